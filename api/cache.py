@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ResponseCache:
+    """
+    Ограниченный по объёму LRU кеш тел ответов API в памяти процесса.
+    Если задан settings.API_RESPONSE_CACHE_ALIAS, вторым уровнем используется кеш Django.
+    Ключи включают номер загрузки публикаций (core.utils.get_cached_generation), поэтому
+    после load_publication старые записи больше не запрашиваются и вытесняются
+    """
+
+    def __init__(self, max_bytes, alias=None):
+        self.max_bytes = max_bytes
+        self.alias = alias
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.second_hits = 0
+
+    def make_key(self, key):
+        return 'api:' + ':'.join(str(part) for part in key)
+
+    def get(self, key):
+        """
+        Метод, возвращающий закешированное тело ответа
+        :param tuple key: Ключ
+        :return: тело ответа или None
+        :rtype: bytes
+        """
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        if self.alias:
+            value = caches[self.alias].get(self.make_key(key))
+            if value is not None:
+                self.second_hits += 1
+                self.set(key, value, second=False)
+        return value
+
+    def set(self, key, value, second=True):
+        """
+        Метод, сохраняющий тело ответа в кеш и вытесняющий самые старые записи при превышении объёма
+        :param tuple key: Ключ
+        :param bytes value: Тело ответа
+        :param bool second: Сохранить также в кеш второго уровня
+        """
+        if second and self.alias:
+            caches[self.alias].set(self.make_key(key), value)
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Метод, возвращающий счётчики кеша для мониторинга
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'second_level_hits': self.second_hits,
+                'evictions': self.evictions,
+                'items': len(self.items),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+response_cache = ResponseCache(
+    getattr(settings, 'API_RESPONSE_CACHE_BYTES', 64 * 1024 * 1024),
+    getattr(settings, 'API_RESPONSE_CACHE_ALIAS', None)
+)
+
@@ -0,0 +1,31 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.media import brotli, precompress_tree
+
+
+class Command(BaseCommand):
+    help = 'Создаёт сжатые варианты (.gz, .br) статических файлов для отдачи без сжатия на лету. ' \
+           'Запускается после collectstatic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='папки, по умолчанию STATIC_ROOT или STATICFILES_DIRS и static/')
+        parser.add_argument('--min-size', type=int, default=1024, help='минимальный размер сжимаемого файла')
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        if not paths:
+            static_root = getattr(settings, 'STATIC_ROOT', None)
+            paths = [static_root] if static_root else \
+                list(getattr(settings, 'STATICFILES_DIRS', [])) + [os.path.join(settings.BASE_DIR, 'static')]
+        if brotli is None:
+            self.stdout.write('brotli is not installed, only gzip variants are created')
+        for path in paths:
+            if isinstance(path, (list, tuple)):
+                path = path[1]
+            if not os.path.isdir(path):
+                continue
+            seen, created = precompress_tree(path, options['min_size'])
+            self.stdout.write('%s: %d files, %d compressed variants created' % (path, seen, created))
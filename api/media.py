@@ -0,0 +1,257 @@
+import gzip
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from core.images import get_manifest_path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Кодировки в порядке предпочтения и расширения файлов с заранее сжатыми вариантами
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# Пути, имя которых содержит хеш содержимого (хранилище медиа-файлов и производные изображения),
+# не меняются и кешируются клиентами навсегда
+HASHED_PATH_RE = re.compile(r'^(store|derived)/[0-9a-f]{2}/[0-9a-f]{40}')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def compress(data, encoding):
+    """
+    Функция, сжимающая данные
+    :param bytes data: Данные
+    :param str encoding: 'br' или 'gzip'
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+def get_accepted_encodings(request):
+    """
+    Функция, возвращающая поддерживаемые клиентом кодировки из ENCODINGS в порядке предпочтения
+    :param HttpRequest request: Запрос
+    :rtype: list
+    """
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return [(encoding, extension) for encoding, extension in ENCODINGS
+            if encoding in accepted and (encoding != 'br' or brotli is not None)]
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def get_etag(path, file_stat):
+    """
+    Функция, возвращающая сильный ETag файла: хеш из имени для путей хранилища,
+    иначе размер и время изменения в наносекундах
+    """
+    match = HASHED_PATH_RE.match(path)
+    if match:
+        return '"%s"' % path.replace('/', '-')
+    return '"%x-%x"' % (file_stat.st_size, file_stat.st_mtime_ns)
+
+
+def get_range(request, size):
+    """
+    Функция, разбирающая заголовок Range с одним диапазоном байт
+    :return: начало и конец диапазона включительно, None - отдавать файл целиком,
+        False - диапазон не может быть выполнен
+    :rtype: tuple
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if not length:
+            return False
+        start, end = max(size - length, 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def precompress_file(path, min_size=1024):
+    """
+    Функция, создающая рядом с файлом сжатые варианты (.br при установленном brotli, .gz)
+    для отдачи serve_media или веб-сервером (gzip_static, brotli_static в nginx).
+    Существующие варианты новее файла не пересоздаются, варианты не меньше исходника не сохраняются
+    :param str path: Путь к файлу
+    :param int min_size: Минимальный размер сжимаемого файла
+    :return: количество созданных файлов
+    :rtype: int
+    """
+    source_stat = os.stat(path)
+    if source_stat.st_size < min_size:
+        return 0
+    created = 0
+    data = None
+    for encoding, extension in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        target = path + extension
+        try:
+            if os.stat(target).st_mtime >= source_stat.st_mtime:
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, 'rb') as file:
+                data = file.read()
+        compressed = compress(data, encoding)
+        if len(compressed) >= len(data):
+            continue
+        tmp_path = '%s.%d.tmp' % (target, os.getpid())
+        with open(tmp_path, 'wb') as file:
+            file.write(compressed)
+        os.replace(tmp_path, target)
+        created += 1
+    return created
+
+
+def precompress_tree(root, min_size=1024):
+    """
+    Функция, создающая сжатые варианты всех сжимаемых файлов (js, css, json, svg и т.п.) в папке
+    :param str root: Папка
+    :param int min_size: Минимальный размер сжимаемого файла
+    :return: количество просмотренных и созданных файлов
+    :rtype: int, int
+    """
+    seen = created = 0
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in file_names:
+            content_type, encoding = mimetypes.guess_type(name)
+            if encoding is not None or not is_compressible(content_type or ''):
+                continue
+            seen += 1
+            created += precompress_file(os.path.join(dir_path, name), min_size)
+    return seen, created
+
+
+def iter_file_range(file, start, length):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Представление для отдачи медиа-файлов в рабочем режиме:
+    - сильный ETag и Last-Modified, ответы 304;
+    - неизменяемый долгий кеш для путей с хешем содержимого (см. HASHED_PATH_RE);
+    - заранее сжатые варианты файла (.br, .gz) по заголовку Accept-Encoding;
+    - диапазоны байт (Range) для несжатых файлов;
+    - при settings.MEDIA_SENDFILE передача файла веб-серверу через X-Sendfile или X-Accel-Redirect.
+    Без sendfile файл отдаётся через FileResponse, который использует wsgi.file_wrapper сервера.
+    Служебные манифесты публикаций не отдаются
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    manifests_path = os.path.abspath(os.path.dirname(get_manifest_path('')))
+    if os.path.commonpath([manifests_path, full_path]) == manifests_path:
+        raise Http404('Файл не найден')
+    try:
+        file_stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Файл не найден')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('Файл не найден')
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    serve_path = full_path
+    content_encoding = None
+    if is_compressible(content_type) and encoding is None:
+        for accepted, extension in get_accepted_encodings(request):
+            try:
+                variant_stat = os.stat(full_path + extension)
+            except FileNotFoundError:
+                continue
+            if variant_stat.st_mtime >= file_stat.st_mtime:
+                serve_path = full_path + extension
+                content_encoding = accepted
+                file_stat = variant_stat
+                break
+
+    etag = get_etag(path, file_stat)
+    if content_encoding:
+        etag = etag[:-1] + '-' + content_encoding + '"'
+    if HASHED_PATH_RE.match(path):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=%d' % getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        response = HttpResponseNotModified()
+    else:
+        sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+        byte_range = None if content_encoding else get_range(request, file_stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % file_stat.st_size
+        elif sendfile == 'x-accel-redirect':
+            # nginx сам обрабатывает Range, If-None-Match и отдаёт файл из internal location
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/') + \
+                os.path.relpath(serve_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        elif sendfile == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = serve_path
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_file_range(open(serve_path, 'rb'), start, end - start + 1),
+                status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, file_stat.st_size)
+            response['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(open(serve_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = file_stat.st_size
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        response['Accept-Ranges'] = 'bytes' if not content_encoding else 'none'
+        response['Last-Modified'] = http_date(file_stat.st_mtime)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    if is_compressible(content_type):
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,221 @@
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+from api.cache import response_cache
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин, память не зависит от количества наблюдений
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """
+        Метод, возвращающий накопленные значения корзин в формате Prometheus
+        :return: пары (граница корзины, количество наблюдений не больше границы)
+        :rtype: list
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((repr(float(bound)), total))
+        result.append(('+Inf', self.count))
+        return result
+
+
+class RouteMetrics:
+    """
+    Метрики одного маршрута и HTTP метода
+    """
+
+    def __init__(self):
+        self.latency = Histogram(getattr(settings, 'API_METRICS_LATENCY_BUCKETS', LATENCY_BUCKETS))
+        self.size = Histogram(SIZE_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов, накопленные в памяти процесса. Метки - имя маршрута (view_name),
+    а не путь запроса, и метод из ограниченного списка, поэтому количество серий
+    ограничено количеством маршрутов. При нескольких процессах сервера каждый процесс
+    отдаёт свои значения
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, method, status, duration, size, queries, db_time):
+        with self.lock:
+            metrics = self.routes.get((route, method))
+            if metrics is None:
+                metrics = self.routes[(route, method)] = RouteMetrics()
+            metrics.latency.observe(duration)
+            if size is not None:
+                metrics.size.observe(size)
+            metrics.queries.observe(queries)
+            metrics.db_time.observe(db_time)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        """
+        Метод, формирующий метрики в текстовом формате Prometheus
+        :rtype: str
+        """
+        lines = []
+        histograms = (
+            ('tgws_http_request_duration_seconds', 'Request latency', 'latency'),
+            ('tgws_http_response_size_bytes', 'Response body size', 'size'),
+            ('tgws_http_db_queries', 'DB queries per request', 'queries'),
+            ('tgws_http_db_duration_seconds', 'DB time per request', 'db_time'),
+        )
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for name, help_text, attr in histograms:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for (route, method), metrics in routes:
+                    histogram = getattr(metrics, attr)
+                    labels = 'view="%s",method="%s"' % (escape_label(route), method)
+                    for bound, count in histogram.samples():
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                    lines.append('%s_sum{%s} %r' % (name, labels, float(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+            lines.append('# HELP tgws_http_requests_total Requests by response status')
+            lines.append('# TYPE tgws_http_requests_total counter')
+            for (route, method), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append('tgws_http_requests_total{view="%s",method="%s",status="%d"} %d' % (
+                        escape_label(route), method, status, count))
+
+        cache = response_cache.stats()
+        for key, metric_type, help_text in (
+                ('hits', 'counter', 'Response cache hits'),
+                ('misses', 'counter', 'Response cache misses'),
+                ('second_level_hits', 'counter', 'Response cache second level hits'),
+                ('evictions', 'counter', 'Response cache evictions'),
+                ('items', 'gauge', 'Response cache entries'),
+                ('bytes', 'gauge', 'Response cache size'),
+                ('max_bytes', 'gauge', 'Response cache size limit')):
+            name = 'tgws_api_response_cache_%s%s' % (key, '_total' if metric_type == 'counter' else '')
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.append('%s %d' % (name, cache[key]))
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter:
+    """
+    Счётчик количества и времени запросов к базе в рамках одного HTTP запроса
+    """
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Middleware, собирающая для каждого маршрута гистограммы времени ответа, размера ответа,
+    количества и времени запросов к базе. Включается settings.API_METRICS_ENABLED
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'API_METRICS_ENABLED', True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None else 'unmatched'
+        if route == 'metrics':
+            return response
+        method = request.method if request.method in METHODS else 'OTHER'
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        registry.observe(route, method, response.status_code, duration, size, counter.count, counter.time)
+        return response
+
+
+def is_metrics_allowed(request):
+    """
+    Функция, проверяющая доступ к метрикам: администраторам и адресам из settings.API_METRICS_ALLOWED_IPS
+    (адреса и сети). Адрес берётся из REMOTE_ADDR, поэтому за прокси-сервером доступ к /metrics
+    ограничивается на самом прокси
+    :param HttpRequest request: Запрос
+    :rtype: bool
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in getattr(settings, 'API_METRICS_ALLOWED_IPS', ()))
+
+
+def metrics(request):
+    if not is_metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
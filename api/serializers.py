@@ -1,3 +1,5 @@
+import json
+
 from rest_framework import serializers
 from core.models import Publication, Module
 
@@ -12,4 +14,25 @@ class ModuleSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Module
-        fields = ('id', 'tech_name', 'title', 'issue_number', 'content_json', 'is_category')
\ No newline at end of file
+        fields = ('id', 'tech_name', 'title', 'issue_number', 'content_json', 'is_category')
+
+
+def splice_json(row, fields, json_fields):
+    """
+    Функция, собирающая тело JSON ответа, в которое уже сериализованные поля
+    вставляются как есть, в виде вложенных объектов, без повторного разбора и кодирования
+    :param dict row: Значения полей
+    :param tuple fields: Порядок полей в ответе
+    :param tuple json_fields: Поля, содержащие готовые JSON строки
+    :return: тело ответа
+    :rtype: bytes
+    """
+    parts = []
+    for field in fields:
+        if field in json_fields:
+            value = row[field] or 'null'
+        else:
+            value = json.dumps(row[field], ensure_ascii=False)
+        parts.append('%s:%s' % (json.dumps(field), value))
+    return ('{%s}' % ','.join(parts)).encode('utf-8')
+
@@ -1,3 +1,703 @@
-from django.test import TestCase
+import gzip
+import importlib
+import io
+import json
+import os
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import include, path
+
+from django.utils.http import http_date
+
+from core.models import Module, Publication, PublicationModule
+from api import urls as api_urls
+from api.cache import ResponseCache, response_cache
+from api.media import precompress_file
+from api.metrics import Histogram, registry
+from api.serializers import splice_json
+from core.instrumentation import ImportSummary
+from core.jobs import enqueue_import
+from core.tests import CODE, OTHER_CODE, MediaTestCase, write_publication
+from core import utils
+from core.utils import delete_publication, get_publication_media_path, load_publication
+
+
+# URL-конфигурация с отдачей медиа-файлов независимо от settings.MEDIA_SERVE, см. MediaServeTests
+urlpatterns = [
+    path('api/', include(api_urls.urlpatterns + api_urls.media_urlpatterns)),
+]
+
+
+class ApiTestCase(MediaTestCase):
+    """
+    Тест API с пустым кешем ответов: идентификаторы записей и номера загрузок повторяются между тестами
+    """
+
+    def setUp(self):
+        super().setUp()
+        response_cache.clear()
+        utils.generation_cache[1] = 0
+
+    def login_admin(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+
+class LazyModuleDetailTests(ApiTestCase):
+    """
+    Выдача модуля, содержание которого формируется при первом запросе
+    """
+
+    @override_settings(LAZY_MODULE_CONTENT=True)
+    def test_content_is_rendered_on_first_request(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 2')
+        self.assertEqual(module.content_json, '')
+
+        response = self.client.get('/api/module_detail/%d/' % module.pk)
+
+        self.assertEqual(response.status_code, 200)
+        content_json = json.loads(response.content.decode('utf-8'))['content_json']
+        self.assertIn('PN-002', content_json)
+        self.assertEqual(Module.objects.get(pk=module.pk).content_json, content_json)
+
+
+class ConditionalRequestTests(ApiTestCase):
+    """
+    Заголовки ETag, Last-Modified и Cache-Control детальных представлений
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+        load_publication(self.path)
+        self.url = '/api/publication_detail/%s/' % CODE
+
+    def test_publication_etag(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertIn('max-age=', cached['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_publication_last_modified(self):
+        response = self.client.get(self.url)
+        updated_at = Publication.objects.get(code=CODE).updated_at
+
+        self.assertEqual(response['Last-Modified'], http_date(updated_at.timestamp()))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        earlier = http_date(updated_at.timestamp() - 3600)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=earlier).status_code, 200)
+
+    def test_module_etag_changes_with_module(self):
+        module = Module.objects.get(tech_name='Модуль 1')
+        url = '/api/module_detail/%d/' % module.pk
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        module.content_hash = 'changed'
+        module.save()
+
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_unknown_objects(self):
+        for url in ('/api/module_detail/999999/', '/api/module_detail/abc/', '/api/publication_detail/UNKNOWN/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', json.loads(response.content.decode('utf-8')))
+            self.assertFalse(response.has_header('ETag'))
+
+
+class NestedJsonTests(ApiTestCase):
+    """
+    Вставка сохранённых structure_json и content_json в ответ вложенными объектами (?nested=1)
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+        load_publication(self.path)
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_splice_json(self):
+        body = splice_json({'id': 1, 'title': 'Модуль "1"', 'content_json': '{"a": [1]}', 'empty': ''},
+                           ('id', 'title', 'content_json', 'empty'), ('content_json', 'empty'))
+
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'id': 1, 'title': 'Модуль "1"', 'content_json': {'a': [1]}, 'empty': None})
+
+    def test_nested_publication(self):
+        url = '/api/publication_detail/%s/' % CODE
+        flat = self.get_json(url)
+
+        nested = self.get_json(url + '?nested=1')
+
+        self.assertEqual(nested['structure_json'], json.loads(flat['structure_json']))
+        nested.pop('structure_json'), flat.pop('structure_json')
+        self.assertEqual(nested, flat)
+        self.assertIsInstance(self.get_json(url + '?nested=0')['structure_json'], str)
+        with override_settings(API_NESTED_JSON=True):
+            self.assertIsInstance(self.get_json(url)['structure_json'], dict)
+
+    def test_nested_module(self):
+        url = '/api/module_detail/%d/' % Module.objects.get(tech_name='Модуль 3').pk
+        flat = self.get_json(url)
+
+        nested = self.get_json(url + '?nested=1')
+
+        self.assertEqual(nested['content_json'], json.loads(flat['content_json']))
+        self.assertEqual(nested['id'], flat['id'])
+        self.assertEqual(nested['title'], 'Модуль 3')
+        category = self.get_json('/api/module_detail/%d/?nested=1' % Module.objects.get(title='Раздел 1').pk)
+        self.assertIsNone(category['content_json'])
+
+    @override_settings(LAZY_MODULE_CONTENT=True)
+    def test_nested_module_renders_lazy_content(self):
+        self.reset()
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 5')
+
+        nested = self.get_json('/api/module_detail/%d/?nested=1' % module.pk)
+
+        self.assertEqual(nested['content_json'], json.loads(Module.objects.get(pk=module.pk).content_json))
+
+
+class ResponseCacheTests(ApiTestCase):
+    """
+    Кеш тел ответов API
+    """
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(10)
+        cache.set(('a',), b'1234')
+        cache.set(('b',), b'1234')
+        self.assertEqual(cache.get(('a',)), b'1234')
+
+        cache.set(('c',), b'1234')
+
+        self.assertIsNone(cache.get(('b',)))
+        self.assertEqual(cache.get(('a',)), b'1234')
+        cache.set(('big',), b'x' * 11)
+        self.assertIsNone(cache.get(('big',)))
+        stats = cache.stats()
+        self.assertEqual((stats['items'], stats['bytes'], stats['evictions']), (2, 8, 1))
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_second_level(self):
+        cache = ResponseCache(10, 'default')
+        cache.set(('a',), b'1234')
+        cache.clear()
+
+        self.assertEqual(cache.get(('a',)), b'1234')
+        self.assertEqual(cache.stats()['second_level_hits'], 1)
+        self.assertEqual(cache.stats()['items'], 1)
+
+    def test_generation_invalidates_cached_bodies(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 1')
+        url = '/api/module_detail/%d/' % module.pk
+        body = self.client.get(url).content
+        Module.objects.filter(pk=module.pk).update(content_json='{"changed": true}')
+
+        self.assertEqual(self.client.get(url).content, body)
+        hits = response_cache.stats()['hits']
+        self.assertGreaterEqual(hits, 1)
+
+        write_publication(self.path + '-other', model='OTHER')
+        load_publication(self.path + '-other')
+
+        self.assertIn('changed', json.loads(self.client.get(url).content.decode('utf-8'))['content_json'])
+        self.assertEqual(response_cache.stats()['hits'], hits)
+
+    def test_generation_read_once_per_ttl(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        url = '/api/module_detail/%d/' % Module.objects.get(tech_name='Модуль 1').pk
+
+        with mock.patch('core.utils.get_generation', wraps=utils.get_generation) as get_generation:
+            with override_settings(API_GENERATION_TTL=60):
+                for _ in range(3):
+                    self.client.get(url)
+                self.assertEqual(get_generation.call_count, 1)
+                # Загрузка в другом процессе видна только после истечения срока
+                Publication.objects.filter(code=CODE).update(generation=100)
+                self.assertNotEqual(utils.get_cached_generation(), 100)
+                with mock.patch('core.utils.time.monotonic', return_value=utils.generation_cache[1]):
+                    self.assertEqual(utils.get_cached_generation(), 100)
+                self.assertEqual(get_generation.call_count, 2)
+
+    def test_cache_stats(self):
+        self.assertEqual(self.client.get('/api/cache_stats/').status_code, 403)
+        self.login_admin()
+
+        response = self.client.get('/api/cache_stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('evictions', json.loads(response.content.decode('utf-8')))
+
+
+class ModuleBatchTests(ApiTestCase):
+    """
+    Пакетная выдача модулей module_batch
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+        load_publication(self.path)
+
+    def get_batch(self, query):
+        response = self.client.get('/api/module_batch/?' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_batch_by_ids(self):
+        ids = list(Module.objects.filter(is_category=False).order_by('-id').values_list('id', flat=True)[:3])
+
+        data = self.get_batch('ids=%d,999999,%d,%d' % (ids[0], ids[1], ids[2]))
+
+        self.assertEqual([module['id'] for module in data['modules']], ids)
+        self.assertEqual(data['missing'], [999999])
+        for module in data['modules']:
+            self.assertEqual(module['content_json'], Module.objects.get(pk=module['id']).content_json)
+
+    def test_batch_by_parent(self):
+        top = self.get_batch('publication=%s' % CODE)['modules']
+        self.assertEqual([module['title'] for module in top], ['Раздел 1', 'Раздел 2'])
+        self.assertEqual(self.get_batch('publication=%s&parent=%%23' % CODE)['modules'], top)
+
+        children = self.get_batch('publication=%s&parent=%d' % (CODE, top[0]['id']))['modules']
+
+        self.assertEqual(sorted(module['title'] for module in children), ['Модуль 1', 'Модуль 2', 'Подраздел 1.1'])
+        self.assertTrue(all(module['content_json'] for module in children if not module['is_category']))
+
+    def test_batch_by_parent_with_shared_modules(self):
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, tree=['Модуль 4', ('Раздел 3', ['Модуль 1'])], model='OTHER')
+        load_publication(other_path)
+        self.assertEqual(PublicationModule.objects.filter(module__tech_name='Модуль 4').count(), 2)
+
+        # Модуль 4 - узел верхнего уровня только во второй публикации
+        top = self.get_batch('publication=%s' % CODE)['modules']
+        self.assertEqual([module['title'] for module in top], ['Раздел 1', 'Раздел 2'])
+        other_top = self.get_batch('publication=%s' % OTHER_CODE)['modules']
+        self.assertEqual(sorted(module['title'] for module in other_top), ['Модуль 4', 'Раздел 3'])
+        section = Module.objects.get(title='Раздел 2')
+        self.assertEqual(self.get_batch('publication=%s&parent=%d' % (OTHER_CODE, section.pk))['modules'], [])
+
+    def test_nested_batch(self):
+        module = Module.objects.get(tech_name='Модуль 4')
+
+        data = self.get_batch('ids=%d,999999&nested=1' % module.pk)
+
+        self.assertEqual(data['modules'][0]['content_json'], json.loads(module.content_json))
+        self.assertEqual(data['missing'], [999999])
+
+    @override_settings(API_MODULE_BATCH_SIZE=2)
+    def test_batch_size_limit(self):
+        response = self.client.get('/api/module_batch/?ids=1,2,3')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.content.decode('utf-8')))
+        parent = Module.objects.get(title='Раздел 1').pk
+        self.assertEqual(self.client.get('/api/module_batch/?publication=%s&parent=%d' % (CODE, parent)).status_code, 400)
+        self.assertEqual(self.client.get('/api/module_batch/').status_code, 400)
+
+
+class PublicationChildrenTests(ApiTestCase):
+    """
+    Ленивая загрузка узлов дерева публикации publication_children
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+        load_publication(self.path)
+        self.url = '/api/publication_children/%s/' % CODE
+
+    def get_children(self, query=''):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_children(self):
+        top = self.get_children()
+        self.assertEqual([(node['text'], node['children']) for node in top], [('Раздел 1', True), ('Раздел 2', True)])
+        self.assertEqual(self.get_children('?id=%23'), top)
+
+        children = self.get_children('?id=%d' % top[0]['id'])
+
+        self.assertEqual(sorted((node['text'], node['children']) for node in children),
+                         [('Модуль 1', False), ('Модуль 2', False), ('Подраздел 1.1', True)])
+        self.assertEqual(self.get_children('?id=999999'), [])
+
+    def test_shares_publication_etag(self):
+        etag = self.client.get('/api/publication_detail/%s/' % CODE)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.url + '?id=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/publication_children/UNKNOWN/').status_code, 400)
+
+
+class MetricsTests(ApiTestCase):
+    """
+    Метрики запросов и их выдача в формате Prometheus (/metrics)
+    """
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_histogram(self):
+        histogram = Histogram((1, 5))
+        for value in (0, 1, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.samples(), [('1.0', 2), ('5.0', 3), ('+Inf', 4)])
+        self.assertEqual((histogram.sum, histogram.count), (14, 4))
+
+    @override_settings(API_METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        url = '/api/publication_detail/%s/' % CODE
+        hits = response_cache.stats()['hits']
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get('/api/publication_detail/UNKNOWN/')
+        self.client.get('/no/such/page/')
+        self.client.generic('BREW', url)
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertIn('tgws_http_request_duration_seconds_count{view="pub_tree",method="GET"} 3', lines)
+        self.assertIn('tgws_http_requests_total{view="pub_tree",method="GET",status="200"} 2', lines)
+        self.assertIn('tgws_http_requests_total{view="pub_tree",method="GET",status="400"} 1', lines)
+        self.assertIn('tgws_http_requests_total{view="unmatched",method="GET",status="404"} 1', lines)
+        self.assertIn('tgws_http_requests_total{view="pub_tree",method="OTHER",status="405"} 1', lines)
+        self.assertIn('tgws_api_response_cache_hits_total %d' % (hits + 1), lines)
+        self.assertFalse([line for line in lines if 'view="metrics"' in line])
+        queries = [line for line in lines if line.startswith('tgws_http_db_queries_sum{view="pub_tree",method="GET"}')]
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+
+    @override_settings(API_METRICS_ENABLED=False, API_METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_disabled(self):
+        self.client.get('/api/cache_stats/')
+
+        self.assertNotIn('cache_stats', self.client.get('/metrics').content.decode('utf-8'))
+
+    @override_settings(API_METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='unknown').status_code, 403)
+        self.login_admin()
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class SearchApiTests(ApiTestCase):
+    """
+    Поиск модулей через API
+    """
+
+    def test_search(self):
+        write_publication(self.path)
+        load_publication(self.path)
+
+        data = json.loads(self.client.get('/api/search/?q=модуль&page=2&page_size=2').content.decode('utf-8'))
+
+        self.assertEqual((data['query'], data['total'], data['page'], data['page_size']), ('модуль', 5, 2, 2))
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'tech_name', 'score'})
+        data = json.loads(self.client.get('/api/search/?q=pn-003&publication=%s' % CODE).content.decode('utf-8'))
+        self.assertEqual([result['title'] for result in data['results']], ['Модуль 3'])
+        self.assertEqual(self.client.get('/api/search/?q=').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=pn&page=x').status_code, 400)
+
+
+class PartLookupApiTests(ApiTestCase):
+    """
+    Поиск деталей через API
+    """
+
+    def test_part_lookup(self):
+        write_publication(self.path)
+        load_publication(self.path)
+
+        data = json.loads(self.client.get('/api/parts/?part_number=pn-00&prefix=1').content.decode('utf-8'))
+        self.assertFalse(data['truncated'])
+        self.assertEqual([part['module_title'] for part in data['parts']], ['Модуль %d' % i for i in range(1, 6)])
+        with override_settings(API_PART_LOOKUP_LIMIT=2):
+            data = json.loads(self.client.get('/api/parts/?part_number=pn&prefix=1').content.decode('utf-8'))
+        self.assertEqual((len(data['parts']), data['truncated']), (2, True))
+        data = json.loads(self.client.get('/api/parts/?manufacturer=K0003').content.decode('utf-8'))
+        self.assertEqual([part['publications'] for part in data['parts']], [[CODE]])
+        self.assertEqual(self.client.get('/api/parts/').status_code, 400)
+
+
+@override_settings(ROOT_URLCONF='api.tests')
+class MediaServeTests(ApiTestCase):
+    """
+    Отдача медиа-файлов serve_media
+    """
+
+    def write_media(self, name, content):
+        file_path = os.path.join(self.base, 'media', name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as file:
+            file.write(content)
+        return file_path
+
+    def get_content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_etag_and_not_modified(self):
+        self.write_media('pub_files/ICN-1.png', b'0123456789')
+
+        response = self.client.get('/api/media/pub_files/ICN-1.png')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_content(response), b'0123456789')
+        self.assertEqual((response['Content-Type'], response['Content-Length']), ('image/png', '10'))
+        self.assertFalse(response['ETag'].startswith('W/'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        cached = self.client.get('/api/media/pub_files/ICN-1.png', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_hashed_paths_are_immutable(self):
+        content_hash = 'ab' + '0' * 38
+        self.write_media('store/ab/%s.png' % content_hash, b'0123456789')
+
+        response = self.client.get('/api/media/store/ab/%s.png' % content_hash)
+
+        self.assertEqual(response['ETag'], '"store-ab-%s.png"' % content_hash)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_media_serve_setting(self):
+        self.addCleanup(importlib.reload, api_urls)
+        for media_serve in (False, True):
+            with override_settings(MEDIA_SERVE=media_serve):
+                importlib.reload(api_urls)
+            self.assertEqual('media' in [pattern.name for pattern in api_urls.urlpatterns], media_serve)
+
+    @override_settings(MEDIA_MANIFESTS_ROOT=None)
+    def test_manifests_are_not_served(self):
+        self.write_media('derived/manifests/CODE.media.json', b'{}')
+
+        self.assertEqual(self.client.get('/api/media/derived/manifests/CODE.media.json').status_code, 404)
+        self.assertEqual(self.client.get('/api/media/derived/../derived/manifests/CODE.media.json').status_code, 404)
+
+    def test_ranges(self):
+        self.write_media('pub_files/ICN-1.png', b'0123456789')
+        url = '/api/media/pub_files/ICN-1.png'
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_content(response), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual((response.status_code, self.get_content(response)), (206, b'789'))
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # несколько диапазонов не поддерживаются, файл отдаётся целиком
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1,3-4').status_code, 200)
+
+    def test_precompressed_variant(self):
+        content = json.dumps(list(range(500))).encode('utf-8')
+        file_path = self.write_media('data/list.json', content)
+        self.assertEqual(precompress_file(file_path, min_size=0), 1)
+
+        response = self.client.get('/api/media/data/list.json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(self.get_content(response)), content)
+        response = self.client.get('/api/media/data/list.json', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.get_content(response), content)
+
+    def test_missing_files_and_methods(self):
+        self.write_media('pub_files/ICN-1.png', b'0123456789')
+
+        for url in ('/api/media/pub_files/ICN-2.png', '/api/media/pub_files/', '/api/media/../settings.py'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post('/api/media/pub_files/ICN-1.png').status_code, 405)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect(self):
+        self.write_media('pub_files/ICN-1.png', b'0123456789')
+
+        response = self.client.get('/api/media/pub_files/ICN-1.png')
+
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/pub_files/ICN-1.png')
+        self.assertEqual(response.content, b'')
+
+    def test_precompress_static(self):
+        self.write_media('static/app.js', b'var a = 1;\n' * 200)
+        self.write_media('static/logo.png', b'0' * 2000)
+        out = io.StringIO()
+
+        call_command('precompress_static', os.path.join(self.base, 'media', 'static'), stdout=out)
+
+        self.assertTrue(os.path.exists(os.path.join(self.base, 'media', 'static', 'app.js.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.base, 'media', 'static', 'logo.png.gz')))
+        self.assertIn('1 files', out.getvalue())
+
+
+@override_settings(API_COMPRESS_MIN_SIZE=0)
+class CompressedJsonTests(ApiTestCase):
+    """
+    Сжатие JSON ответов API с хранением сжатых тел в кеше ответов
+    """
+
+    def test_compressed_publication_detail(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        url = '/api/publication_detail/%s/' % CODE
+        plain = self.client.get(url)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'][:-1] + '-gzip"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        cached = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    @override_settings(API_COMPRESS_MIN_SIZE=1024 * 1024)
+    def test_small_bodies_are_not_compressed(self):
+        write_publication(self.path)
+        load_publication(self.path)
+
+        response = self.client.get('/api/publication_detail/%s/' % CODE, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ImportJobApiTests(ApiTestCase):
+    """
+    Состояние и отмена заданий загрузки через API доступны только администраторам
+    """
+
+    def test_anonymous_access_is_denied(self):
+        job = enqueue_import(self.path)
+
+        for url in ('/api/import_jobs/', '/api/import_jobs/%d/' % job.pk):
+            self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.post('/api/import_jobs/%d/cancel/' % job.pk).status_code, 403)
+
+    def test_job_status(self):
+        job = enqueue_import(self.path)
+        self.login_admin()
+
+        data = json.loads(self.client.get('/api/import_jobs/').content.decode('utf-8'))
+        self.assertEqual([item['id'] for item in data['jobs']], [job.pk])
+        data = json.loads(self.client.get('/api/import_jobs/%d/' % job.pk).content.decode('utf-8'))
+        self.assertEqual((data['status'], data['path'], data['progress']), ('queued', self.path, 0.0))
+        self.assertEqual(self.client.get('/api/import_jobs/999999/').status_code, 400)
+
+    def test_cancel(self):
+        job = enqueue_import(self.path)
+        self.login_admin()
+
+        data = json.loads(self.client.post('/api/import_jobs/%d/cancel/' % job.pk).content.decode('utf-8'))
+
+        self.assertEqual(data['status'], 'cancelled')
+
+
+class PublishApiTests(ApiTestCase):
+    """
+    Ответы API во время загрузки новой версии публикации
+    """
+
+    def test_previous_version_is_served_during_import(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        url = '/api/publication_detail/%s/' % CODE
+        before = self.client.get(url)
+        self.edit_file(self.get_dmc_path(1), 'PN-001', 'PN-STAGED')
+        served = []
+
+        def listener(summary, name, span):
+            if name == 'publish' and span is None:
+                response = self.client.get(url)
+                self.assertEqual(response['ETag'], before['ETag'])
+                self.assertEqual(response.content, before.content)
+                served.append(name)
+
+        load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertEqual(served, ['publish'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['structure_json'],
+                         Publication.objects.get(code=CODE).structure_json)
+
+    def test_staging_versions_are_not_served(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        responses = {}
+
+        def listener(summary, name, span):
+            if name == 'publish' and span is None:
+                code = Publication.objects.get(staging=True).code
+                responses['detail'] = self.client.get('/api/publication_detail/%s/' % code)
+                responses['children'] = self.client.get('/api/publication_children/%s/' % code)
+                responses['batch'] = self.client.get('/api/module_batch/', {'publication': code})
+
+        load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertEqual(responses['detail'].status_code, 400)
+        self.assertEqual(responses['children'].status_code, 400)
+        self.assertEqual(json.loads(responses['batch'].content.decode('utf-8'))['modules'], [])
+        self.assertEqual(self.client.get('/api/publication_detail/%s/' % CODE).status_code, 200)
+
+    def test_module_detail_after_shared_content_reset(self):
+        write_publication(self.path)
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER')
+        load_publication(self.path)
+        load_publication(other_path)
+        module = Module.objects.get(tech_name='Модуль 1')
+        # содержание, сформированное до перехода на пути в хранилище
+        legacy = json.dumps({'src': os.path.join(get_publication_media_path(CODE), 'ICN.png')})
+        Module.objects.filter(pk=module.pk).update(content_json=legacy)
+        url = '/api/module_detail/%d/' % module.pk
+        before = self.client.get(url)
+        self.assertIn('ICN.png', json.loads(before.content.decode('utf-8'))['content_json'])
+
+        delete_publication(CODE)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], before['ETag'])
+        content_json = json.loads(response.content.decode('utf-8'))['content_json']
+        self.assertNotIn('ICN.png', content_json)
+        self.assertEqual(content_json, Module.objects.get(pk=module.pk).content_json)
@@ -1,13 +1,30 @@
-from django.urls import path, include
-from api.views import publication_detail, module_detail
-from django.conf.urls.static import static
+import re
+
+from django.urls import path, include, re_path
+from api.media import serve_media
+from api.views import publication_detail, publication_children, module_detail, module_batch, search, part_lookup, cache_stats, \
+    import_jobs, import_job_detail, import_job_cancel
 from django.conf import settings
 
 
 urlpatterns = [
     path('publication_detail/<str:pubcode>/', publication_detail, name='pub_tree'),
+    path('publication_children/<str:pubcode>/', publication_children, name='pub_children'),
     path('module_detail/<str:module_id>/', module_detail, name='module_detail'),
+    path('module_batch/', module_batch, name='module_batch'),
+    path('search/', search, name='search'),
+    path('parts/', part_lookup, name='part_lookup'),
+    path('import_jobs/', import_jobs, name='import_jobs'),
+    path('import_jobs/<int:job_id>/', import_job_detail, name='import_job_detail'),
+    path('import_jobs/<int:job_id>/cancel/', import_job_cancel, name='import_job_cancel'),
+    path('cache_stats/', cache_stats, name='cache_stats'),
+]
+
+# Отдача медиа-файлов приложением, если их не отдаёт веб-сервер (settings.MEDIA_SERVE)
+media_urlpatterns = [
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if getattr(settings, 'MEDIA_SERVE', False):
+    urlpatterns += media_urlpatterns
 
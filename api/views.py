@@ -1,37 +1,407 @@
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import permissions
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
 
-from core.models import Publication, Module
-from api.serializers import PublicationSerializer, ModuleSerializer
+from core.jobs import cancel_job, get_job_status
+from core.models import ImportJob, Publication, PublicationModule, Module
+from core.search import find_parts, search_modules
+from core.utils import ensure_module_content, get_cached_generation, get_content_hash, get_tree_children
+from api.cache import response_cache
+from api.media import compress, get_accepted_encodings
+from api.serializers import PublicationSerializer, ModuleSerializer, splice_json
+
+
+def cache_headers(view):
+    """
+    Декоратор, добавляющий заголовок Cache-Control к успешным ответам и ответам 304
+    :param function view: Представление
+    :return: обёрнутое представление
+    :rtype: function
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # сжатые ответы отдаются с ETag вида "<хеш>-<кодировка>", см. json_response;
+        # для сравнения в condition суффикс кодировки убирается
+        match = ENCODED_ETAG_RE.search(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if match:
+            request.META['HTTP_IF_NONE_MATCH'] = ENCODED_ETAG_RE.sub('"', request.META['HTTP_IF_NONE_MATCH'])
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'API_CACHE_MAX_AGE', 60))
+            patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = response.get('Content-Encoding') or (match and response.status_code == 304 and match.group(1))
+        if encoding and response.has_header('ETag'):
+            response['ETag'] = response['ETag'][:-1] + '-' + encoding + '"'
+        return response
+    return wrapper
+
+
+ENCODED_ETAG_RE = re.compile(r'-(br|gzip)"')
+
+
+def json_response(request, key, get_body):
+    """
+    Функция, формирующая ответ с JSON телом из кеша ответов. Тела больше
+    settings.API_COMPRESS_MIN_SIZE сжимаются поддерживаемой клиентом кодировкой (brotli, gzip)
+    один раз и хранятся в кеше рядом с несжатыми, поэтому не сжимаются заново на каждый запрос
+    :param HttpRequest request: Запрос
+    :param tuple key: Ключ кеша ответов, включающий номер загрузки
+    :param function get_body: Функция без параметров, формирующая несжатое тело
+    :rtype: HttpResponse
+    """
+    encodings = get_accepted_encodings(request)
+    encoding = encodings[0][0] if encodings else None
+    body = response_cache.get(key + (encoding,)) if encoding else None
+    if body is None:
+        body = response_cache.get(key)
+        if body is None:
+            body = get_body()
+            response_cache.set(key, body)
+        if encoding and len(body) >= getattr(settings, 'API_COMPRESS_MIN_SIZE', 16 * 1024):
+            body = compress(body, encoding)
+            response_cache.set(key + (encoding,), body)
+        else:
+            encoding = None
+
+    response = HttpResponse(body, content_type='application/json')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def get_publication_validators(request, pubcode):
+    """
+    Функция, возвращающая поля публикации, по которым строятся ETag и Last-Modified,
+    без загрузки structure_json. Результат запоминается на объекте запроса.
+    Загружаемые и заменённые версии публикаций (staging) клиентам не отдаются
+    :param HttpRequest request: Запрос
+    :param str pubcode: Код публикации
+    :return: словарь с полями code, issue_number, content_hash, updated_at, generation или None
+    :rtype: dict
+    """
+    if not hasattr(request, 'publication_validators'):
+        request.publication_validators = Publication.objects.filter(code=pubcode, staging=False)\
+            .values('code', 'issue_number', 'content_hash', 'updated_at', 'generation').first()
+    return request.publication_validators
+
+
+def publication_etag(request, pubcode):
+    row = get_publication_validators(request, pubcode)
+    if row:
+        return get_content_hash(('%(code)s:%(issue_number)s:%(content_hash)s' % row).encode('utf-8'))
+
+
+def publication_last_modified(request, pubcode):
+    row = get_publication_validators(request, pubcode)
+    if row:
+        return row['updated_at']
+
+
+def get_module_validators(request, module_id):
+    """
+    Функция, возвращающая поля модуля, по которым строятся ETag и Last-Modified,
+    без загрузки content_xml и content_json. Результат запоминается на объекте запроса
+    :param HttpRequest request: Запрос
+    :param str module_id: Идентификатор модуля
+    :return: словарь с полями id, content_hash, updated_at или None
+    :rtype: dict
+    """
+    if not hasattr(request, 'module_validators'):
+        try:
+            request.module_validators = Module.objects.filter(pk=int(module_id))\
+                .values('id', 'content_hash', 'updated_at').first()
+        except ValueError:
+            request.module_validators = None
+    return request.module_validators
+
+
+def module_etag(request, module_id):
+    row = get_module_validators(request, module_id)
+    if row:
+        return get_content_hash(('%(id)s:%(content_hash)s:%(updated_at)s' % row).encode('utf-8'))
+
+
+def module_last_modified(request, module_id):
+    row = get_module_validators(request, module_id)
+    if row:
+        return row['updated_at']
+
+
+def is_nested(request):
+    """
+    Функция, определяющая, нужно ли отдавать structure_json и content_json вложенными объектами,
+    а не строками: параметр запроса nested=1 или settings.API_NESTED_JSON
+    :param HttpRequest request: Запрос
+    :rtype: bool
+    """
+    nested = request.GET.get('nested')
+    if nested is None:
+        return getattr(settings, 'API_NESTED_JSON', False)
+    return nested not in ('', '0', 'false')
+
+
+def get_publication_body(pubcode, nested):
+    """
+    Функция, формирующая тело ответа publication_detail
+    :param str pubcode: Код публикации
+    :param bool nested: Отдавать structure_json вложенным объектом, см. is_nested
+    :rtype: bytes
+    :raises Publication.DoesNotExist: публикация не найдена
+    """
+    if not nested:
+        publication = Publication.objects.defer('content_xml').get(code=pubcode, staging=False)
+        return JSONRenderer().render(PublicationSerializer(publication).data)
+
+    fields = PublicationSerializer.Meta.fields
+    row = Publication.objects.filter(code=pubcode, staging=False).values(*fields).first()
+    if row is None:
+        raise Publication.DoesNotExist('Publication matching query does not exist.')
+    return splice_json(row, fields, ('structure_json',))
+
+
+def get_module_body(module_id, nested):
+    """
+    Функция, формирующая тело ответа module_detail
+    :param int module_id: Идентификатор модуля
+    :param bool nested: Отдавать content_json вложенным объектом, см. is_nested
+    :rtype: bytes
+    :raises Module.DoesNotExist: модуль не найден
+    """
+    if not nested:
+        module = Module.objects.defer('content_xml').get(pk=module_id)
+        ensure_module_content(module)
+        return JSONRenderer().render(ModuleSerializer(module).data)
+
+    fields = ModuleSerializer.Meta.fields
+    row = Module.objects.filter(pk=module_id).values(*fields).first()
+    if row is None:
+        raise Module.DoesNotExist('Module matching query does not exist.')
+    if not row['is_category'] and not row['content_json']:
+        row['content_json'] = ensure_module_content(Module.objects.get(pk=row['id']))
+    return splice_json(row, fields, ('content_json',))
+
 
 # Create your views here.
+@cache_headers
+@condition(etag_func=publication_etag, last_modified_func=publication_last_modified)
 @api_view(['GET'])
 @permission_classes((permissions.AllowAny,))
 def publication_detail(request, pubcode):
     data = {}
     try:
-        publication = Publication.objects.get(code=pubcode)
-        serializer = PublicationSerializer(publication)
-        return Response(serializer.data)
+        nested = is_nested(request)
+        validators = get_publication_validators(request, pubcode)
+        key = ('publication', pubcode, nested, validators and validators['generation'])
+        return json_response(request, key, lambda: get_publication_body(pubcode, nested))
     except Exception as err:
-        data = {'error':err}
+        data = {'error': str(err)}
 
     return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
+@cache_headers
+@condition(etag_func=module_etag, last_modified_func=module_last_modified)
 @api_view(['GET'])
 @permission_classes((permissions.AllowAny,))
 def module_detail(request, module_id):
     data = {}
     try:
-        module = Module.objects.get(pk=int(module_id))
-        serializer = ModuleSerializer(module)
-        return Response(serializer.data)
-    except Exception:
-        data = {'error': err}
+        nested = is_nested(request)
+        module_id = int(module_id)
+        key = ('module', module_id, nested, get_cached_generation())
+        return json_response(request, key, lambda: get_module_body(module_id, nested))
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@cache_headers
+@condition(etag_func=publication_etag, last_modified_func=publication_last_modified)
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def publication_children(request, pubcode):
+    data = {}
+    try:
+        node_id = request.GET.get('id', '#')
+        parent = None if node_id == '#' else int(node_id)
+        validators = get_publication_validators(request, pubcode)
+        key = ('children', pubcode, parent, validators and validators['generation'])
+        return json_response(request, key, lambda: JSONRenderer().render(
+            get_tree_children(Publication.objects.only('id').get(code=pubcode, staging=False), parent)))
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+
+def get_batch_rows(request):
+    """
+    Функция, выбирающая модули для module_batch одним запросом без загрузки content_xml:
+    по списку идентификаторов (ids=1,2,3) или по родительскому узлу публикации
+    (publication=<код>&parent=<id модуля>, без parent - узлы верхнего уровня) опубликованной версии
+    :param HttpRequest request: Запрос
+    :return: значения полей ModuleSerializer в порядке запроса и список ненайденных идентификаторов
+    :rtype: list, list
+    :raises ValueError: неверные параметры или превышен размер пачки
+    """
+    max_size = getattr(settings, 'API_MODULE_BATCH_SIZE', 100)
+    fields = ModuleSerializer.Meta.fields
+
+    if 'ids' in request.GET:
+        ids = [int(module_id) for module_id in request.GET['ids'].split(',') if module_id]
+        if len(ids) > max_size:
+            raise ValueError('too many modules requested: %d, max %d' % (len(ids), max_size))
+        rows = {row['id']: row for row in Module.objects.filter(id__in=ids).values(*fields)}
+        return [rows[module_id] for module_id in ids if module_id in rows], [module_id for module_id in ids if module_id not in rows]
+
+    if 'publication' in request.GET:
+        # условия на публикацию и родителя должны относиться к одной связи: модуль может входить
+        # в несколько публикаций (см. core.utils.get_existing_modules) с разными родителями
+        links = PublicationModule.objects.filter(publication__code=request.GET['publication'], publication__staging=False)
+        parent = request.GET.get('parent')
+        if parent and parent != '#':
+            links = links.filter(parent_id=int(parent))
+        else:
+            links = links.filter(parent__isnull=True)
+        rows = [
+            {field: row['module__' + field] for field in fields}
+            for row in links.order_by('order_in_parent', 'id').values(*['module__' + field for field in fields])[:max_size + 1]
+        ]
+        if len(rows) > max_size:
+            raise ValueError('too many modules in node, max %d' % max_size)
+        return rows, []
+
+    raise ValueError('ids or publication parameter required')
+
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def module_batch(request):
+    data = {}
+    try:
+        nested = is_nested(request)
+        rows, missing = get_batch_rows(request)
+        for row in rows:
+            if not row['is_category'] and not row['content_json']:
+                row['content_json'] = ensure_module_content(Module.objects.get(pk=row['id']))
+
+        if nested:
+            fields = ModuleSerializer.Meta.fields
+            modules = b','.join(splice_json(row, fields, ('content_json',)) for row in rows)
+            body = b'{"modules":[' + modules + b'],"missing":' + JSONRenderer().render(missing) + b'}'
+        else:
+            body = JSONRenderer().render({'modules': rows, 'missing': missing})
+        return HttpResponse(body, content_type='application/json')
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def search(request):
+    """
+    Полнотекстовый поиск модулей: ?q=<запрос>[&publication=<код>][&page=1][&page_size=20]
+    """
+    data = {}
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(
+            max(int(request.GET.get('page_size', getattr(settings, 'API_SEARCH_PAGE_SIZE', 20))), 1),
+            getattr(settings, 'API_SEARCH_MAX_PAGE_SIZE', 100)
+        )
+        total, results = search_modules(
+            request.GET.get('q', ''), request.GET.get('publication'), (page - 1) * page_size, page_size)
+        data = {
+            'query': request.GET.get('q', ''),
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'results': results,
+        }
+        return Response(data)
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def part_lookup(request):
+    """
+    Поиск позиций каталога деталей: ?part_number=<номер>[&prefix=1][&manufacturer=<код>]
+    """
+    data = {}
+    try:
+        parts, truncated = find_parts(
+            request.GET.get('part_number'),
+            request.GET.get('manufacturer'),
+            prefix=request.GET.get('prefix', '') not in ('', '0', 'false'),
+            limit=getattr(settings, 'API_PART_LOOKUP_LIMIT', 100)
+        )
+        data = {'parts': parts, 'truncated': truncated}
+        return Response(data)
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAdminUser,))
+def import_jobs(request):
+    """
+    Последние задания загрузки публикаций: [?status=<состояние>][&limit=20]
+    """
+    data = {}
+    try:
+        jobs = ImportJob.objects.order_by('-created_at', '-id')
+        if request.GET.get('status'):
+            jobs = jobs.filter(status=request.GET['status'])
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        data = {'jobs': [get_job_status(job) for job in jobs[:limit]]}
+        return Response(data)
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response(data, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes((permissions.IsAdminUser,))
+def import_job_detail(request, job_id):
+    data = {}
+    try:
+        data = get_job_status(ImportJob.objects.get(pk=job_id))
+        return Response(data)
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@permission_classes((permissions.IsAdminUser,))
+def import_job_cancel(request, job_id):
+    data = {}
+    try:
+        data = get_job_status(cancel_job(job_id))
+        return Response(data)
+    except Exception as err:
+        data = {'error': str(err)}
+
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAdminUser,))
+def cache_stats(request):
+    return Response(response_cache.stats())
@@ -1,5 +1,27 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Обработчик connection_created, переводящий SQLite в режим WAL (settings.SQLITE_JOURNAL_MODE):
+    чтение не блокируется записью, поэтому API отвечает во время загрузки публикаций
+    """
+    if connection.vendor != 'sqlite':
+        return
+    journal_mode = getattr(settings, 'SQLITE_JOURNAL_MODE', 'wal')
+    if not journal_mode:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=%s' % journal_mode)
+        if journal_mode.lower() == 'wal':
+            # в режиме WAL synchronous=NORMAL не нарушает целостность базы при сбое
+            cursor.execute('PRAGMA synchronous=NORMAL')
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite, dispatch_uid='core.configure_sqlite')
@@ -0,0 +1,188 @@
+import bz2
+import io
+import lzma
+import zlib
+from functools import partial
+
+from django.conf import settings
+from django.db import models
+
+# Сжатое значение хранится как b'\x00<кодек>\x00<данные>'.
+# XML не может начинаться с нулевого байта, поэтому несжатые значения,
+# записанные до появления поля, читаются без изменений
+MARKER = b'\x00'
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# Кодеки, которые умеют сжимать данные по частям, см. compress_file
+STREAM_COMPRESSORS = {
+    'zlib': lambda: zlib.compressobj(6),
+    'bz2': bz2.BZ2Compressor,
+    'lzma': lzma.LZMACompressor,
+}
+
+# Кодеки, которые умеют распаковывать данные по частям, см. open_value
+STREAM_DECOMPRESSORS = {
+    'zlib': zlib.decompressobj,
+    'bz2': bz2.BZ2Decompressor,
+    'lzma': lzma.LZMADecompressor,
+}
+
+
+class CompressedValue(bytes):
+    """
+    Уже сжатое значение с заголовком кодека, записывается в CompressedBinaryField без повторного сжатия
+    """
+
+
+def register_codec(name, compress, decompress):
+    """
+    Функция, регистрирующая кодек сжатия для CompressedBinaryField
+    :param str name: Имя кодека (ascii, без нулевых байтов)
+    :param callable compress: Функция сжатия bytes -> bytes
+    :param callable decompress: Функция распаковки bytes -> bytes
+    """
+    CODECS[name] = (compress, decompress)
+
+
+def get_default_codec():
+    """
+    Функция, возвращающая имя кодека по умолчанию
+    :return: значение settings.CONTENT_XML_CODEC или 'zlib'
+    :rtype: str
+    """
+    return getattr(settings, 'CONTENT_XML_CODEC', 'zlib')
+
+
+def compress_value(value, codec=None):
+    """
+    Функция, сжимающая значение для записи в базу
+    :param bytes value: Исходное значение
+    :param str codec: Имя кодека, по умолчанию get_default_codec()
+    :return: сжатое значение с заголовком кодека
+    :rtype: bytes
+    """
+    codec = codec or get_default_codec()
+    compress = CODECS[codec][0]
+    return MARKER + codec.encode('ascii') + MARKER + compress(bytes(value))
+
+
+def compress_file(file_path, codec=None, chunk_size=1024 * 1024):
+    """
+    Функция, сжимающая файл по частям для записи в CompressedBinaryField, не читая его в память целиком:
+    в памяти находится только сжатое значение. Кодеки, зарегистрированные через register_codec,
+    сжимают файл целиком
+    :param str file_path: Путь к файлу
+    :param str codec: Имя кодека, по умолчанию get_default_codec()
+    :param int chunk_size: Размер читаемой части файла
+    :return: сжатое значение с заголовком кодека
+    :rtype: CompressedValue
+    """
+    codec = codec or get_default_codec()
+    chunks = [MARKER + codec.encode('ascii') + MARKER]
+    with open(file_path, 'rb') as file:
+        if codec in STREAM_COMPRESSORS:
+            compressor = STREAM_COMPRESSORS[codec]()
+            for chunk in iter(partial(file.read, chunk_size), b''):
+                chunks.append(compressor.compress(chunk))
+            chunks.append(compressor.flush())
+        else:
+            chunks.append(CODECS[codec][0](file.read()))
+    return CompressedValue(b''.join(chunks))
+
+
+def decompress_value(value):
+    """
+    Функция, распаковывающая значение, прочитанное из базы.
+    Значения без заголовка кодека возвращаются как есть
+    :param bytes value: Значение из базы
+    :return: исходное значение
+    :rtype: bytes
+    :raises ValueError: неизвестный кодек
+    """
+    value = bytes(value)
+    if not value.startswith(MARKER):
+        return value
+    end = value.index(MARKER, 1)
+    codec = value[1:end].decode('ascii')
+    if codec not in CODECS:
+        raise ValueError('unknown compression codec: %s' % codec)
+    return CODECS[codec][1](value[end + 1:])
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Файловый объект, распаковывающий сжатые данные по частям при чтении
+    """
+
+    def __init__(self, data, decompressor, chunk_size):
+        self.data = memoryview(data)
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer and self.pos < len(self.data):
+            chunk = self.data[self.pos:self.pos + self.chunk_size]
+            self.pos += len(chunk)
+            self.buffer = self.decompressor.decompress(chunk)
+            if self.pos >= len(self.data) and hasattr(self.decompressor, 'flush'):
+                self.buffer += self.decompressor.flush()
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def open_value(value, chunk_size=64 * 1024):
+    """
+    Функция, открывающая значение, прочитанное из базы без распаковки, как файл. Значения, сжатые кодеками
+    из STREAM_DECOMPRESSORS, распаковываются по частям при чтении, поэтому исходное значение целиком
+    в памяти не находится; остальные значения распаковываются сразу
+    :param bytes value: Значение из базы (со сжатием) или исходное значение
+    :param int chunk_size: Размер распаковываемой части сжатых данных
+    :return: файловый объект с исходным значением
+    :rtype: io.BufferedIOBase
+    """
+    value = bytes(value)
+    if value.startswith(MARKER):
+        end = value.index(MARKER, 1)
+        codec = value[1:end].decode('ascii')
+        if codec in STREAM_DECOMPRESSORS:
+            reader = DecompressingReader(memoryview(value)[end + 1:], STREAM_DECOMPRESSORS[codec](), chunk_size)
+            return io.BufferedReader(reader)
+    return io.BytesIO(decompress_value(value))
+
+
+class CompressedBinaryField(models.BinaryField):
+    """
+    Бинарное поле, прозрачно сжимающее значение при записи и распаковывающее при чтении
+    """
+
+    def __init__(self, *args, codec=None, **kwargs):
+        self.codec = codec
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.codec:
+            kwargs['codec'] = self.codec
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return value
+        return decompress_value(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value and not prepared and not isinstance(value, CompressedValue):
+            value = compress_value(value, self.codec)
+        return super().get_db_prep_value(value, connection, prepared)
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+INFO_FILE = 'info.json'
+# Папка производных изображений в пути превью или тайлов из манифеста публикации
+HASH_DIR_RE = re.compile(r'/[0-9a-f]{2}/([0-9a-f]{40})/')
+
+
+def get_derivatives_root():
+    """
+    Функция, возвращающая путь к папке производных изображений (превью и тайлов)
+    :rtype: str
+    """
+    return getattr(settings, 'IMAGE_DERIVATIVES_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'derived')
+
+
+def get_manifests_root():
+    """
+    Функция, возвращающая путь к папке служебных манифестов публикаций (производные изображения
+    и медиа-файлы). Папка не должна отдаваться как медиа-файлы, по умолчанию - MEDIA_ROOT/derived/manifests,
+    которую не отдаёт serve_media
+    :rtype: str
+    """
+    return getattr(settings, 'MEDIA_MANIFESTS_ROOT', None) or os.path.join(get_derivatives_root(), 'manifests')
+
+
+def get_media_url(abs_path):
+    """
+    Функция, возвращающая путь к файлу в том же виде, что и get_media_index
+    :param str abs_path: Абсолютный путь к файлу
+    :rtype: str
+    """
+    return abs_path.replace(settings.BASE_DIR, '')
+
+
+def get_media_file(media_url):
+    """
+    Функция, возвращающая абсолютный путь к файлу по пути из get_media_index
+    :param str media_url: Путь из индекса медиа-файлов
+    :rtype: str
+    """
+    abs_path = settings.BASE_DIR + media_url
+    return abs_path if os.path.exists(abs_path) else media_url
+
+
+def save_image_derivatives(image, tmp_dir, src_dir, info, preview_size, tile_size, tile_threshold):
+    """
+    Функция, сохраняющая превью и тайлы изображения во временную папку и дополняющая ими описание изображения
+    :param Image.Image image: Открытое изображение
+    :param str tmp_dir: Временная папка
+    :param str src_dir: Путь папки изображения в описании (относительно папки производных изображений)
+    :param dict info: Описание изображения с размерами
+    :param int preview_size: Наибольшая сторона превью
+    :param int tile_size: Сторона тайла
+    :param int tile_threshold: Наибольшая сторона изображения, начиная с которой создаются тайлы
+    """
+    width, height = image.size
+    os.makedirs(tmp_dir)
+    if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    preview = image.copy()
+    preview.thumbnail((preview_size, preview_size), Image.LANCZOS)
+    preview.save(os.path.join(tmp_dir, 'preview.png'), optimize=True)
+    info['preview'] = {
+        'src': os.path.join(src_dir, 'preview.png'),
+        'width': preview.size[0],
+        'height': preview.size[1],
+    }
+
+    if max(width, height) > tile_threshold:
+        os.makedirs(os.path.join(tmp_dir, 'tiles'))
+        columns = (width + tile_size - 1) // tile_size
+        rows = (height + tile_size - 1) // tile_size
+        for x in range(columns):
+            for y in range(rows):
+                box = (x * tile_size, y * tile_size, min((x + 1) * tile_size, width), min((y + 1) * tile_size, height))
+                image.crop(box).save(os.path.join(tmp_dir, 'tiles', '%d_%d.png' % (x, y)), optimize=True)
+        info['tiles'] = {
+            'src': os.path.join(src_dir, 'tiles', '{x}_{y}.png'),
+            'size': tile_size,
+            'columns': columns,
+            'rows': rows,
+        }
+
+
+def build_image_derivatives(source, derivatives_root, preview_size, tile_size, tile_threshold, max_pixels=None):
+    """
+    Функция, создающая превью и тайлы изображения. Выполняется в том числе в дочерних процессах,
+    поэтому не обращается к базе данных и настройкам. Результат сохраняется в папке по хешу
+    файла, поэтому одинаковые изображения разных публикаций обрабатываются один раз
+    :param str source: Путь к изображению
+    :param str derivatives_root: Папка производных изображений
+    :param int preview_size: Наибольшая сторона превью
+    :param int tile_size: Сторона тайла
+    :param int tile_threshold: Наибольшая сторона изображения, начиная с которой создаются тайлы
+    :param int max_pixels: Наибольшее количество точек обрабатываемого изображения, None - без ограничения
+    :return: размеры изображения, превью и тайлов с путями относительно derivatives_root, или None,
+        если формат не поддерживается, изображение больше max_pixels или его не удалось обработать
+    :rtype: dict
+    """
+    from core.utils import get_file_hash
+
+    content_hash = get_file_hash(source)
+    target_dir = os.path.join(derivatives_root, content_hash[:2], content_hash)
+    info_path = os.path.join(target_dir, INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path) as file:
+            return json.load(file)
+
+    try:
+        # размер из заголовка проверяется по max_pixels, поэтому предупреждение Pillow о крупных
+        # изображениях (больше Image.MAX_IMAGE_PIXELS) не нужно
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            image = Image.open(source)
+        width, height = image.size
+    except Image.DecompressionBombError:
+        logger.warning('image %s exceeds PIL.Image.MAX_IMAGE_PIXELS, previews and tiles are not created', source)
+        return None
+    except (OSError, ValueError):
+        return None
+    if max_pixels and width * height > max_pixels:
+        logger.warning('image %s (%dx%d) exceeds IMAGE_MAX_PIXELS, previews and tiles are not created',
+                       source, width, height)
+        return None
+
+    info = {'width': width, 'height': height}
+    if max(width, height) > preview_size:
+        tmp_dir = '%s.%d.tmp' % (target_dir, os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            save_image_derivatives(image, tmp_dir, os.path.relpath(target_dir, derivatives_root), info,
+                                   preview_size, tile_size, tile_threshold)
+        except (OSError, ValueError, MemoryError) as err:
+            # повреждённое или неполное изображение не должно прерывать загрузку публикации
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.warning('image %s: previews and tiles are not created: %s', source, err)
+            return None
+
+        with open(os.path.join(tmp_dir, INFO_FILE), 'w') as file:
+            json.dump(info, file)
+        # папка появляется целиком, поэтому наличие info.json означает, что все файлы созданы
+        try:
+            os.rename(tmp_dir, target_dir)
+        except OSError:
+            # папку уже создал параллельный процесс
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return info
+
+
+def get_manifest_path(publication_code):
+    return os.path.join(get_manifests_root(), publication_code + '.json')
+
+
+def build_publication_derivatives(publication_code, media_index, workers=None):
+    """
+    Функция, создающая превью и тайлы крупных изображений публикации в пуле процессов
+    и сохраняющая их описание в файл манифеста публикации (см. get_publication_derivatives).
+    Без установленного Pillow ничего не делает
+    :param str publication_code: Код публикации
+    :param dict media_index: Индекс медиа-файлов публикации, см. core.utils.get_media_index
+    :param int workers: Количество процессов, по умолчанию settings.IMAGE_WORKERS
+    :return: {имя файла без расширения: размеры изображения, превью и тайлов}
+    :rtype: dict
+    """
+    from core.utils import write_manifest
+
+    if Image is None or not getattr(settings, 'IMAGE_DERIVATIVES', True):
+        return {}
+    if workers is None:
+        workers = getattr(settings, 'IMAGE_WORKERS', 1)
+
+    names = sorted(media_index)
+    sources = [get_media_file(media_index[name]) for name in names]
+    derivatives_root = get_derivatives_root()
+    build = partial(
+        build_image_derivatives,
+        derivatives_root=derivatives_root,
+        preview_size=getattr(settings, 'IMAGE_PREVIEW_SIZE', 1024),
+        tile_size=getattr(settings, 'IMAGE_TILE_SIZE', 512),
+        tile_threshold=getattr(settings, 'IMAGE_TILE_THRESHOLD', 4096),
+        max_pixels=getattr(settings, 'IMAGE_MAX_PIXELS', 178956970),
+    )
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(build, sources, chunksize=8))
+    else:
+        results = [build(source) for source in sources]
+
+    derivatives = {}
+    for name, info in zip(names, results):
+        if info is None:
+            continue
+        # пути в info.json относительны папки производных изображений (в прежних версиях - абсолютные)
+        if 'preview' in info:
+            info['preview'] = dict(info['preview'], src=get_media_url(os.path.join(derivatives_root, info['preview']['src'])))
+        if 'tiles' in info:
+            info['tiles'] = dict(info['tiles'], src=get_media_url(os.path.join(derivatives_root, info['tiles']['src'])))
+        derivatives[name] = info
+
+    logger.info('publication %s: %d images, %d previews, %d tiled', publication_code, len(derivatives),
+                sum(1 for info in derivatives.values() if 'preview' in info),
+                sum(1 for info in derivatives.values() if 'tiles' in info))
+    write_manifest(get_manifest_path(publication_code), derivatives)
+    return derivatives
+
+
+def get_publication_derivatives(publication_code):
+    """
+    Функция, возвращающая описание превью и тайлов изображений публикации из её манифеста.
+    Манифест кешируется в процессе до его замены, см. core.utils.read_manifest
+    :param str publication_code: Код публикации
+    :return: {имя файла без расширения: размеры изображения, превью и тайлов}
+    :rtype: dict
+    """
+    from core.utils import read_manifest
+
+    return read_manifest(get_manifest_path(publication_code)) or {}
+
+
+def gc_image_derivatives(min_age=3600):
+    """
+    Функция, удаляющая папки производных изображений, на которые не ссылается ни один манифест
+    публикации, и временные папки прерванной обработки. Недавно созданные папки не удаляются,
+    так как манифест загружаемой публикации записывается после обработки всех изображений
+    :param int min_age: Минимальный возраст удаляемой папки в секундах
+    :return: количество удаленных папок
+    :rtype: int
+    """
+    from core.utils import read_manifest
+
+    derivatives_root = get_derivatives_root()
+    manifests_path = os.path.dirname(get_manifest_path(''))
+    referenced = set()
+    if os.path.isdir(manifests_path):
+        for name in os.listdir(manifests_path):
+            if name.endswith('.json') and not name.endswith('.media.json'):
+                for info in (read_manifest(os.path.join(manifests_path, name)) or {}).values():
+                    for key in ('preview', 'tiles'):
+                        match = HASH_DIR_RE.search(info.get(key, {}).get('src', ''))
+                        if match:
+                            referenced.add(match.group(1))
+
+    removed = 0
+    now = time.time()
+    for prefix in os.listdir(derivatives_root) if os.path.isdir(derivatives_root) else []:
+        prefix_path = os.path.join(derivatives_root, prefix)
+        if prefix == 'manifests' or not os.path.isdir(prefix_path):
+            # папка манифестов по умолчанию
+            continue
+        for name in os.listdir(prefix_path):
+            # временная папка: <хеш>.<pid>.tmp
+            if name.split('.', 1)[0] in referenced and not name.endswith('.tmp'):
+                continue
+            path = os.path.join(prefix_path, name)
+            if now - os.stat(path).st_mtime > min_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
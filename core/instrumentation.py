@@ -0,0 +1,133 @@
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_max_rss():
+    """
+    Функция, возвращающая максимальный объем памяти, занятый процессом с момента запуска
+    :return: объем памяти в байтах или None, если недоступно на платформе
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    # ru_maxrss в Linux измеряется в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ImportSpan:
+    """
+    Замер одного этапа загрузки: время, количество обработанных элементов,
+    запросов к базе, прочитанных байт и пик памяти.
+    peak_memory заполняется только если включен tracemalloc, max_rss - пиковый
+    объем памяти процесса на момент окончания этапа, failed - этап прерван исключением
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes_read = 0
+        self.queries = 0
+        self.time = 0.0
+        self.peak_memory = None
+        self.max_rss = None
+        self.failed = False
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'items': self.items,
+            'bytes_read': self.bytes_read,
+            'queries': self.queries,
+            'time': self.time,
+            'peak_memory': self.peak_memory,
+            'max_rss': self.max_rss,
+            'failed': self.failed,
+        }
+
+
+class ImportSummary:
+    """
+    Сводка по этапам загрузки публикации, возвращается из load_publication.
+    listener - необязательная функция listener(summary, name, span), которая вызывается
+    в начале этапа (span=None) и по его завершении; исключение из неё прерывает загрузку
+    """
+
+    def __init__(self, path, listener=None):
+        self.path = path
+        self.code = None
+        # публикация создана этой загрузкой и ещё не опубликована, см. core.jobs.cleanup_job
+        self.created = False
+        self.listener = listener
+        self.spans = []
+
+    @contextmanager
+    def span(self, name):
+        """
+        Замеряет выполнение этапа и пишет результат в лог.
+        Количество элементов и прочитанных байт заполняет сам этап.
+        Этап, прерванный исключением, тоже попадает в сводку с отметкой failed
+        """
+        if self.listener is not None:
+            self.listener(self, name, None)
+        span = ImportSpan(name)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            getattr(tracemalloc, 'reset_peak', tracemalloc.clear_traces)()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(span.count_query):
+                yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            span.time = time.perf_counter() - start
+            if tracing:
+                span.peak_memory = tracemalloc.get_traced_memory()[1]
+            span.max_rss = get_max_rss()
+            self.spans.append(span)
+            logger.log(
+                logging.WARNING if span.failed else logging.INFO,
+                'import %s: %s %s - %d items, %d queries, %d bytes read in %.3f s',
+                self.code or self.path, name, 'failed' if span.failed else 'done', span.items, span.queries,
+                span.bytes_read, span.time, extra={'import_span': span.as_dict()})
+        if self.listener is not None:
+            self.listener(self, name, span)
+
+    @property
+    def time(self):
+        return sum(span.time for span in self.spans)
+
+    @property
+    def queries(self):
+        return sum(span.queries for span in self.spans)
+
+    @property
+    def bytes_read(self):
+        return sum(span.bytes_read for span in self.spans)
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'code': self.code,
+            'time': self.time,
+            'queries': self.queries,
+            'bytes_read': self.bytes_read,
+            'spans': [span.as_dict() for span in self.spans],
+        }
@@ -0,0 +1,374 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from core.images import gc_image_derivatives
+from core.instrumentation import ImportSummary
+from core.models import ImportJob, Publication
+from core.utils import delete_publication, delete_retired_publications, gc_media_store, load_publication, \
+    update_publication
+
+
+logger = logging.getLogger(__name__)
+
+# Этапы загрузки в порядке выполнения, см. load_publication и update_publication
+LOAD_STAGES = ('props', 'dmc_load', 'tree_build', 'static_copy', 'image_derivatives', 'structure_json',
+               'module_parse', 'search_index', 'publish', 'gc')
+UPDATE_STAGES = ('props', 'dmc_load', 'tree_build', 'static_copy', 'image_derivatives', 'module_parse', 'search_index')
+
+# Этапы, на которых выполняющееся задание можно отменить: загрузка ещё не опубликована
+# (см. core.utils.publish_publication) и удаляется cleanup_job, а обновление ещё не зафиксировало
+# транзакцию дерева и откатывается. Пустой этап - процесс задания ещё не начал загрузку.
+# Ключ - ImportJob.update
+CANCELLABLE_STAGES = {
+    False: ('',) + LOAD_STAGES[:LOAD_STAGES.index('publish')],
+    True: ('',) + UPDATE_STAGES[:UPDATE_STAGES.index('tree_build') + 1],
+}
+
+# Количество последних выполненных заданий, по которым оценивается доля времени этапов
+WEIGHT_HISTORY = 10
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+def enqueue_import(path, update=False, bulk=False, workers=None, lazy=None):
+    """
+    Функция, ставящая загрузку публикации в очередь фоновых заданий (см. run_worker)
+    :param str path: Путь к директории с файлом структуры публикации (PMC-...)
+    :param bool update: Загрузить новый выпуск публикации (update_publication)
+    :param bool bulk: Параметр load_publication
+    :param int workers: Количество процессов для разбора файлов модулей
+    :param bool lazy: Не формировать содержание модулей при загрузке
+    :rtype: ImportJob
+    """
+    options = {'workers': workers, 'lazy': lazy}
+    if not update:
+        options['bulk'] = bulk
+    return ImportJob.objects.create(path=os.path.abspath(path), update=update, options=json.dumps(options))
+
+
+def cancel_job(job_id):
+    """
+    Функция, отменяющая задание. Задание в очереди отменяется сразу, выполняющееся
+    прерывается перед следующим этапом загрузки, а если этап не завершится
+    за settings.IMPORT_JOB_CANCEL_TIMEOUT секунд - завершением процесса (см. run_worker).
+    После того как изменения стали видны API (см. CANCELLABLE_STAGES), задание не отменяется
+    :param int job_id: Идентификатор задания
+    :return: задание
+    :rtype: ImportJob
+    :raises ImportJob.DoesNotExist: задание не найдено
+    """
+    now = timezone.now()
+    ImportJob.objects.filter(pk=job_id, status=ImportJob.QUEUED).update(
+        status=ImportJob.CANCELLED, cancel_requested_at=now, finished_at=now)
+    ImportJob.objects.filter(pk=job_id, status=ImportJob.RUNNING, cancel_requested_at__isnull=True).update(
+        cancel_requested_at=now)
+    return ImportJob.objects.get(pk=job_id)
+
+
+def get_stage_weights(update):
+    """
+    Функция, оценивающая долю времени каждого этапа в загрузке по последним выполненным заданиям
+    того же вида. Без истории все этапы считаются одинаковыми
+    :param bool update: Задания обновления публикации
+    :return: {этап: доля времени}
+    :rtype: dict
+    """
+    stages = UPDATE_STAGES if update else LOAD_STAGES
+    shares = {name: [] for name in stages}
+    for stages_json in ImportJob.objects.filter(status=ImportJob.DONE, update=update)\
+            .order_by('-finished_at').values_list('stages_json', flat=True)[:WEIGHT_HISTORY]:
+        times = {}
+        for span in json.loads(stages_json or '[]'):
+            times[span['name']] = times.get(span['name'], 0) + span['time']
+        total = sum(times.values())
+        if total:
+            for name in stages:
+                shares[name].append(times.get(name, 0) / total)
+    return {
+        name: sum(values) / len(values) if values else 1 / len(stages)
+        for name, values in shares.items()
+    }
+
+
+class JobProgress:
+    """
+    Обработчик этапов ImportSummary, сохраняющий ход выполнения задания
+    и проверяющий запрос отмены перед каждым этапом из CANCELLABLE_STAGES
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.weights = get_stage_weights(job.update)
+        self.cancellable = CANCELLABLE_STAGES[job.update]
+        self.stages = []
+
+    def __call__(self, summary, name, span):
+        job = self.job
+        if span is None:
+            if name in self.cancellable and \
+                    ImportJob.objects.filter(pk=job.pk, cancel_requested_at__isnull=False).exists():
+                raise ImportCancelled('import cancelled')
+            job.stage = name
+            job.stage_started_at = timezone.now()
+        else:
+            self.stages.append(span.as_dict())
+            job.stages_json = json.dumps(self.stages)
+            done = set(span['name'] for span in self.stages)
+            job.progress = min(sum(weight for stage, weight in self.weights.items() if stage in done), 1.0)
+        # после публикации (см. publish_publication) загруженная публикация при ошибке не удаляется
+        job.publication_created = summary.created
+        job.publication_code = summary.code or ''
+        job.save(update_fields=['stage', 'stage_started_at', 'stages_json', 'progress', 'publication_code',
+                                'publication_created'])
+
+
+def cleanup_job(job):
+    """
+    Функция, удаляющая частично загруженную публикацию прерванного задания, если задание её создало.
+    Изменения модулей при обновлении выполняются в одной транзакции и откатываются сами
+    :param ImportJob job: Задание
+    """
+    if job.publication_created and job.publication_code:
+        delete_publication(job.publication_code)
+
+
+def finish_job(job, status, error=''):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    if status != ImportJob.DONE:
+        cleanup_job(job)
+    logger.info('import job %d %s: %s %s', job.pk, status, job.path, error.strip().splitlines()[-1] if error else '')
+
+
+def run_job(job_id):
+    """
+    Функция, выполняющая задание в текущем процессе. Задание в очереди предварительно захватывается
+    :param int job_id: Идентификатор задания
+    :return: задание
+    :rtype: ImportJob
+    :raises ValueError: задание уже выполняется другим процессом или завершено
+    """
+    ImportJob.objects.filter(pk=job_id, status=ImportJob.QUEUED).update(
+        status=ImportJob.RUNNING, started_at=timezone.now())
+    job = ImportJob.objects.get(pk=job_id)
+    if job.status != ImportJob.RUNNING or job.worker_pid is not None:
+        raise ValueError('import job %d is %s' % (job.pk, job.status))
+    job.worker_pid = os.getpid()
+    job.save(update_fields=['worker_pid'])
+
+    options = json.loads(job.options or '{}')
+    summary = ImportSummary(job.path, listener=JobProgress(job))
+    try:
+        if job.update:
+            update_publication(job.path, summary=summary, **options)
+        else:
+            load_publication(job.path, summary=summary, **options)
+    except ImportCancelled:
+        finish_job(job, ImportJob.CANCELLED)
+    except Exception:
+        finish_job(job, ImportJob.FAILED, traceback.format_exc())
+    else:
+        job.progress = 1.0
+        job.stage = ''
+        job.save(update_fields=['progress', 'stage'])
+        finish_job(job, ImportJob.DONE)
+    return job
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover_jobs():
+    """
+    Функция, завершающая с ошибкой задания, процесс которых прекратил работу
+    (например, после перезапуска сервера), и удаляющая их частичные результаты
+    :return: количество заданий
+    :rtype: int
+    """
+    count = 0
+    # захваченное задание получает процесс не сразу, см. run_job
+    started_before = timezone.now() - timedelta(seconds=getattr(settings, 'IMPORT_JOB_CANCEL_TIMEOUT', 60))
+    for job in ImportJob.objects.filter(status=ImportJob.RUNNING):
+        if job.worker_pid is None and job.started_at < started_before or \
+                job.worker_pid is not None and not is_process_alive(job.worker_pid):
+            finish_job(job, ImportJob.CANCELLED if job.cancel_requested_at else ImportJob.FAILED,
+                       '' if job.cancel_requested_at else 'import process terminated')
+            count += 1
+    return count
+
+
+def gc_staging_publications(min_age=86400):
+    """
+    Функция, удаляющая неопубликованные версии публикаций, оставшиеся от прерванных загрузок,
+    и заменённые версии старше settings.IMPORT_RETIRED_TTL (см. core.utils.publish_publication).
+    Версии, которые собирают выполняющиеся задания, не удаляются
+    :param int min_age: Минимальное время с последнего изменения незавершённой версии в секундах
+    :return: количество удалённых версий
+    :rtype: int
+    """
+    removed = delete_retired_publications(getattr(settings, 'IMPORT_RETIRED_TTL', 60))
+    codes = list(Publication.objects.filter(
+        staging=True, generation=0, updated_at__lt=timezone.now() - timedelta(seconds=min_age))\
+        .exclude(code__in=ImportJob.objects.filter(status=ImportJob.RUNNING).values('publication_code'))\
+        .values_list('code', flat=True))
+    return removed + sum(1 for code in codes if delete_publication(code))
+
+
+def claim_job():
+    """
+    Функция, захватывающая самое раннее задание из очереди. Задания одной и той же папки
+    не выполняются одновременно. Захват - условное изменение состояния, поэтому
+    несколько процессов run_worker не захватят одно задание
+    :rtype: ImportJob
+    """
+    running = set(ImportJob.objects.filter(status=ImportJob.RUNNING).values_list('path', flat=True))
+    for job in ImportJob.objects.filter(status=ImportJob.QUEUED).order_by('created_at', 'id'):
+        if job.path in running:
+            continue
+        if ImportJob.objects.filter(pk=job.pk, status=ImportJob.QUEUED).update(
+                status=ImportJob.RUNNING, started_at=timezone.now()):
+            return job
+
+
+def reap_job(job_id, returncode):
+    """
+    Функция, завершающая задание, процесс которого завершился, не записав результат: прерван или упал
+    :param int job_id: Идентификатор задания
+    :param int returncode: Код завершения процесса
+    """
+    job = ImportJob.objects.get(pk=job_id)
+    if job.status == ImportJob.RUNNING:
+        finish_job(job, ImportJob.CANCELLED if job.cancel_requested_at else ImportJob.FAILED,
+                   '' if job.cancel_requested_at else 'import process exited with code %d' % returncode)
+
+
+def start_job_process(job):
+    """
+    Функция, запускающая задание в отдельном процессе Python (команда run_import_job)
+    :param ImportJob job: Захваченное задание
+    :rtype: subprocess.Popen
+    """
+    return subprocess.Popen(
+        [sys.executable, '-m', 'django', 'run_import_job', str(job.pk)],
+        cwd=settings.BASE_DIR,
+        env=dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'tgws_serv.settings'))
+    )
+
+
+def run_worker(processes=None, poll=1.0, once=False):
+    """
+    Функция, выполняющая задания из очереди в пуле до processes дочерних процессов, чтобы публикации
+    загружались параллельно. Следит за завершением процессов и принудительно завершает задания,
+    отмена которых не выполнена за settings.IMPORT_JOB_CANCEL_TIMEOUT секунд. Периодически удаляет
+    заменённые версии публикаций, файлы хранилища и производные изображения без ссылок (settings.MEDIA_STORE_GC_INTERVAL)
+    :param int processes: Количество процессов, по умолчанию settings.IMPORT_JOB_PROCESSES
+    :param float poll: Период опроса очереди в секундах
+    :param bool once: Завершиться, когда очередь опустеет
+    """
+    if processes is None:
+        processes = getattr(settings, 'IMPORT_JOB_PROCESSES', 2)
+    cancel_timeout = getattr(settings, 'IMPORT_JOB_CANCEL_TIMEOUT', 60)
+    recover_jobs()
+    store_gc_interval = getattr(settings, 'MEDIA_STORE_GC_INTERVAL', 3600)
+    running = {}
+    gc_at = store_gc_at = 0
+    try:
+        while True:
+            if time.time() >= gc_at:
+                # заменённые загрузками версии публикаций удаляются по истечении IMPORT_RETIRED_TTL
+                delete_retired_publications(getattr(settings, 'IMPORT_RETIRED_TTL', 60))
+                gc_at = time.time() + 60
+            if store_gc_interval and time.time() >= store_gc_at:
+                # файлы хранилища и производные изображения, на которые больше не ссылаются публикации
+                gc_media_store()
+                gc_image_derivatives()
+                store_gc_at = time.time() + store_gc_interval
+            for job_id, process in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[job_id]
+                reap_job(job_id, process.returncode)
+
+            deadline = timezone.now() - timedelta(seconds=cancel_timeout)
+            for job_id in ImportJob.objects.filter(id__in=list(running), cancel_requested_at__lt=deadline)\
+                    .filter(Q(update=False, stage__in=CANCELLABLE_STAGES[False]) |
+                            Q(update=True, stage__in=CANCELLABLE_STAGES[True]))\
+                    .values_list('id', flat=True):
+                running[job_id].terminate()
+
+            while len(running) < processes:
+                job = claim_job()
+                if job is None:
+                    break
+                running[job.pk] = start_job_process(job)
+                logger.info('import job %d started: %s', job.pk, job.path)
+
+            if once and not running:
+                return
+            # не держим соединение с базой открытым между опросами
+            connections.close_all()
+            time.sleep(poll)
+    finally:
+        for process in running.values():
+            process.terminate()
+        for job_id, process in running.items():
+            reap_job(job_id, process.wait())
+
+
+def get_job_status(job):
+    """
+    Функция, возвращающая состояние задания для API: завершённые этапы, текущий этап,
+    долю выполнения и оценку оставшегося времени в секундах. Оценка строится по доле
+    выполненных этапов в ожидаемом времени загрузки, см. get_stage_weights
+    :param ImportJob job: Задание
+    :rtype: dict
+    """
+    stages = json.loads(job.stages_json or '[]')
+    eta = None
+    if job.status == ImportJob.RUNNING and job.started_at and job.progress > 0:
+        elapsed = (timezone.now() - job.started_at).total_seconds()
+        done_time = sum(span['time'] for span in stages)
+        eta = max(done_time / job.progress - elapsed, 0.0)
+    return {
+        'id': job.pk,
+        'path': job.path,
+        'update': job.update,
+        'status': job.status,
+        'publication_code': job.publication_code,
+        'stage': job.stage,
+        'stage_started_at': job.stage_started_at,
+        'stages': [
+            {'name': span['name'], 'items': span['items'], 'bytes_read': span['bytes_read'],
+             'queries': span['queries'], 'time': span['time']}
+            for span in stages
+        ],
+        'progress': job.progress,
+        'eta': eta,
+        'error': job.error,
+        'cancel_requested_at': job.cancel_requested_at,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,298 @@
+import copy
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.utils import load_publication
+
+
+MODEL_IDENT_CODE = 'BENCH'
+ISSUE_NUMBER = '001'
+
+
+def get_dm_ref(tech_name):
+    """
+    Функция, возвращающая ссылку dmRef на модуль синтетической публикации
+    :param str tech_name: Полное название модуля
+    :return: xml ссылки
+    :rtype: str
+    """
+    return (
+        '<dmRef><dmRefIdent><issueInfo issueNumber="%s" inWork="00"/></dmRefIdent>'
+        '<dmRefAddressItems><dmTitle><techName>%s</techName></dmTitle></dmRefAddressItems></dmRef>'
+    ) % (ISSUE_NUMBER, tech_name)
+
+
+def make_module_xml(tech_name, graphics, parts, rnd):
+    """
+    Функция, создающая содержимое модуля данных с каталогом деталей (IPC)
+    :param str tech_name: Полное название модуля
+    :param list graphics: Имена иллюстраций модуля (infoEntityIdent)
+    :param int parts: Количество позиций каталога
+    :param Random rnd: Генератор случайных чисел
+    :return: xml модуля
+    :rtype: str
+    """
+    figure = ''.join(
+        '<graphic infoEntityIdent="%s" id="fig-%d">%s</graphic>' % (name, i, ''.join(
+            '<hotspot id="hs-%d-%d" applicationStructureIdent="%d" hotspotTitle="%d"/>' % (i, j, j + 1, j + 1)
+            for j in range(min(parts, 5))
+        ))
+        for i, name in enumerate(graphics)
+    )
+    catalog = ''.join(
+        '<catalogSeqNumber item="%03d" figureNumber="01" indenture="%d"><itemSeqNumber itemSeqNumberValue="00A">'
+        '<quantityPerNextHigherAssy>%d</quantityPerNextHigherAssy>'
+        '<partRef partNumberValue="PN-%06d" manufacturerCodeValue="K%04d"/>'
+        '</itemSeqNumber></catalogSeqNumber>' % (
+            i + 1, rnd.randint(1, 3), rnd.randint(1, 10), rnd.randint(0, 999999), rnd.randint(0, 9999))
+        for i in range(parts)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<dmodule><identAndStatusSection><dmAddress>'
+        '<dmIdent><issueInfo issueNumber="%s" inWork="00"/><language languageIsoCode="ru" countryIsoCode="RU"/></dmIdent>'
+        '<dmAddressItems><issueDate year="2018" month="08" day="15"/><dmTitle><techName>%s</techName>'
+        '<infoName>Каталог деталей</infoName></dmTitle></dmAddressItems>'
+        '</dmAddress></identAndStatusSection>'
+        '<content><illustratedPartsCatalog><figure id="fig">%s</figure>%s</illustratedPartsCatalog></content>'
+        '</dmodule>'
+    ) % (ISSUE_NUMBER, tech_name, figure, catalog)
+
+
+def generate_publication(path, depth=3, fanout=5, modules=500, graphics=100, parts=10,
+                         graphic_size=20000, seed=0):
+    """
+    Функция, создающая директорию синтетической публикации в формате, который ожидает
+    load_publication: файл структуры PMC-..., файлы модулей DMC-... и папка graphics.
+    Категории образуют дерево глубиной depth, где у каждой категории fanout подкатегорий,
+    модули распределяются по категориям нижнего уровня по очереди
+    :param str path: Путь к создаваемой директории
+    :param int depth: Глубина дерева категорий
+    :param int fanout: Количество подкатегорий у категории
+    :param int modules: Количество модулей данных
+    :param int graphics: Количество иллюстраций
+    :param int parts: Количество позиций каталога в модуле
+    :param int graphic_size: Размер файла иллюстрации в байтах
+    :param int seed: Начальное значение генератора случайных чисел
+    :return: количество категорий, модулей и иллюстраций
+    :rtype: int, int, int
+    """
+    rnd = random.Random(seed)
+    graphics_path = os.path.join(path, 'graphics')
+    os.makedirs(graphics_path)
+
+    graphic_names = ['ICN-%s-A-000000-A-00000-%05d-A-01-1' % (MODEL_IDENT_CODE, i) for i in range(graphics)]
+    for name in graphic_names:
+        with open(os.path.join(graphics_path, name + '.png'), 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n' + bytes(rnd.getrandbits(8) for i in range(graphic_size)))
+
+    # листья дерева категорий, по которым раскладываются ссылки на модули
+    leaves = [[]] if depth <= 0 else []
+    categories = 0
+
+    def make_entries(level, prefix):
+        nonlocal categories
+        entries = []
+        for i in range(1, fanout + 1):
+            categories += 1
+            number = '%s.%d' % (prefix, i) if prefix else str(i)
+            children = []
+            if level < depth:
+                children = make_entries(level + 1, number)
+            else:
+                leaves.append(children)
+            entries.append(('Раздел %s' % number, children))
+        return entries
+
+    root = leaves[0] if depth <= 0 else make_entries(1, '')
+
+    for i in range(modules):
+        tech_name = 'Модуль %d' % (i + 1)
+        file_name = 'DMC-%s-A-%05d-941A-D_%s-00_RU-RU.XML' % (MODEL_IDENT_CODE, i + 1, ISSUE_NUMBER)
+        module_graphics = [graphic_names[(i + j) % graphics] for j in range(2)] if graphics else []
+        with open(os.path.join(path, file_name), 'w', encoding='utf-8') as file:
+            file.write(make_module_xml(tech_name, module_graphics, parts, rnd))
+        leaves[i % len(leaves)].append(tech_name)
+
+    def render(entries):
+        return ''.join(
+            get_dm_ref(entry) if isinstance(entry, str)
+            else '<pmEntry><pmEntryTitle>%s</pmEntryTitle>%s</pmEntry>' % (entry[0], render(entry[1]))
+            for entry in entries
+        )
+
+    pmc = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<pm><identAndStatusSection><pmAddress>'
+        '<pmIdent><issueInfo issueNumber="%s" inWork="00"/></pmIdent>'
+        '<pmAddressItems><pmTitle>Синтетическая публикация</pmTitle></pmAddressItems>'
+        '</pmAddress><pmStatus><brexDmRef><dmRef><dmRefIdent><dmCode modelIdentCode="%s" systemDiffCode="A" '
+        'systemCode="00" subSystemCode="0" subSubSystemCode="0" assyCode="00" disassyCode="00" '
+        'disassyCodeVariant="A" infoCode="022" infoCodeVariant="A" itemLocationCode="D"/></dmRefIdent></dmRef>'
+        '</brexDmRef></pmStatus></identAndStatusSection><content>%s</content></pm>'
+    ) % (ISSUE_NUMBER, MODEL_IDENT_CODE, render(root))
+    with open(os.path.join(path, 'PMC-%s-00000-00_%s-00_RU-RU.XML' % (MODEL_IDENT_CODE, ISSUE_NUMBER)),
+              'w', encoding='utf-8') as file:
+        file.write(pmc)
+
+    return categories, modules, graphics
+
+
+@contextmanager
+def throwaway_database(sqlite_path):
+    """
+    Контекстный менеджер, подменяющий соединение с базой по умолчанию соединением с временной базой
+    той же СУБД, которая создаётся и заполняется миграциями так же, как тестовая база Django
+    (для SQLite - файл sqlite_path), и удаляется после выхода
+    :param str sqlite_path: Путь к файлу временной базы SQLite
+    :return: соединение с временной базой
+    :rtype: BaseDatabaseWrapper
+    """
+    original = connections[DEFAULT_DB_ALIAS]
+    settings_dict = copy.deepcopy(original.settings_dict)
+    if original.vendor == 'sqlite':
+        settings_dict['TEST'] = dict(settings_dict.get('TEST') or {}, NAME=sqlite_path)
+    old_name = settings_dict['NAME']
+    bench = original.__class__(settings_dict, DEFAULT_DB_ALIAS)
+    connections[DEFAULT_DB_ALIAS] = bench
+    created = False
+    try:
+        bench.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        created = True
+        yield bench
+    finally:
+        try:
+            if created:
+                bench.creation.destroy_test_db(old_name, verbosity=0)
+            else:
+                bench.close()
+        finally:
+            connections[DEFAULT_DB_ALIAS] = original
+
+
+class Command(BaseCommand):
+    help = 'Создает синтетическую публикацию и замеряет этапы её загрузки через load_publication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='глубина дерева категорий')
+        parser.add_argument('--fanout', type=int, default=5, help='количество подкатегорий у категории')
+        parser.add_argument('--modules', type=int, default=500, help='количество модулей данных')
+        parser.add_argument('--graphics', type=int, default=100, help='количество иллюстраций')
+        parser.add_argument('--parts', type=int, default=10, help='количество позиций каталога в модуле')
+        parser.add_argument('--graphic-size', type=int, default=20000, help='размер иллюстрации в байтах')
+        parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора')
+        parser.add_argument('--path', help='директория для синтетической публикации, по умолчанию временная')
+        parser.add_argument('--keep', action='store_true', help='не удалять созданную публикацию')
+        parser.add_argument('--bulk', action='store_true', help='загружать с bulk=True')
+        parser.add_argument('--workers', type=int, help='количество процессов для разбора модулей')
+        parser.add_argument('--lazy', action='store_true', help='не формировать содержание модулей')
+        parser.add_argument('--save', help='файл для сохранения результатов (json)')
+        parser.add_argument('--compare', help='файл с ранее сохраненными результатами для сравнения')
+
+    def handle(self, *args, **options):
+        params = {key: options[key] for key in (
+            'depth', 'fanout', 'modules', 'graphics', 'parts', 'graphic_size', 'seed', 'bulk', 'workers', 'lazy')}
+        base_path = options['path'] or tempfile.mkdtemp(prefix='bench-import-')
+        path = os.path.join(base_path, 'publication')
+        if os.path.exists(path):
+            raise CommandError('Директория уже существует: %s' % path)
+
+        try:
+            start = time.perf_counter()
+            categories, modules, graphics = generate_publication(
+                path, options['depth'], options['fanout'], options['modules'], options['graphics'],
+                options['parts'], options['graphic_size'], options['seed'])
+            self.stdout.write('generated %d categories, %d modules, %d graphics in %.2f s at %s' % (
+                categories, modules, graphics, time.perf_counter() - start, path))
+            stages = self.run_import(path, options)
+        finally:
+            if not options['keep']:
+                shutil.rmtree(path, ignore_errors=True)
+                if not options['path']:
+                    shutil.rmtree(base_path, ignore_errors=True)
+
+        results = {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'params': params,
+            'stages': stages,
+            'total': {
+                'time': sum(stage['time'] for stage in stages),
+                'queries': sum(stage['queries'] for stage in stages),
+                'items': sum(stage['items'] for stage in stages),
+                'bytes_read': sum(stage['bytes_read'] for stage in stages),
+                'peak_memory': max(stage['peak_memory'] for stage in stages),
+            },
+        }
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)
+            if previous.get('params') != params:
+                self.stderr.write('parameters differ from compared results: %s' % previous.get('params'))
+        self.report(results, previous)
+
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write('results saved to %s' % options['save'])
+
+    def run_import(self, path, options):
+        """
+        Загружает публикацию во временную базу (см. throwaway_database), поэтому загрузка выполняется
+        с теми же транзакциями, что и обычно, и не затрагивает рабочую базу. Медиа-файлы, хранилище
+        и производные изображения создаются во временной папке рядом с публикацией и удаляются
+        """
+        media_root = os.path.join(os.path.dirname(path), 'media')
+        db_path = os.path.join(os.path.dirname(path), 'bench.sqlite3')
+        if os.path.exists(media_root):
+            raise CommandError('Директория уже существует: %s' % media_root)
+        if os.path.exists(db_path):
+            raise CommandError('Файл уже существует: %s' % db_path)
+
+        # пик памяти этапов считается по tracemalloc, память дочерних процессов не учитывается
+        tracemalloc.start()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, MEDIA_STORE_ROOT=None, IMAGE_DERIVATIVES_ROOT=None,
+                                   MEDIA_MANIFESTS_ROOT=None), \
+                    throwaway_database(db_path):
+                summary = load_publication(path, bulk=options['bulk'], workers=options['workers'],
+                                           lazy=options['lazy'] or None)
+        finally:
+            tracemalloc.stop()
+            shutil.rmtree(media_root, ignore_errors=True)
+        return [span.as_dict() for span in summary.spans]
+
+    def report(self, results, previous=None):
+        previous_stages = {}
+        if previous:
+            previous_stages = {stage['name']: stage for stage in previous['stages']}
+            previous_stages['total'] = previous['total']
+
+        rows = results['stages'] + [dict(results['total'], name='total')]
+        self.stdout.write('%-15s %8s %10s %10s %9s %12s' % (
+            'stage', 'items', 'read, KiB', 'time, s', 'queries', 'peak, KiB'))
+        for stage in rows:
+            line = '%-15s %8d %10.1f %10.3f %9d %12.1f' % (
+                stage['name'], stage['items'], stage['bytes_read'] / 1024, stage['time'], stage['queries'],
+                stage['peak_memory'] / 1024)
+            old = previous_stages.get(stage['name'])
+            if old:
+                line += '   time %+7.1f%%  queries %+d  peak %+7.1f%%' % (
+                    (stage['time'] / old['time'] - 1) * 100 if old['time'] else 0,
+                    stage['queries'] - old['queries'],
+                    (stage['peak_memory'] / old['peak_memory'] - 1) * 100 if old['peak_memory'] else 0)
+            self.stdout.write(line)
@@ -0,0 +1,82 @@
+import time
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Publication
+from core.utils import ModuleFile, create_nodes_bulk, get_childrens, get_tree_data
+
+
+def make_content(nodes, fanout, categories, modules_index):
+    """
+    Функция, создающая узел content синтетической публикации
+    :param int nodes: Количество узлов дерева
+    :param int fanout: Количество дочерних узлов у категории
+    :param int categories: Количество категорий среди дочерних узлов
+    :param dict modules_index: Индекс модулей для заполнения, см. load_modules_from_files
+    :return: узел content
+    :rtype: ETreeElement
+    """
+    content = ET.Element('content')
+    queue = [content]
+    created = 0
+    while created < nodes:
+        parent = queue.pop(0)
+        for i in range(fanout):
+            if created >= nodes:
+                break
+            created += 1
+            if i >= categories:
+                tech_name = 'Module %d' % created
+                dm_ref = ET.SubElement(parent, 'dmRef')
+                ET.SubElement(dm_ref, 'dmRefIdent').append(ET.Element('issueInfo', issueNumber='001'))
+                title = ET.SubElement(ET.SubElement(dm_ref, 'dmRefAddressItems'), 'dmTitle')
+                ET.SubElement(title, 'techName').text = tech_name
+                modules_index[(tech_name, '001')] = ModuleFile('DMC-%d.XML' % created, b'', '')
+            else:
+                entry = ET.SubElement(parent, 'pmEntry')
+                ET.SubElement(entry, 'pmEntryTitle').text = 'Category %d' % created
+                queue.append(entry)
+    return content
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает построение дерева публикации через get_childrens и get_tree_data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=10000, help='количество узлов дерева')
+        parser.add_argument('--fanout', type=int, default=10, help='количество дочерних узлов у категории')
+        parser.add_argument('--categories', type=int, default=3, help='количество категорий среди дочерних узлов')
+
+    def measure(self, func):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+        return result, len(queries), elapsed
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            publication = Publication.objects.create(title='bench', code='bench-tree', file_name='bench')
+            modules_index = {}
+            content = make_content(options['nodes'], options['fanout'], options['categories'], modules_index)
+            rows = create_nodes_bulk(content, publication, modules_index)
+            self.stdout.write('publication with %d rows created' % rows)
+
+            holder = []
+            results = [
+                ('get_childrens', self.measure(lambda: get_childrens(holder, publication) and holder)),
+                ('get_tree_data', self.measure(lambda: get_tree_data(publication))),
+            ]
+            for name, (data, queries, elapsed) in results:
+                self.stdout.write('%-15s queries: %6d  time: %8.3f s' % (name, queries, elapsed))
+            self.stdout.write('trees match: %s' % (results[0][1][0] == results[1][1][0]))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import cancel_job
+from core.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Отменяет задания загрузки публикаций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        for job_id in options['job_ids']:
+            try:
+                job = cancel_job(job_id)
+            except ImportJob.DoesNotExist:
+                raise CommandError('import job %d not found' % job_id)
+            self.stdout.write('job %d %s%s' % (job.pk, job.status, ', cancel requested' if job.status == ImportJob.RUNNING else ''))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.fields import decompress_value
+from core.models import Module
+
+
+class Command(BaseCommand):
+    help = 'Выводит степень сжатия и время распаковки content_xml модулей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-module', action='store_true', help='выводить строку для каждого модуля')
+
+    def handle(self, *args, **options):
+        table = connection.ops.quote_name(Module._meta.db_table)
+        count = 0
+        stored_total = 0
+        raw_total = 0
+        decode_total = 0.0
+        decode_max = 0.0
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, title, content_xml FROM %s WHERE is_category = %%s' % table, [False])
+            for pk, title, stored in cursor.fetchall():
+                stored = bytes(stored or b'')
+                start = time.perf_counter()
+                raw = decompress_value(stored)
+                decode = time.perf_counter() - start
+
+                count += 1
+                stored_total += len(stored)
+                raw_total += len(raw)
+                decode_total += decode
+                decode_max = max(decode_max, decode)
+                if options['per_module']:
+                    self.stdout.write('%8d  %10d -> %10d  x%6.2f  %8.3f ms  %s' % (
+                        pk, len(raw), len(stored), len(raw) / len(stored) if stored else 0, decode * 1000, title))
+
+        if not count:
+            self.stdout.write('no modules')
+            return
+        self.stdout.write('modules: %d' % count)
+        self.stdout.write('raw: %d bytes, stored: %d bytes, ratio: x%.2f' % (
+            raw_total, stored_total, raw_total / stored_total if stored_total else 0))
+        self.stdout.write('decode per module: mean %.3f ms, max %.3f ms' % (decode_total / count * 1000, decode_max * 1000))
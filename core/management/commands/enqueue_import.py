@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue_import
+
+
+class Command(BaseCommand):
+    help = 'Ставит загрузку публикаций в очередь фоновых заданий, задания выполняет команда import_worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='папки публикаций с файлом структуры PMC-...')
+        parser.add_argument('--update', action='store_true', help='загрузить новый выпуск (update_publication)')
+        parser.add_argument('--bulk', action='store_true', help='создавать модули и связи пачками')
+        parser.add_argument('--workers', type=int, default=None, help='процессов для разбора файлов модулей')
+        parser.add_argument('--lazy', action='store_true', default=None,
+                            help='формировать содержание модулей при первом запросе')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            job = enqueue_import(path, update=options['update'], bulk=options['bulk'],
+                                 workers=options['workers'], lazy=options['lazy'])
+            self.stdout.write('job %d queued: %s' % (job.pk, job.path))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.images import gc_image_derivatives, get_derivatives_root
+from core.utils import gc_media_store, get_media_store_root
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища медиа-файлов и папки производных изображений файлы, ' \
+           'на которые не ссылается ни одна публикация'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help='минимальный возраст удаляемого файла в секундах')
+
+    def handle(self, *args, **options):
+        removed = gc_media_store(options['min_age'])
+        self.stdout.write('%d files removed from %s' % (removed, get_media_store_root()))
+        removed = gc_image_derivatives(options['min_age'])
+        self.stdout.write('%d folders removed from %s' % (removed, get_derivatives_root()))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import gc_staging_publications
+
+
+class Command(BaseCommand):
+    help = 'Удаляет неопубликованные версии публикаций, оставшиеся от прерванных загрузок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=86400, help='минимальный возраст версии в секундах')
+
+    def handle(self, *args, **options):
+        removed = gc_staging_publications(options['min_age'])
+        self.stdout.write('%d publication versions removed' % removed)
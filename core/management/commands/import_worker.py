@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания загрузки публикаций из очереди в пуле дочерних процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='количество одновременных загрузок, по умолчанию IMPORT_JOB_PROCESSES')
+        parser.add_argument('--poll', type=float, default=1.0, help='период опроса очереди в секундах')
+        parser.add_argument('--once', action='store_true', help='завершиться, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        run_worker(options['processes'], options['poll'], options['once'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Module, ModulePart, SearchTerm
+from core.utils import index_modules
+
+
+class Command(BaseCommand):
+    help = 'Заново строит обратный индекс поиска и таблицу деталей модулей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='индексировать только модули без терминов')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        with transaction.atomic():
+            if not options['missing']:
+                SearchTerm.objects.all().delete()
+                ModulePart.objects.all().delete()
+            count = index_modules(Module.objects.all())
+        self.stdout.write('%d modules indexed in %.2f s, %d terms, %d parts' % (
+            count, time.time() - start, SearchTerm.objects.count(), ModulePart.objects.count()))
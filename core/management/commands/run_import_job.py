@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import run_job
+
+
+class Command(BaseCommand):
+    help = 'Выполняет одно задание загрузки в текущем процессе (запускается import_worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            job = run_job(options['job_id'])
+        except ValueError as err:
+            raise CommandError(err)
+        self.stdout.write('job %d %s' % (job.pk, job.status))
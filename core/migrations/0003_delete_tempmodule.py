@@ -0,0 +1,16 @@
+# Generated by Django 2.0.8 on 2026-10-18 10:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_auto_20180815_0848'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='TempModule',
+        ),
+    ]
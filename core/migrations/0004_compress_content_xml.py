@@ -0,0 +1,50 @@
+# Generated by Django 2.0.8 on 2026-10-18 10:44
+
+import core.fields
+from django.db import migrations
+
+
+def compress_content_xml(apps, schema_editor):
+    # значения без заголовка кодека читаются как есть и сжимаются при записи
+    for model_name in ('Module', 'Publication'):
+        model = apps.get_model('core', model_name)
+        rows = model.objects.using(schema_editor.connection.alias).values_list('id', 'content_xml')
+        for pk, content_xml in rows.iterator():
+            if content_xml:
+                model.objects.filter(pk=pk).update(content_xml=content_xml)
+
+
+def decompress_content_xml(apps, schema_editor):
+    connection = schema_editor.connection
+    for model_name in ('Module', 'Publication'):
+        table = connection.ops.quote_name(apps.get_model('core', model_name)._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, content_xml FROM %s' % table)
+            rows = cursor.fetchall()
+            for pk, content_xml in rows:
+                if content_xml and bytes(content_xml).startswith(core.fields.MARKER):
+                    cursor.execute(
+                        'UPDATE %s SET content_xml = %%s WHERE id = %%s' % table,
+                        [connection.Database.Binary(core.fields.decompress_value(content_xml)), pk]
+                    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_delete_tempmodule'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='module',
+            name='content_xml',
+            field=core.fields.CompressedBinaryField(blank=True, verbose_name='XML содержимое'),
+        ),
+        migrations.AlterField(
+            model_name='publication',
+            name='content_xml',
+            field=core.fields.CompressedBinaryField(blank=True, verbose_name='XML содержимое'),
+        ),
+        migrations.RunPython(compress_content_xml, decompress_content_xml),
+    ]
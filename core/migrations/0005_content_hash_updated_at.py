@@ -0,0 +1,36 @@
+# Generated by Django 2.0.8 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_compress_content_xml'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, verbose_name='хеш содержимого'),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='publication',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, verbose_name='хеш структуры'),
+        ),
+        migrations.AddField(
+            model_name='publication',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='дата изменения'),
+            preserve_default=False,
+        ),
+    ]
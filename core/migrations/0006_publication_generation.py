@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_content_hash_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publication',
+            name='generation',
+            field=models.IntegerField(default=0, verbose_name='номер загрузки'),
+        ),
+    ]
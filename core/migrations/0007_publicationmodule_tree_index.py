@@ -0,0 +1,17 @@
+# Generated by Django 2.0.8 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_publication_generation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='publicationmodule',
+            index=models.Index(fields=['publication', 'parent', 'order_in_parent'], name='core_pubmod_tree_idx'),
+        ),
+    ]
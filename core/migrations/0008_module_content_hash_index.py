@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_publicationmodule_tree_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='module',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=40, verbose_name='хеш содержимого'),
+        ),
+    ]
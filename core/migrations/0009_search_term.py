@@ -0,0 +1,35 @@
+# Generated by Django 2.0.8 on 2026-10-18 11:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_module_content_hash_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, verbose_name='термин')),
+                ('weight', models.IntegerField(default=1, verbose_name='вес')),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='core.Module')),
+            ],
+            options={
+                'verbose_name': 'термин поиска',
+                'verbose_name_plural': 'термины поиска',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', 'module', 'weight'], name='core_search_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', '-weight', 'module'], name='core_search_rank_idx'),
+        ),
+    ]
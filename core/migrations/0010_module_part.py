@@ -0,0 +1,38 @@
+# Generated by Django 2.0.8 on 2026-10-18 11:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_search_term'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModulePart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=200, verbose_name='номер детали')),
+                ('part_number_key', models.CharField(max_length=200, verbose_name='нормализованный номер детали')),
+                ('manufacturer_code', models.CharField(blank=True, max_length=50, verbose_name='код производителя')),
+                ('item', models.CharField(blank=True, max_length=50, verbose_name='номер позиции')),
+                ('figure_number', models.CharField(blank=True, max_length=50, verbose_name='номер рисунка')),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='core.Module')),
+            ],
+            options={
+                'verbose_name': 'деталь модуля',
+                'verbose_name_plural': 'детали модулей',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='modulepart',
+            index=models.Index(fields=['part_number_key', 'manufacturer_code'], name='core_part_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='modulepart',
+            index=models.Index(fields=['manufacturer_code'], name='core_part_manufacturer_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.0.8 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_module_part'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, verbose_name='путь к публикации')),
+                ('update', models.BooleanField(default=False, verbose_name='обновление')),
+                ('options', models.TextField(blank=True, verbose_name='параметры загрузки')),
+                ('status', models.CharField(choices=[('queued', 'в очереди'), ('running', 'выполняется'), ('done', 'выполнено'), ('failed', 'ошибка'), ('cancelled', 'отменено')], default='queued', max_length=20, verbose_name='состояние')),
+                ('publication_code', models.CharField(blank=True, max_length=200, verbose_name='код публикации')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='этап')),
+                ('stage_started_at', models.DateTimeField(blank=True, null=True, verbose_name='начало этапа')),
+                ('stages_json', models.TextField(blank=True, verbose_name='завершённые этапы')),
+                ('progress', models.FloatField(default=0, verbose_name='выполнено')),
+                ('error', models.TextField(blank=True, verbose_name='ошибка')),
+                ('publication_created', models.BooleanField(default=False, verbose_name='публикация создана заданием')),
+                ('cancel_requested_at', models.DateTimeField(blank=True, null=True, verbose_name='дата запроса отмены')),
+                ('worker_pid', models.IntegerField(blank=True, null=True, verbose_name='процесс')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='дата начала')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='дата завершения')),
+            ],
+            options={
+                'verbose_name': 'задание загрузки',
+                'verbose_name_plural': 'задания загрузки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='importjob',
+            index=models.Index(fields=['status', 'created_at'], name='core_import_job_status_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.8 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publication',
+            name='staging',
+            field=models.BooleanField(default=False, verbose_name='не опубликована'),
+        ),
+        migrations.AddField(
+            model_name='publication',
+            name='storage_key',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ключ медиа-файлов'),
+        ),
+    ]
@@ -1,14 +1,23 @@
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
+from core.fields import CompressedBinaryField
+
 # Create your models here.
 class Publication(models.Model):
     title = models.CharField(max_length=200, verbose_name=_('название'))    
     code = models.CharField(max_length=200, verbose_name=_('код'), unique=True)
     file_name = models.CharField(max_length=200, verbose_name=_('имя файла'))
     issue_number = models.CharField(max_length=200, verbose_name=_('номер версии'), blank=True)
-    content_xml = models.BinaryField(verbose_name=_('XML содержимое'), blank=True)
+    content_xml = CompressedBinaryField(verbose_name=_('XML содержимое'), blank=True)
     structure_json = models.TextField(verbose_name=_('JSON cтруктура'), blank=True)    
+    content_hash = models.CharField(max_length=40, verbose_name=_('хеш структуры'), blank=True)
+    updated_at = models.DateTimeField(verbose_name=_('дата изменения'), auto_now=True)
+    generation = models.IntegerField(verbose_name=_('номер загрузки'), default=0)
+    # папка медиа-файлов и манифеста изображений, пусто - совпадает с кодом (см. media_key)
+    storage_key = models.CharField(max_length=200, verbose_name=_('ключ медиа-файлов'), blank=True)
+    # загружаемая или заменённая версия публикации, не отдаётся API (см. core.utils.load_publication)
+    staging = models.BooleanField(verbose_name=_('не опубликована'), default=False)
     modules = models.ManyToManyField('Module', through='PublicationModule', through_fields=('publication', 'module'), blank=True)
 
     def __unicode__(self):
@@ -17,6 +26,10 @@ class Publication(models.Model):
     def __str__(self):
         return self.file_name
 
+    @property
+    def media_key(self):
+        return self.storage_key or self.code
+
     class Meta:
         verbose_name = _("публикация")
         verbose_name_plural = _("публикации")
@@ -28,8 +41,10 @@ class Module(models.Model):
     title = models.CharField(max_length=200, verbose_name=_('название'))
     file_name = models.CharField(max_length=200, verbose_name=_('имя файла'), blank=True)
     issue_number = models.CharField(max_length=200, verbose_name=_('номер версии'), blank=True)
-    content_xml = models.BinaryField(verbose_name=_('XML содержимое'), blank=True)
+    content_xml = CompressedBinaryField(verbose_name=_('XML содержимое'), blank=True)
     content_json = models.TextField(verbose_name=_('JSON содержимое'), blank=True)
+    content_hash = models.CharField(max_length=40, verbose_name=_('хеш содержимого'), blank=True, db_index=True)
+    updated_at = models.DateTimeField(verbose_name=_('дата изменения'), auto_now=True)
     is_category = models.BooleanField(verbose_name=_('категория'), default=False)
 
     def __unicode__(self):
@@ -52,11 +67,89 @@ class PublicationModule(models.Model):
     parent = models.ForeignKey(Module, on_delete=models.CASCADE, related_name='parents', related_query_name='parent', blank=True, null=True)
     order_in_parent = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['publication', 'parent', 'order_in_parent'], name='core_pubmod_tree_idx'),
+        ]
+
+
+class SearchTerm(models.Model):
+    '''
+    Обратный индекс для полнотекстового поиска по модулям: термин и его вес в модуле
+    '''
+    term = models.CharField(max_length=100, verbose_name=_('термин'))
+    module = models.ForeignKey(Module, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.IntegerField(verbose_name=_('вес'), default=1)
+
+    class Meta:
+        verbose_name = _("термин поиска")
+        verbose_name_plural = _("термины поиска")
+        indexes = [
+            models.Index(fields=['term', 'module', 'weight'], name='core_search_term_idx'),
+            models.Index(fields=['term', '-weight', 'module'], name='core_search_rank_idx'),
+        ]
 
-class TempModule(models.Model):
-    tech_name = models.CharField(max_length=200, verbose_name=_('полное название'), blank=True)
-    title = models.CharField(max_length=200, verbose_name=_('название'))
-    file_name = models.CharField(max_length=200, verbose_name=_('имя файла'), blank=True)
-    issue_number = models.CharField(max_length=200, verbose_name=_('номер версии'), blank=True)
-    content_xml = models.BinaryField(verbose_name=_('XML содержимое'), blank=True)
 
+class ModulePart(models.Model):
+    '''
+    Позиция каталога деталей модуля (catalogSeqNumber), для поиска модулей по номеру детали
+    '''
+    module = models.ForeignKey(Module, on_delete=models.CASCADE, related_name='parts')
+    part_number = models.CharField(max_length=200, verbose_name=_('номер детали'))
+    part_number_key = models.CharField(max_length=200, verbose_name=_('нормализованный номер детали'))
+    manufacturer_code = models.CharField(max_length=50, verbose_name=_('код производителя'), blank=True)
+    item = models.CharField(max_length=50, verbose_name=_('номер позиции'), blank=True)
+    figure_number = models.CharField(max_length=50, verbose_name=_('номер рисунка'), blank=True)
+
+    class Meta:
+        verbose_name = _("деталь модуля")
+        verbose_name_plural = _("детали модулей")
+        indexes = [
+            models.Index(fields=['part_number_key', 'manufacturer_code'], name='core_part_number_idx'),
+            models.Index(fields=['manufacturer_code'], name='core_part_manufacturer_idx'),
+        ]
+
+
+class ImportJob(models.Model):
+    '''
+    Задание на загрузку публикации, выполняется фоновым процессом (см. core.jobs)
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (QUEUED, _('в очереди')),
+        (RUNNING, _('выполняется')),
+        (DONE, _('выполнено')),
+        (FAILED, _('ошибка')),
+        (CANCELLED, _('отменено')),
+    )
+
+    path = models.CharField(max_length=500, verbose_name=_('путь к публикации'))
+    update = models.BooleanField(verbose_name=_('обновление'), default=False)
+    options = models.TextField(verbose_name=_('параметры загрузки'), blank=True)
+    status = models.CharField(max_length=20, verbose_name=_('состояние'), choices=STATUSES, default=QUEUED)
+    publication_code = models.CharField(max_length=200, verbose_name=_('код публикации'), blank=True)
+    stage = models.CharField(max_length=50, verbose_name=_('этап'), blank=True)
+    stage_started_at = models.DateTimeField(verbose_name=_('начало этапа'), blank=True, null=True)
+    stages_json = models.TextField(verbose_name=_('завершённые этапы'), blank=True)
+    progress = models.FloatField(verbose_name=_('выполнено'), default=0)
+    error = models.TextField(verbose_name=_('ошибка'), blank=True)
+    publication_created = models.BooleanField(verbose_name=_('публикация создана заданием'), default=False)
+    cancel_requested_at = models.DateTimeField(verbose_name=_('дата запроса отмены'), blank=True, null=True)
+    worker_pid = models.IntegerField(verbose_name=_('процесс'), blank=True, null=True)
+    created_at = models.DateTimeField(verbose_name=_('дата создания'), auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name=_('дата начала'), blank=True, null=True)
+    finished_at = models.DateTimeField(verbose_name=_('дата завершения'), blank=True, null=True)
+
+    def __str__(self):
+        return '%s %s' % (self.path, self.status)
+
+    class Meta:
+        verbose_name = _("задание загрузки")
+        verbose_name_plural = _("задания загрузки")
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='core_import_job_status_idx'),
+        ]
@@ -0,0 +1,249 @@
+import heapq
+import math
+import re
+from collections import defaultdict
+
+from django.db.models import Count, Max
+
+from core.models import Module, ModulePart, Publication, PublicationModule, SearchTerm
+
+
+# Веса терминов в зависимости от того, где они найдены в модуле
+WEIGHTS = {
+    'tech_name': 10,
+    'part_number': 8,
+    'manufacturer': 4,
+    'text': 1,
+}
+
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+MAX_QUERY_TERMS = 10
+
+WORD_RE = re.compile(r'\w[\w.\-/]*')
+
+
+def tokenize(text, parts=True):
+    """
+    Функция, разбивающая текст на термины поиска в нижнем регистре.
+    Слова с разделителями (PN-0001, 12.3/4) попадают в результат целиком и, при parts=True,
+    по частям, чтобы находились и полные обозначения, и их части
+    :param str text: Текст
+    :param bool parts: Добавлять части слов с разделителями
+    :return: термины в порядке появления, без повторов
+    :rtype: list
+    """
+    terms = []
+    seen = set()
+    for word in WORD_RE.findall((text or '').lower()):
+        word = word.strip('.-/')
+        words = [word]
+        if parts:
+            words += [part for part in re.split(r'[.\-/]+', word) if part != word]
+        for part in words:
+            part = part[:MAX_TERM_LENGTH]
+            if part and part not in seen:
+                seen.add(part)
+                terms.append(part)
+    return terms
+
+
+def get_search_terms(tech_name, content):
+    """
+    Функция, собирающая термины модуля и их веса из полного названия
+    и содержания, сформированного get_module_content
+    :param str tech_name: Полное название модуля
+    :param dict content: Содержание модуля (разобранный content_json)
+    :return: {термин: вес}
+    :rtype: dict
+    """
+    terms = {}
+
+    def add(text, weight):
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + weight
+
+    add(tech_name, WEIGHTS['tech_name'])
+    info = content.get('info', {})
+    if info.get('techName') != tech_name:
+        add(info.get('techName'), WEIGHTS['text'])
+    for part in content.get('data', {}).get('parts', []):
+        part_info = part.get('info', {})
+        add(part_info.get('partNumber'), WEIGHTS['part_number'])
+        add(part_info.get('code'), WEIGHTS['manufacturer'])
+    return terms
+
+
+# количество модулей для расчёта idf: (номер загрузки, количество)
+module_count = [None, 0]
+
+
+def get_published_modules(publication_code=None):
+    """
+    Функция, возвращающая id модулей опубликованных публикаций. Модули собираемых и заменённых
+    версий (staging, см. core.utils.publish_publication) в поиск не попадают
+    :param str publication_code: Только модули публикации с этим кодом
+    :return: queryset значений module_id для фильтра module__in / id__in
+    :rtype: QuerySet
+    """
+    links = PublicationModule.objects.filter(publication__staging=False)
+    if publication_code:
+        links = links.filter(publication__code=publication_code)
+    return links.values('module_id')
+
+
+def get_module_count():
+    """
+    Функция, возвращающая количество модулей (не категорий) опубликованных публикаций. Значение пересчитывается
+    только после новой загрузки публикации (см. core.utils.bump_generation)
+    :rtype: int
+    """
+    generation = Publication.objects.aggregate(generation=Max('generation'))['generation'] or 0
+    if module_count[0] != generation:
+        module_count[:] = [
+            generation, Module.objects.filter(is_category=False, id__in=get_published_modules()).count()
+        ]
+    return module_count[1]
+
+
+def normalize_part_number(part_number):
+    """
+    Функция, приводящая номер детали к виду для поиска: верхний регистр, без пробелов
+    :param str part_number: Номер детали
+    :rtype: str
+    """
+    return ''.join((part_number or '').split()).upper()
+
+
+def get_module_parts(content):
+    """
+    Функция, возвращающая позиции каталога деталей из содержания,
+    сформированного get_module_content
+    :param dict content: Содержание модуля (разобранный content_json)
+    :return: несохранённые экземпляры ModulePart без ссылки на модуль
+    :rtype: list
+    """
+    fields = {field.name: field.max_length for field in ModulePart._meta.get_fields() if getattr(field, 'max_length', None)}
+    parts = []
+    for part in content.get('data', {}).get('parts', []):
+        part_info = part.get('info', {})
+        part_number = (part_info.get('partNumber') or '').strip()
+        if not part_number:
+            continue
+        values = {
+            'part_number': part_number,
+            'part_number_key': normalize_part_number(part_number),
+            'manufacturer_code': (part_info.get('code') or '').strip().upper(),
+            'item': part.get('item') or '',
+            'figure_number': part.get('figureNumber') or '',
+        }
+        parts.append(ModulePart(**{name: value[:fields[name]] for name, value in values.items()}))
+    return parts
+
+
+def find_parts(part_number=None, manufacturer_code=None, prefix=False, limit=100):
+    """
+    Функция, ищущая позиции каталога деталей опубликованных модулей по номеру детали и/или коду производителя.
+    Поиск по префиксу выполняется диапазоном по индексу (part_number_key, manufacturer_code)
+    :param str part_number: Номер детали или его начало
+    :param str manufacturer_code: Код производителя
+    :param bool prefix: Искать номера, начинающиеся с part_number
+    :param int limit: Максимальное количество позиций
+    :return: позиции (номер, код производителя, модуль, позиция, рисунок, коды публикаций)
+        и флаг, что результатов больше limit
+    :rtype: list, bool
+    :raises ValueError: не задан ни номер детали, ни код производителя
+    """
+    key = normalize_part_number(part_number)
+    manufacturer_code = (manufacturer_code or '').strip().upper()
+    if not key and not manufacturer_code:
+        raise ValueError('part_number or manufacturer parameter required')
+
+    parts = ModulePart.objects.filter(module__in=get_published_modules())
+    if key and prefix:
+        parts = parts.filter(part_number_key__gte=key, part_number_key__lt=key + '\U0010ffff')
+    elif key:
+        parts = parts.filter(part_number_key=key)
+    if manufacturer_code:
+        parts = parts.filter(manufacturer_code=manufacturer_code)
+
+    rows = list(parts.order_by('part_number_key', 'manufacturer_code', 'module_id', 'id').values(
+        'part_number', 'manufacturer_code', 'module_id', 'module__title', 'item', 'figure_number')[:limit + 1])
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+
+    publications = defaultdict(list)
+    for module_id, code in PublicationModule.objects.filter(module_id__in=set(row['module_id'] for row in rows),
+                                                            publication__staging=False)\
+            .values_list('module_id', 'publication__code').distinct().order_by('publication__code'):
+        publications[module_id].append(code)
+    for row in rows:
+        row['module_title'] = row.pop('module__title')
+        row['publications'] = publications[row['module_id']]
+    return rows, truncated
+
+
+def search_modules(query, publication_code=None, offset=0, limit=20):
+    """
+    Функция, ищущая опубликованные модули, содержащие все термины запроса, по обратному индексу SearchTerm.
+    Результаты упорядочены по сумме весов терминов, умноженных на их обратную частоту (idf).
+    Для одного термина страница выбирается по индексу (term, -weight, module) без сортировки.
+    Для нескольких кандидаты берутся по самому редкому термину и проверяются по индексу
+    (term, module), поэтому время поиска определяется количеством модулей с самым
+    редким термином, а не размером базы
+    :param str query: Строка запроса
+    :param str publication_code: Искать только в модулях публикации с этим кодом
+    :param int offset: Смещение первой записи
+    :param int limit: Количество записей
+    :return: общее количество найденных модулей и страница результатов (id, title, tech_name, score)
+    :rtype: int, list
+    :raises ValueError: пустой запрос
+    """
+    # части составных обозначений индексируются вместе с ними, в запросе они не нужны
+    terms = tokenize(query, parts=False)[:MAX_QUERY_TERMS]
+    if not terms:
+        raise ValueError('empty search query')
+
+    postings = SearchTerm.objects.filter(module__in=get_published_modules(publication_code))
+
+    frequencies = dict(postings.filter(term__in=terms).values_list('term').annotate(count=Count('id')).order_by())
+    if len(frequencies) < len(terms):
+        return 0, []
+
+    total_modules = get_module_count() or 1
+    idf = {term: math.log(1 + total_modules / frequencies[term]) for term in terms}
+    terms.sort(key=lambda term: frequencies[term])
+
+    if len(terms) == 1:
+        term = terms[0]
+        total = frequencies[term]
+        page = [
+            (module_id, weight * idf[term])
+            for module_id, weight in postings.filter(term=term).order_by('-weight', 'module_id')
+            .values_list('module_id', 'weight')[offset:offset + limit]
+        ]
+    else:
+        scores = {
+            module_id: weight * idf[terms[0]]
+            for module_id, weight in postings.filter(term=terms[0]).values_list('module_id', 'weight')
+        }
+        for term in terms[1:]:
+            candidates = list(scores)
+            found = {}
+            # ограничиваем количество параметров запроса
+            for i in range(0, len(candidates), 500):
+                found.update(SearchTerm.objects.filter(term=term, module_id__in=candidates[i:i + 500])
+                             .values_list('module_id', 'weight'))
+            scores = {module_id: score + found[module_id] * idf[term]
+                      for module_id, score in scores.items() if module_id in found}
+        total = len(scores)
+        page = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))[offset:]
+
+    modules = {
+        row['id']: row
+        for row in Module.objects.filter(id__in=[module_id for module_id, score in page]).values('id', 'title', 'tech_name')
+    }
+    results = [
+        dict(modules[module_id], score=score)
+        for module_id, score in page if module_id in modules
+    ]
+    return total, results
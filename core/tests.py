@@ -1,3 +1,1641 @@
-from django.test import TestCase
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import warnings
+import xml.etree.ElementTree as ET
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import images, search, utils
+from core.fields import CODECS, MARKER, CompressedValue, compress_file, compress_value, decompress_value, open_value, \
+    register_codec
+from core.images import gc_image_derivatives, get_derivatives_root, get_manifest_path, get_publication_derivatives
+from core.instrumentation import ImportSummary
+from core.jobs import LOAD_STAGES, UPDATE_STAGES, ImportCancelled, JobProgress, cancel_job, claim_job, enqueue_import, \
+    finish_job, get_job_status, get_stage_weights, recover_jobs, run_job, run_worker
+from core.management.commands.bench_import import generate_publication
+from core.models import ImportJob, Module, ModulePart, Publication, PublicationModule, SearchTerm
+from core.search import find_parts, get_module_count, normalize_part_number, search_modules, tokenize
+from core.utils import collect_nodes, collect_nodes_stream, delete_publication, delete_retired_publications, \
+    ensure_module_content, gc_media_store, get_childrens, get_file_hash, get_media_index, get_media_manifest_path, \
+    get_media_store_root, get_module_content, get_publication_media_index, get_publication_media_path, \
+    get_publication_props, get_publication_store_paths, get_tree_children, get_tree_data, load_modules_from_files, \
+    load_publication, parce_modules, parse_module_file, update_publication, write_manifest
+
+PMC_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<pm><identAndStatusSection><pmAddress>'
+    '<pmIdent><issueInfo issueNumber="%(issue)s" inWork="00"/></pmIdent>'
+    '<pmAddressItems><pmTitle>Тестовая публикация</pmTitle></pmAddressItems>'
+    '</pmAddress><pmStatus><brexDmRef><dmRef><dmRefIdent><dmCode modelIdentCode="%(model)s" systemDiffCode="A" '
+    'systemCode="00" subSystemCode="0" subSubSystemCode="0" assyCode="00" disassyCode="00" '
+    'disassyCodeVariant="A" infoCode="022" infoCodeVariant="A" itemLocationCode="D"/></dmRefIdent></dmRef>'
+    '</brexDmRef></pmStatus></identAndStatusSection><content>%(content)s</content></pm>'
+)
+
+DM_REF_XML = (
+    '<dmRef><dmRefIdent><issueInfo issueNumber="%(issue)s" inWork="00"/></dmRefIdent>'
+    '<dmRefAddressItems><dmTitle><techName>%(tech_name)s</techName></dmTitle></dmRefAddressItems></dmRef>'
+)
+
+DMC_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<dmodule><identAndStatusSection><dmAddress>'
+    '<dmIdent><issueInfo issueNumber="%(issue)s" inWork="00"/></dmIdent>'
+    '<dmAddressItems><issueDate year="2018" month="08" day="15"/>'
+    '<dmTitle><techName>%(tech_name)s</techName></dmTitle></dmAddressItems>'
+    '</dmAddress></identAndStatusSection>'
+    '<content><illustratedPartsCatalog><figure id="fig">'
+    '<graphic infoEntityIdent="%(graphic)s" id="fig-1"><hotspot id="hs-1" applicationStructureIdent="1"/></graphic>'
+    '</figure>'
+    '<catalogSeqNumber item="001" figureNumber="01"><itemSeqNumber>'
+    '<quantityPerNextHigherAssy>2</quantityPerNextHigherAssy>'
+    '<partRef partNumberValue="%(part_number)s" manufacturerCodeValue="K%(number)04d"/>'
+    '</itemSeqNumber></catalogSeqNumber>'
+    '</illustratedPartsCatalog></content></dmodule>'
+)
+
+# Разделы публикации по умолчанию: (заголовок, [модули и подразделы])
+TREE = [
+    ('Раздел 1', ['Модуль 1', 'Модуль 2', ('Подраздел 1.1', ['Модуль 3'])]),
+    ('Раздел 2', ['Модуль 4', 'Модуль 5']),
+]
+
+CODE = 'TEST-A-00-0-0-00-00-A-022-A-D'
+OTHER_CODE = 'OTHER-A-00-0-0-00-00-A-022-A-D'
+
+
+def get_dm_ref(tech_name, issue='001'):
+    return DM_REF_XML % {'tech_name': tech_name, 'issue': issue}
+
+
+def write_module(path, tech_name, issue='001', part_number=None, graphic=None):
+    """
+    Функция, создающая файл модуля данных с одной иллюстрацией и одной позицией каталога
+    :param str path: Путь к директории публикации
+    :param str tech_name: Полное название модуля вида 'Модуль <номер>'
+    :param str issue: Номер выпуска
+    :param str part_number: Номер детали, по умолчанию PN-<номер модуля>
+    :param str graphic: Имя иллюстрации, по умолчанию ICN-<номер модуля по модулю 3>
+    :return: путь к файлу
+    :rtype: str
+    """
+    number = int(tech_name.split()[-1])
+    file_path = os.path.join(path, 'DMC-TEST-A-%05d-941A-D_%s-00_RU-RU.XML' % (number, issue))
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write(DMC_XML % {
+            'tech_name': tech_name,
+            'issue': issue,
+            'number': number,
+            'part_number': part_number or 'PN-%03d' % number,
+            'graphic': graphic or 'ICN-%d' % (number % 3),
+        })
+    return file_path
+
+
+def write_publication(path, tree=TREE, model='TEST', issue='001', modules=True):
+    """
+    Функция, создающая директорию публикации: файл структуры PMC-..., файлы модулей DMC-...
+    и папку graphics с иллюстрациями ICN-0..ICN-2
+    :param str path: Путь к директории
+    :param list tree: Узлы верхнего уровня: название модуля или (заголовок раздела, [узлы])
+    :param str model: modelIdentCode кода публикации
+    :param str issue: Номер выпуска публикации
+    :param bool modules: Создавать файлы модулей
+    """
+    os.makedirs(os.path.join(path, 'graphics'), exist_ok=True)
+    for i in range(3):
+        with open(os.path.join(path, 'graphics', 'ICN-%d.png' % i), 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n' + bytes([i]) * 64)
+
+    def render(nodes):
+        content = ''
+        for node in nodes:
+            if isinstance(node, str):
+                content += get_dm_ref(node)
+                if modules:
+                    write_module(path, node)
+            else:
+                content += '<pmEntry><pmEntryTitle>%s</pmEntryTitle>%s</pmEntry>' % (node[0], render(node[1]))
+        return content
+
+    with open(os.path.join(path, 'PMC-%s-00000-00_%s-00_RU-RU.XML' % (model, issue)), 'w', encoding='utf-8') as file:
+        file.write(PMC_XML % {'model': model, 'issue': issue, 'content': render(tree)})
+
+
+def get_tree(publication):
+    """
+    Функция, возвращающая дерево публикации из structure_json в виде [(заголовок, [дочерние узлы])]
+    """
+    def walk(nodes):
+        return [(node['text'], walk(node['children'])) for node in nodes]
+    return walk(json.loads(publication.structure_json)['core']['data'])
+
+
+def get_links(publication):
+    """
+    Функция, возвращающая связи публикации в виде (заголовок, заголовок родителя, порядок)
+    """
+    return sorted(PublicationModule.objects.filter(publication=publication)
+                  .values_list('module__title', 'parent__title', 'order_in_parent'), key=str)
+
+
+def get_store_path(file_path):
+    """
+    Функция, возвращающая путь к копии файла в хранилище медиа-файлов, см. core.utils.put_to_store
+    """
+    content_hash = get_file_hash(file_path)
+    return os.path.join(get_media_store_root(), content_hash[:2], content_hash + os.path.splitext(file_path)[1].lower())
+
+
+class MediaTestCase(TestCase):
+    """
+    Тест с временными директориями для публикаций и MEDIA_ROOT
+    """
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base, True)
+        media = override_settings(MEDIA_ROOT=os.path.join(self.base, 'media'),
+                                  MEDIA_MANIFESTS_ROOT=os.path.join(self.base, 'manifests'))
+        media.enable()
+        self.addCleanup(media.disable)
+        self.path = os.path.join(self.base, 'pub')
+        # количество модулей запоминается по номеру загрузки, а номера повторяются между тестами
+        search.module_count[:] = [None, 0]
+
+    def reset(self):
+        """
+        Удаляет загруженные публикации, модули и медиа-файлы
+        """
+        Publication.objects.all().delete()
+        Module.objects.all().delete()
+        shutil.rmtree(os.path.join(self.base, 'media'), ignore_errors=True)
+
+    def get_pmc_path(self, path=None):
+        return glob.glob(os.path.join(path or self.path, 'PMC-*.XML'))[0]
+
+    def get_dmc_path(self, number, path=None):
+        return glob.glob(os.path.join(path or self.path, 'DMC-TEST-A-%05d-*.XML' % number))[0]
+
+    def edit_file(self, file_path, old, new):
+        with open(file_path, encoding='utf-8') as file:
+            content = file.read()
+        self.assertIn(old, content)
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.write(content.replace(old, new, 1))
+
+
+class BulkLoadTests(MediaTestCase):
+    """
+    Создание дерева публикации пачками в одной транзакции (load_publication(bulk=True))
+    """
+
+    def test_bulk_tree_matches_default_mode(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        publication = Publication.objects.get(code=CODE)
+        tree, links = get_tree(publication), get_links(publication)
+        contents = sorted(Module.objects.filter(is_category=False).values_list('title', 'content_json'))
+        self.reset()
+
+        load_publication(self.path, bulk=True)
+
+        publication = Publication.objects.get(code=CODE)
+        self.assertEqual(get_tree(publication), tree)
+        self.assertEqual(get_links(publication), links)
+        self.assertEqual(sorted(Module.objects.filter(is_category=False).values_list('title', 'content_json')),
+                         contents)
+        self.assertEqual([title for title, children in tree], ['Раздел 1', 'Раздел 2'])
+        self.assertIn(('Подраздел 1.1', [('Модуль 3', [])]), tree[0][1])
+
+    def test_bulk_creates_nothing_when_a_module_is_missing(self):
+        write_publication(self.path)
+        os.remove(os.path.join(self.path, 'DMC-TEST-A-00004-941A-D_001-00_RU-RU.XML'))
+
+        with self.assertRaises(ValueError):
+            load_publication(self.path, bulk=True)
+
+        self.assertFalse(Module.objects.exists())
+        self.assertFalse(PublicationModule.objects.exists())
+
+
+class ParallelParseTests(MediaTestCase):
+    """
+    Разбор файлов модулей в пуле процессов (load_modules_from_files(workers=N))
+    """
+
+    def test_parse_module_file(self):
+        os.makedirs(self.path)
+        file_path = write_module(self.path, 'Модуль 7', issue='002')
+
+        tech_name, issue_number, file_name, content_xml, content_hash = parse_module_file(file_path)
+
+        self.assertEqual((tech_name, issue_number, file_name), ('Модуль 7', '002', os.path.basename(file_path)))
+        self.assertIn('PN-007'.encode('utf-8'), content_xml)
+        with open(file_path, 'rb') as file:
+            self.assertEqual(content_hash, hashlib.sha1(file.read()).hexdigest())
+
+    def test_process_pool_matches_sequential(self):
+        write_publication(self.path)
+        sequential = load_modules_from_files(self.path, workers=1)
+
+        parallel = load_modules_from_files(self.path, workers=2)
+
+        self.assertEqual(len(sequential[0]), 5)
+        self.assertEqual(parallel, sequential)
+
+    def test_load_publication_with_workers(self):
+        write_publication(self.path)
+
+        load_publication(self.path, workers=2)
+
+        publication = Publication.objects.get(code=CODE)
+        self.assertEqual(Module.objects.filter(is_category=False).count(), 5)
+        self.assertEqual(len(get_tree(publication)), 2)
+
+
+class ModuleIndexTests(MediaTestCase):
+    """
+    Индекс модулей публикации в памяти вместо таблицы TempModule
+    """
+
+    def test_index_by_tech_name_and_issue(self):
+        write_publication(self.path)
+        write_module(self.path, 'Модуль 1', issue='002')
+
+        modules_index, duplicates = load_modules_from_files(self.path)
+
+        self.assertEqual(len(modules_index), 6)
+        self.assertEqual(duplicates, {})
+        module_file = modules_index[('Модуль 1', '002')]
+        self.assertEqual(module_file.file_name, 'DMC-TEST-A-00001-941A-D_002-00_RU-RU.XML')
+        self.assertIn(b'PN-001', module_file.content_xml)
+
+    def test_duplicates_are_reported(self):
+        write_publication(self.path)
+        shutil.copy(os.path.join(self.path, 'DMC-TEST-A-00002-941A-D_001-00_RU-RU.XML'),
+                    os.path.join(self.path, 'DMC-TEST-A-00002-941A-D_001-00_RU-RU-COPY.XML'))
+
+        modules_index, duplicates = load_modules_from_files(self.path)
+
+        self.assertEqual(list(duplicates), [('Модуль 2', '001')])
+        self.assertEqual(len(duplicates[('Модуль 2', '001')]), 2)
+        with self.assertRaises(ValueError) as error:
+            load_publication(self.path)
+        self.assertIn('Модуль 2', str(error.exception))
+        self.assertFalse(Module.objects.exists())
+
+    def test_all_missing_modules_are_reported(self):
+        write_publication(self.path)
+        for number in (2, 5):
+            os.remove(os.path.join(self.path, 'DMC-TEST-A-%05d-941A-D_001-00_RU-RU.XML' % number))
+
+        with self.assertRaises(ValueError) as error:
+            load_publication(self.path)
+
+        self.assertIn('Модуль 2', str(error.exception))
+        self.assertIn('Модуль 5', str(error.exception))
+        self.assertFalse(Module.objects.exists())
+
+
+class MediaIndexTests(MediaTestCase):
+    """
+    Поиск иллюстраций модулей по индексу медиа-файлов публикации
+    """
+
+    def test_media_index(self):
+        media_path = os.path.join(self.base, 'media', 'pub_files', 'X')
+        os.makedirs(os.path.join(media_path, 'sub'))
+        for name in ('ICN-1.png', 'ICN-2.CGM', 'sub/ICN-1.jpg', 'sub/ICN-3.png'):
+            open(os.path.join(media_path, name), 'wb').close()
+
+        media_index = get_media_index(media_path)
+
+        self.assertEqual(media_index, {
+            'ICN-1': os.path.join(media_path, 'ICN-1.png'),
+            'ICN-2': os.path.join(media_path, 'ICN-2.CGM'),
+            'ICN-3': os.path.join(media_path, 'sub', 'ICN-3.png'),
+        })
+
+    def test_unresolved_graphics(self):
+        os.makedirs(self.path)
+        with open(write_module(self.path, 'Модуль 1', graphic='ICN-404'), 'rb') as file:
+            content_xml = file.read()
+        unresolved = set()
+
+        content = json.loads(get_module_content(content_xml, {'ICN-1': '/media/ICN-1.png'}, unresolved))
+
+        self.assertIsNone(content['data']['imgs'][0]['src'])
+        self.assertEqual(unresolved, {'ICN-404'})
+        content = json.loads(get_module_content(content_xml, {'ICN-404': '/media/ICN-404.png'}))
+        self.assertEqual(content['data']['imgs'][0]['src'], '/media/ICN-404.png')
+
+    def test_module_content_is_parsed_from_file(self):
+        os.makedirs(self.path)
+        with open(write_module(self.path, 'Модуль 1'), 'rb') as file:
+            content_xml = file.read()
+        media_index = {'ICN-1': '/media/ICN-1.png'}
+
+        content_json = get_module_content(open_value(compress_value(content_xml), chunk_size=100), media_index)
+
+        self.assertEqual(content_json, get_module_content(content_xml, media_index))
+        self.assertEqual(json.loads(content_json)['info']['techName'], 'Модуль 1')
+        with self.assertRaises(ValueError):
+            get_module_content(b'<dmodule><content/></dmodule>', media_index)
+
+    def test_modules_are_rendered_without_decompressing_content(self):
+        write_publication(self.path)
+        load_publication(self.path, lazy=True)
+        publication = Publication.objects.get(code=CODE)
+
+        with mock.patch('core.fields.decompress_value', side_effect=AssertionError('decompressed')):
+            count = parce_modules(publication, get_publication_media_index(CODE))
+
+        self.assertEqual(count, 5)
+        self.assertIn('PN-001', Module.objects.get(tech_name='Модуль 1').content_json)
+
+    def test_loaded_modules_reference_copied_graphics(self):
+        write_publication(self.path)
+
+        load_publication(self.path)
+
+        content = json.loads(Module.objects.get(tech_name='Модуль 4').content_json)
+        # изображения указываются путём в хранилище, не зависящим от публикации
+        self.assertEqual(content['data']['imgs'][0]['src'],
+                         get_store_path(os.path.join(self.base, 'media', 'pub_files', CODE, 'ICN-1.png')))
+        self.assertEqual(content['data']['parts'][0]['info']['partNumber'], 'PN-004')
+
+
+class TreeDataTests(MediaTestCase):
+    """
+    Построение дерева публикации одним запросом
+    """
+
+    def test_tree_data_matches_recursive_builder(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        publication = Publication.objects.get()
+        holder = []
+        get_childrens(holder, publication)
+
+        with self.assertNumQueries(1):
+            data = get_tree_data(publication)
+
+        self.assertEqual(data, holder)
+        self.assertEqual(json.loads(publication.structure_json)['core']['data'], data)
+
+    def test_tree_children_match_tree_data(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        publication = Publication.objects.get()
+
+        def walk(nodes, parent=None):
+            with self.assertNumQueries(1):
+                children = get_tree_children(publication, parent)
+            self.assertEqual(children, [dict(node, children=bool(node['children'])) for node in nodes])
+            for node in nodes:
+                walk(node['children'], node['id'])
+
+        walk(get_tree_data(publication))
+
+    def test_bench_tree(self):
+        out = io.StringIO()
+
+        call_command('bench_tree', nodes=50, fanout=5, categories=2, stdout=out)
+
+        self.assertIn('trees match: True', out.getvalue())
+        self.assertFalse(Publication.objects.exists())
+
+
+class StreamingParseTests(MediaTestCase):
+    """
+    Потоковый разбор файлов, размер которых не меньше IMPORT_STREAMING_THRESHOLD
+    """
+
+    def test_collect_nodes_stream_matches_tree(self):
+        write_publication(self.path)
+        modules_index = load_modules_from_files(self.path)[0]
+        root = ET.parse(self.get_pmc_path()).getroot()
+        modules, links = [], []
+        collect_nodes(root.find('content'), modules, links, modules_index)
+        stream_modules, stream_links = [], []
+
+        collect_nodes_stream(self.get_pmc_path(), stream_modules, stream_links, modules_index)
+
+        self.assertEqual(stream_links, links)
+        self.assertEqual([(module.title, module.is_category) for module in stream_modules],
+                         [(module.title, module.is_category) for module in modules])
+
+    def test_streaming_import_matches_default_mode(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        publication = Publication.objects.get(code=CODE)
+        props = (publication.title, publication.issue_number)
+        tree, links = get_tree(publication), get_links(publication)
+        contents = sorted(Module.objects.filter(is_category=False).values_list('title', 'content_json'))
+        self.reset()
+
+        with override_settings(IMPORT_STREAMING_THRESHOLD=1):
+            load_publication(self.path)
+
+        publication = Publication.objects.get(code=CODE)
+        self.assertEqual((publication.title, publication.issue_number), props)
+        self.assertEqual(get_tree(publication), tree)
+        self.assertEqual(get_links(publication), links)
+        self.assertEqual(sorted(Module.objects.filter(is_category=False).values_list('title', 'content_json')),
+                         contents)
+
+    @override_settings(IMPORT_STREAMING_THRESHOLD=1)
+    def test_streaming_keeps_original_file(self):
+        write_publication(self.path)
+        file_path = os.path.join(self.path, 'DMC-TEST-A-00001-941A-D_001-00_RU-RU.XML')
+        with open(file_path, 'rb') as file:
+            original = file.read()
+
+        content_xml, content_hash = parse_module_file(file_path)[3:]
+        # содержимое сжимается по частям и записывается в базу без повторного сжатия
+        self.assertIsInstance(content_xml, CompressedValue)
+        self.assertEqual(decompress_value(content_xml), original)
+        self.assertEqual(content_hash, hashlib.sha1(original).hexdigest())
+        self.assertEqual(get_publication_props(self.get_pmc_path())['code'], CODE)
+        module = Module.objects.create(title='Модуль 1', content_xml=content_xml)
+        self.assertEqual(get_stored_content_xml(Module, module.pk), content_xml)
+        self.assertEqual(Module.objects.get(pk=module.pk).content_xml, original)
+
+    @override_settings(IMPORT_STREAMING_THRESHOLD=1)
+    def test_streaming_reports_missing_modules(self):
+        write_publication(self.path)
+        os.remove(os.path.join(self.path, 'DMC-TEST-A-00004-941A-D_001-00_RU-RU.XML'))
+
+        with self.assertRaisesRegex(ValueError, 'Модуль 4'):
+            load_publication(self.path)
+
+        self.assertFalse(PublicationModule.objects.exists())
+
+
+def get_stored_content_xml(model, pk):
+    """
+    Функция, возвращающая значение content_xml в том виде, в котором оно записано в базе
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT content_xml FROM %s WHERE id = %%s' % model._meta.db_table, [pk])
+        return bytes(cursor.fetchone()[0])
+
+
+class CompressedBinaryFieldTests(TestCase):
+    """
+    Сжатие content_xml полем CompressedBinaryField
+    """
+
+    def test_round_trip(self):
+        content_xml = DMC_XML.encode('utf-8') * 20
+
+        module = Module.objects.create(title='Модуль 1', content_xml=content_xml)
+
+        stored = get_stored_content_xml(Module, module.pk)
+        self.assertTrue(stored.startswith(MARKER + b'zlib' + MARKER))
+        self.assertLess(len(stored), len(content_xml))
+        self.assertEqual(Module.objects.get(pk=module.pk).content_xml, content_xml)
+
+    def test_codecs(self):
+        register_codec('rev', lambda data: data[::-1], lambda data: data[::-1])
+        self.addCleanup(CODECS.pop, 'rev')
+        for codec in ('zlib', 'bz2', 'lzma', 'rev'):
+            self.assertEqual(decompress_value(compress_value(b'<dmodule/>', codec)), b'<dmodule/>')
+        with override_settings(CONTENT_XML_CODEC='lzma'):
+            module = Module.objects.create(title='Модуль 1', content_xml=b'<dmodule/>')
+        self.assertTrue(get_stored_content_xml(Module, module.pk).startswith(MARKER + b'lzma' + MARKER))
+        self.assertEqual(Module.objects.get(pk=module.pk).content_xml, b'<dmodule/>')
+        with self.assertRaises(ValueError):
+            decompress_value(MARKER + b'unknown' + MARKER + b'data')
+
+    def test_compress_file(self):
+        file_path = os.path.join(tempfile.mkdtemp(), 'DMC.XML')
+        self.addCleanup(shutil.rmtree, os.path.dirname(file_path))
+        content = DMC_XML.encode('utf-8') * 20
+        with open(file_path, 'wb') as file:
+            file.write(content)
+        register_codec('rev', lambda data: data[::-1], lambda data: data[::-1])
+        self.addCleanup(CODECS.pop, 'rev')
+
+        for codec in ('zlib', 'bz2', 'lzma', 'rev'):
+            value = compress_file(file_path, codec, chunk_size=100)
+            self.assertTrue(value.startswith(MARKER + codec.encode('ascii') + MARKER))
+            self.assertEqual(decompress_value(value), content)
+
+    def test_open_value(self):
+        content = DMC_XML.encode('utf-8') * 20
+        register_codec('rev', lambda data: data[::-1], lambda data: data[::-1])
+        self.addCleanup(CODECS.pop, 'rev')
+
+        for codec in ('zlib', 'bz2', 'lzma', 'rev'):
+            with open_value(compress_value(content, codec), chunk_size=100) as file:
+                self.assertEqual(file.read(), content)
+        with open_value(content) as file:
+            self.assertEqual(file.read(), content)
+
+    def test_plain_values_are_read_as_is(self):
+        module = Module.objects.create(title='Модуль 1')
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET content_xml = %%s WHERE id = %%s' % Module._meta.db_table,
+                           [b'<dmodule/>', module.pk])
+
+        self.assertEqual(Module.objects.get(pk=module.pk).content_xml, b'<dmodule/>')
+
+    def test_compression_report(self):
+        Module.objects.create(title='Модуль 1', content_xml=DMC_XML.encode('utf-8'))
+        out = io.StringIO()
+
+        call_command('compression_report', per_module=True, stdout=out)
+
+        self.assertIn('Модуль 1', out.getvalue())
+        self.assertIn('modules: 1', out.getvalue())
+
+
+class CompressContentMigrationTests(TransactionTestCase):
+    """
+    Миграция 0004, сжимающая уже записанные content_xml
+    """
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('core', target)])
+        return executor.loader.project_state(('core', target)).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_forward_and_backward(self):
+        apps = self.migrate('0003_delete_tempmodule')
+        module = apps.get_model('core', 'Module').objects.create(title='Модуль 1', content_xml=b'<dmodule/>')
+        publication = apps.get_model('core', 'Publication').objects.create(
+            title='Публикация', code=CODE, file_name='PMC.XML', content_xml=b'<pm/>')
+        empty = apps.get_model('core', 'Module').objects.create(title='Раздел 1', is_category=True)
+
+        self.migrate('0004_compress_content_xml')
+
+        self.assertTrue(get_stored_content_xml(Module, module.pk).startswith(MARKER))
+        self.assertTrue(get_stored_content_xml(Publication, publication.pk).startswith(MARKER))
+        self.assertEqual(get_stored_content_xml(Module, empty.pk), b'')
+        self.assertEqual(decompress_value(get_stored_content_xml(Module, module.pk)), b'<dmodule/>')
+
+        self.migrate('0003_delete_tempmodule')
+
+        self.assertEqual(get_stored_content_xml(Module, module.pk), b'<dmodule/>')
+        self.assertEqual(get_stored_content_xml(Publication, publication.pk), b'<pm/>')
+
+
+class LazyContentTests(MediaTestCase):
+    """
+    Формирование содержания модулей при первом обращении (load_publication(lazy=True))
+    """
+
+    def get_contents(self):
+        return sorted(Module.objects.filter(is_category=False).values_list('title', 'content_json'))
+
+    def test_lazy_content_matches_eager(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        contents = self.get_contents()
+        self.reset()
+
+        load_publication(self.path, lazy=True)
+
+        self.assertEqual(set(content_json for title, content_json in self.get_contents()), {''})
+        for module in Module.objects.filter(is_category=False):
+            self.assertEqual(ensure_module_content(module), module.content_json)
+        self.assertEqual(self.get_contents(), contents)
+
+    @override_settings(LAZY_MODULE_CONTENT=True)
+    def test_first_stored_content_is_kept(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 1')
+        # содержание уже записано другим процессом
+        Module.objects.filter(pk=module.pk).update(content_json='{"rendered": "elsewhere"}')
+
+        self.assertEqual(ensure_module_content(module), '{"rendered": "elsewhere"}')
+        category = Module.objects.get(title='Раздел 1')
+        self.assertEqual(ensure_module_content(category), '')
+
+    def test_media_index_manifest(self):
+        write_publication(self.path)
+        load_publication(self.path, lazy=True)
+        media_index = get_publication_media_index(CODE)
+        self.assertEqual(sorted(media_index), ['ICN-0', 'ICN-1', 'ICN-2'])
+
+        # манифест, заменённый другим процессом, перечитывается
+        write_manifest(get_media_manifest_path(CODE), {'index': dict(media_index, **{'ICN-1': '/other/ICN-1.png'})})
+        module = Module.objects.get(tech_name='Модуль 1')
+        self.assertIn('/other/ICN-1.png', ensure_module_content(module))
+        # публикация, загруженная до появления манифестов
+        os.remove(get_media_manifest_path(CODE))
+        self.assertIsNone(get_publication_media_index(CODE))
+        module = Module.objects.get(tech_name='Модуль 4')
+        self.assertIn(os.path.join(get_publication_media_path(CODE), 'ICN-1.png'), ensure_module_content(module))
+
+    def test_shared_content_of_legacy_publication_is_not_saved(self):
+        write_publication(self.path)
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER')
+        load_publication(self.path, lazy=True)
+        load_publication(other_path, lazy=True)
+        # публикации загружены до появления манифестов медиа-файлов
+        for code in (CODE, OTHER_CODE):
+            os.remove(get_media_manifest_path(code))
+        module = Module.objects.get(tech_name='Модуль 1')
+
+        content_json = ensure_module_content(module)
+
+        self.assertIn(get_publication_media_path(OTHER_CODE), content_json)
+        self.assertEqual(Module.objects.get(pk=module.pk).content_json, '')
+
+    def test_content_is_not_saved_before_media_is_ready(self):
+        write_publication(self.path)
+        src = get_store_path(os.path.join(self.path, 'graphics', 'ICN-1.png'))
+        rendered = []
+
+        def listener(summary, name, span):
+            if name == 'static_copy' and span is None:
+                module = Module.objects.get(tech_name='Модуль 1')
+                content_json = ensure_module_content(module)
+                self.assertIn('PN-001', content_json)
+                self.assertNotIn(src, content_json)
+                self.assertEqual(Module.objects.get(pk=module.pk).content_json, '')
+                rendered.append(name)
+
+        load_publication(self.path, lazy=True, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertEqual(rendered, ['static_copy'])
+        self.assertIn(src, ensure_module_content(Module.objects.get(tech_name='Модуль 1')))
+
+
+class UpdatePublicationTests(MediaTestCase):
+    """
+    Повторная загрузка нового выпуска публикации (update_publication)
+    """
+
+    def get_ids(self):
+        return dict(Module.objects.filter(is_category=False).values_list('tech_name', 'id'))
+
+    def test_first_update_loads_publication(self):
+        write_publication(self.path)
+
+        report = update_publication(self.path)
+
+        self.assertEqual((report['added'], report['static_copied']), (5, 3))
+        self.assertEqual(get_tree(Publication.objects.get(code=CODE))[0][0], 'Раздел 1')
+
+    def test_changed_module_is_updated_in_place(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        ids = self.get_ids()
+        self.edit_file(self.get_dmc_path(2), 'PN-002', 'PN-NEW')
+
+        report = update_publication(self.path)
+
+        self.assertEqual((report['changed'], report['unchanged'], report['added'], report['removed']), (1, 4, 0, 0))
+        self.assertEqual(self.get_ids(), ids)
+        self.assertIn('PN-NEW', Module.objects.get(pk=ids['Модуль 2']).content_json)
+        self.assertIn(b'PN-NEW', Module.objects.get(pk=ids['Модуль 2']).content_xml)
+
+    def test_added_and_removed_modules(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        ids = self.get_ids()
+        os.remove(self.get_dmc_path(5))
+        write_publication(self.path, tree=[TREE[0], ('Раздел 2', ['Модуль 6', 'Модуль 4'])])
+
+        report = update_publication(self.path)
+
+        self.assertEqual((report['added'], report['removed'], report['unchanged']), (1, 1, 4))
+        self.assertFalse(Module.objects.filter(tech_name='Модуль 5').exists())
+        self.assertEqual(self.get_ids()['Модуль 4'], ids['Модуль 4'])
+        self.assertIn('PN-006', Module.objects.get(tech_name='Модуль 6').content_json)
+        publication = Publication.objects.get(code=CODE)
+        tree, links = get_tree(publication), get_links(publication)
+        self.reset()
+        load_publication(self.path)
+        publication = Publication.objects.get(code=CODE)
+        self.assertEqual(get_tree(publication), tree)
+        self.assertEqual(get_links(publication), links)
+
+    def test_unchanged_publication(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        ids = self.get_ids()
+        links = get_links(Publication.objects.get(code=CODE))
+        section = list(PublicationModule.objects.filter(parent__title='Раздел 2').values_list('id', flat=True))
+        generation = Publication.objects.get(code=CODE).generation
+
+        report = update_publication(self.path)
+
+        self.assertEqual((report['changed'], report['unchanged'], report['static_copied']), (0, 5, 0))
+        self.assertEqual(self.get_ids(), ids)
+        self.assertEqual(get_links(Publication.objects.get(code=CODE)), links)
+        self.assertEqual(list(PublicationModule.objects.filter(parent__title='Раздел 2').values_list('id', flat=True)),
+                         section)
+        self.assertGreater(Publication.objects.get(code=CODE).generation, generation)
+
+    def test_changed_graphics_are_synced(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        media_path = os.path.join(self.base, 'media', 'pub_files', CODE)
+        with open(os.path.join(self.path, 'graphics', 'ICN-1.png'), 'wb') as file:
+            file.write(b'changed')
+        os.remove(os.path.join(self.path, 'graphics', 'ICN-2.png'))
+
+        report = update_publication(self.path)
+
+        self.assertEqual((report['static_copied'], report['static_removed']), (1, 1))
+        with open(os.path.join(media_path, 'ICN-1.png'), 'rb') as file:
+            self.assertEqual(file.read(), b'changed')
+        self.assertEqual(sorted(os.listdir(media_path)), ['ICN-0.png', 'ICN-1.png'])
+
+    def test_modules_with_changed_graphics_are_rendered_again(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 4')
+        graphic = os.path.join(self.path, 'graphics', 'ICN-1.png')
+        self.assertIn(get_store_path(graphic), module.content_json)
+        other_content = Module.objects.get(tech_name='Модуль 2').content_json
+        with open(graphic, 'wb') as file:
+            file.write(b'changed')
+
+        report = update_publication(self.path)
+
+        self.assertEqual(report['changed'], 0)
+        changed = Module.objects.get(tech_name='Модуль 4')
+        self.assertEqual(changed.pk, module.pk)
+        self.assertIn(get_store_path(graphic), changed.content_json)
+        self.assertEqual(Module.objects.get(tech_name='Модуль 2').content_json, other_content)
+
+    def test_module_rendered_during_update_is_rendered_again(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        # изменённый модуль ссылается на новое изображение
+        graphic = os.path.join(self.path, 'graphics', 'ICN-3.png')
+        with open(graphic, 'wb') as file:
+            file.write(b'new')
+        self.edit_file(self.get_dmc_path(4), 'ICN-1', 'ICN-3')
+        sync_static = utils.sync_static
+
+        def read_and_sync(*args, **kwargs):
+            # обращение к изменённому модулю до записи манифеста медиа-файлов
+            ensure_module_content(Module.objects.get(tech_name='Модуль 4'))
+            return sync_static(*args, **kwargs)
+
+        with mock.patch('core.utils.sync_static', side_effect=read_and_sync):
+            report = update_publication(self.path, lazy=True)
+
+        self.assertEqual(report['changed'], 1)
+        self.assertIn(get_store_path(graphic), ensure_module_content(Module.objects.get(tech_name='Модуль 4')))
+
+    @override_settings(IMAGE_DERIVATIVES=False)
+    def test_unchanged_graphics_are_not_hashed(self):
+        write_publication(self.path)
+        load_publication(self.path)
+
+        with mock.patch('core.utils.get_file_hash') as get_file_hash_mock:
+            report = update_publication(self.path)
+
+        self.assertEqual((report['static_copied'], report['static_removed']), (0, 0))
+        get_file_hash_mock.assert_not_called()
+
+
+class SharedModulesTests(MediaTestCase):
+    """
+    Модули, общие для нескольких публикаций, хранятся один раз
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.other_path = os.path.join(self.base, 'other')
+        write_publication(self.path)
+        write_publication(self.other_path, model='OTHER')
+
+    def assertShared(self):
+        self.assertEqual(Module.objects.filter(is_category=False).count(), 5)
+        for module in Module.objects.filter(is_category=False):
+            self.assertEqual(sorted(PublicationModule.objects.filter(module=module)
+                                    .values_list('publication__code', flat=True)), [OTHER_CODE, CODE])
+            self.assertIn(get_media_store_root(), module.content_json)
+
+    def test_second_publication_reuses_modules(self):
+        load_publication(self.path)
+        load_publication(self.other_path)
+
+        self.assertShared()
+        self.assertEqual(get_tree(Publication.objects.get(code=OTHER_CODE)),
+                         get_tree(Publication.objects.get(code=CODE)))
+
+    def test_bulk_load_reuses_modules(self):
+        load_publication(self.path, bulk=True)
+        load_publication(self.other_path, bulk=True)
+
+        self.assertShared()
+
+    def test_repeated_module_is_stored_once(self):
+        write_publication(self.path, tree=[('Раздел 1', ['Модуль 1']), ('Раздел 2', ['Модуль 1', 'Модуль 2'])])
+
+        load_publication(self.path, bulk=True)
+
+        self.assertEqual(Module.objects.filter(tech_name='Модуль 1').count(), 1)
+        self.assertEqual(PublicationModule.objects.filter(module__tech_name='Модуль 1').count(), 2)
+
+    def test_update_of_one_publication_keeps_the_other(self):
+        load_publication(self.path)
+        load_publication(self.other_path)
+        before = sorted(Publication.objects.get(code=CODE).modules.values_list('id', 'content_hash'))
+        self.edit_file(self.get_dmc_path(1, self.other_path), 'PN-001', 'PN-OTHER')
+
+        report = update_publication(self.other_path)
+
+        self.assertEqual(report['changed'], 1)
+        self.assertEqual(sorted(Publication.objects.get(code=CODE).modules.values_list('id', 'content_hash')), before)
+        self.assertEqual(Module.objects.filter(is_category=False).count(), 6)
+        changed = Publication.objects.get(code=OTHER_CODE).modules.get(tech_name='Модуль 1')
+        self.assertIn('PN-OTHER', changed.content_json)
+        self.assertIn(get_media_store_root(), changed.content_json)
+
+    def test_removed_shared_module_is_kept(self):
+        load_publication(self.path)
+        load_publication(self.other_path)
+        self.edit_file(self.get_pmc_path(self.other_path), get_dm_ref('Модуль 5'), '')
+
+        report = update_publication(self.other_path)
+
+        self.assertEqual(report['removed'], 1)
+        self.assertTrue(Publication.objects.get(code=CODE).modules.filter(tech_name='Модуль 5').exists())
+        self.assertFalse(Publication.objects.get(code=OTHER_CODE).modules.filter(tech_name='Модуль 5').exists())
+
+
+class BenchImportTests(MediaTestCase):
+    """
+    Синтетическая публикация и замеры этапов загрузки (bench_import)
+    """
+
+    def test_generated_publication_loads(self):
+        categories, modules, graphics = generate_publication(self.path, depth=2, fanout=2, modules=7, graphics=3,
+                                                             parts=2, graphic_size=16)
+
+        summary = load_publication(self.path)
+
+        self.assertEqual((categories, modules, graphics), (6, 7, 3))
+        self.assertEqual(Module.objects.filter(is_category=True).count(), 6)
+        self.assertEqual(Module.objects.filter(is_category=False).exclude(content_json='').count(), 7)
+        self.assertEqual(len(os.listdir(os.path.join(self.path, 'graphics'))), 3)
+        self.assertEqual([span.name for span in summary.spans], list(LOAD_STAGES))
+
+    def test_bench_import(self):
+        results = os.path.join(self.base, 'results.json')
+        bench_path = os.path.join(self.base, 'bench')
+        params = dict(depth=1, fanout=2, modules=4, graphics=2, parts=2, graphic_size=16)
+        out = io.StringIO()
+        databases = []
+
+        def load(*args, **kwargs):
+            # публикация загружается во временную базу без внешней транзакции
+            databases.append((connection.settings_dict['NAME'], connection.in_atomic_block))
+            return load_publication(*args, **kwargs)
+
+        with mock.patch('core.management.commands.bench_import.load_publication', side_effect=load):
+            call_command('bench_import', path=bench_path, save=results, stdout=out, **params)
+
+        self.assertEqual(databases, [(os.path.join(bench_path, 'bench.sqlite3'), False)])
+        call_command('bench_import', path=bench_path, compare=results, stdout=out, **params)
+
+        with open(results) as file:
+            saved = json.load(file)
+        self.assertEqual([stage['name'] for stage in saved['stages']], list(LOAD_STAGES))
+        self.assertIn('queries', out.getvalue())
+        self.assertFalse(Publication.objects.exists())
+        # медиа-файлы, хранилище и манифесты создаются во временной папке и удаляются вместе с ней
+        self.assertEqual(os.listdir(bench_path), [])
+        self.assertFalse(os.path.exists(os.path.join(self.base, 'media')))
+
+
+class ImportSummaryTests(MediaTestCase):
+    """
+    Замеры этапов загрузки (core.instrumentation)
+    """
+
+    def test_load_publication_summary(self):
+        write_publication(self.path)
+
+        with self.assertLogs('core.instrumentation', 'INFO') as logs:
+            summary = load_publication(self.path)
+
+        self.assertTrue(summary)
+        self.assertEqual(summary.code, CODE)
+        spans = {span.name: span for span in summary.spans}
+        self.assertEqual(list(spans), ['props', 'dmc_load', 'tree_build', 'static_copy', 'image_derivatives',
+                                       'structure_json', 'module_parse', 'search_index', 'publish', 'gc'])
+        self.assertEqual((spans['dmc_load'].items, spans['static_copy'].items, spans['module_parse'].items), (5, 3, 5))
+        self.assertGreater(spans['dmc_load'].bytes_read, 0)
+        self.assertGreater(spans['tree_build'].queries, 0)
+        self.assertEqual(summary.queries, sum(span.queries for span in summary.spans))
+        self.assertEqual([record.import_span['name'] for record in logs.records], list(spans))
+        self.assertEqual(summary.as_dict()['spans'][1], spans['dmc_load'].as_dict())
+
+    def test_span(self):
+        summary = ImportSummary('path')
+
+        with summary.span('count') as span:
+            span.items = 2
+            Module.objects.count()
+
+        self.assertEqual((summary.spans[0].items, summary.spans[0].queries), (2, 1))
+        self.assertGreaterEqual(summary.time, 0)
+        self.assertFalse(summary.spans[0].failed)
+
+    def test_failed_span(self):
+        listener = mock.Mock()
+        summary = ImportSummary('path', listener=listener)
+
+        with self.assertLogs('core.instrumentation', 'WARNING') as logs, self.assertRaises(ValueError):
+            with summary.span('parse') as span:
+                span.items = 3
+                Module.objects.count()
+                raise ValueError('broken module')
+
+        span = summary.spans[0]
+        self.assertEqual((span.name, span.items, span.queries, span.failed), ('parse', 3, 1, True))
+        self.assertGreaterEqual(span.time, 0)
+        self.assertIn('parse failed', logs.output[0])
+        self.assertTrue(logs.records[0].import_span['failed'])
+        # по прерванному этапу слушатель вызывается только в его начале
+        listener.assert_called_once_with(summary, 'parse', None)
+
+
+class SearchTests(MediaTestCase):
+    """
+    Полнотекстовый поиск модулей по обратному индексу SearchTerm
+    """
+
+    def get_titles(self, query, **kwargs):
+        return [result['title'] for result in search_modules(query, **kwargs)[1]]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Гайка PN-0001 12.3/4'), ['гайка', 'pn-0001', 'pn', '0001', '12.3/4', '12', '3', '4'])
+        self.assertEqual(tokenize('PN-0001, pn-0001', parts=False), ['pn-0001'])
+
+    def test_search_by_tech_name_and_part_number(self):
+        write_publication(self.path)
+        load_publication(self.path)
+
+        total, results = search_modules('модуль', limit=2)
+        self.assertEqual((total, len(results)), (5, 2))
+        self.assertEqual(len(search_modules('модуль', offset=4)[1]), 1)
+        self.assertEqual(self.get_titles('PN-002'), ['Модуль 2'])
+        self.assertEqual(self.get_titles('k0003'), ['Модуль 3'])
+        self.assertEqual(self.get_titles('модуль 4'), ['Модуль 4'])
+        self.assertEqual(self.get_titles('модуль отсутствует'), [])
+        with self.assertRaises(ValueError):
+            search_modules(' ,')
+
+    def test_ranking(self):
+        write_publication(self.path, tree=TREE + [('Раздел 3', ['Модуль 6'])])
+        write_module(self.path, 'Модуль 6', part_number='PN-1')
+        load_publication(self.path)
+
+        # совпадение в полном названии весит больше, чем номер детали
+        self.assertEqual(self.get_titles('1'), ['Модуль 1', 'Модуль 6'])
+
+    def test_search_in_publication(self):
+        write_publication(self.path, tree=[('Раздел 1', ['Модуль 1', 'Модуль 2'])])
+        load_publication(self.path)
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER', tree=[('Раздел 1', ['Модуль 2', 'Модуль 3'])])
+        load_publication(other_path)
+
+        self.assertEqual(sorted(self.get_titles('модуль')), ['Модуль 1', 'Модуль 2', 'Модуль 3'])
+        self.assertEqual(sorted(self.get_titles('модуль', publication_code=OTHER_CODE)), ['Модуль 2', 'Модуль 3'])
+
+    def test_lazy_modules_are_indexed(self):
+        write_publication(self.path)
+
+        load_publication(self.path, lazy=True)
+
+        self.assertEqual(self.get_titles('pn-005'), ['Модуль 5'])
+
+    def test_index_is_rebuilt_for_changed_modules_only(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        unchanged = list(SearchTerm.objects.filter(module__tech_name='Модуль 1').order_by('id').values_list('id'))
+        self.edit_file(self.get_dmc_path(2), 'PN-002', 'PN-NEW')
+
+        update_publication(self.path)
+
+        self.assertEqual(self.get_titles('pn-new'), ['Модуль 2'])
+        self.assertEqual(self.get_titles('pn-002'), [])
+        self.assertEqual(list(SearchTerm.objects.filter(module__tech_name='Модуль 1').order_by('id').values_list('id')),
+                         unchanged)
+
+    def test_rebuild_search_index(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        terms = sorted(SearchTerm.objects.values_list('term', 'module_id', 'weight'))
+        SearchTerm.objects.filter(module__tech_name='Модуль 1').delete()
+        out = io.StringIO()
+
+        call_command('rebuild_search_index', missing=True, stdout=out)
+        self.assertIn('1 modules indexed', out.getvalue())
+        call_command('rebuild_search_index', stdout=out)
+
+        self.assertEqual(sorted(SearchTerm.objects.values_list('term', 'module_id', 'weight')), terms)
+
+
+class PartLookupTests(MediaTestCase):
+    """
+    Поиск позиций каталога деталей по номеру детали (ModulePart)
+    """
+
+    def get_numbers(self, *args, **kwargs):
+        return [part['part_number'] for part in find_parts(*args, **kwargs)[0]]
+
+    def test_find_parts(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER', tree=[('Раздел 1', ['Модуль 2'])])
+        load_publication(other_path)
+
+        parts, truncated = find_parts(' pn-002 ')
+
+        self.assertFalse(truncated)
+        self.assertEqual(parts, [{
+            'part_number': 'PN-002', 'manufacturer_code': 'K0002', 'module_id': Module.objects.get(tech_name='Модуль 2').id,
+            'module_title': 'Модуль 2', 'item': '001', 'figure_number': '01', 'publications': [OTHER_CODE, CODE],
+        }])
+        self.assertEqual(normalize_part_number(' pn 002 '), 'PN002')
+        self.assertEqual(self.get_numbers('PN-00', prefix=True), ['PN-001', 'PN-002', 'PN-003', 'PN-004', 'PN-005'])
+        self.assertEqual(self.get_numbers('PN-00'), [])
+        self.assertEqual(self.get_numbers(manufacturer_code='k0004'), ['PN-004'])
+        self.assertEqual(self.get_numbers('PN-004', manufacturer_code='K0005'), [])
+        self.assertEqual(find_parts('PN', prefix=True, limit=2)[1], True)
+        with self.assertRaises(ValueError):
+            find_parts()
+
+    def test_parts_of_changed_module_are_refreshed(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        self.edit_file(self.get_dmc_path(2), 'PN-002', 'PN-NEW')
+
+        update_publication(self.path)
+
+        self.assertEqual(self.get_numbers('PN-NEW'), ['PN-NEW'])
+        self.assertEqual(self.get_numbers('PN-002'), [])
+        self.assertEqual(ModulePart.objects.count(), 5)
+
+
+class MediaStoreTests(MediaTestCase):
+    """
+    Хранилище медиа-файлов: каждый файл хранится один раз, публикации ссылаются на него жесткими ссылками
+    """
+
+    def get_store_files(self):
+        store = os.path.join(self.base, 'media', 'store')
+        return sorted(os.path.join(dir_path, file) for dir_path, dir_names, files in os.walk(store) for file in files)
+
+    def test_publications_share_stored_files(self):
+        write_publication(self.path)
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER')
+
+        load_publication(self.path)
+        load_publication(other_path)
+
+        store_files = self.get_store_files()
+        self.assertEqual(len(store_files), 3)
+        for store_path in store_files:
+            self.assertEqual(os.stat(store_path).st_nlink, 3)
+            self.assertEqual(os.path.basename(store_path), get_file_hash(store_path) + '.png')
+        for code in (CODE, OTHER_CODE):
+            target = os.path.join(get_publication_media_path(code), 'ICN-1.png')
+            self.assertTrue(any(os.path.samefile(target, store_path) for store_path in store_files))
+
+    def test_publication_can_be_loaded_again(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        Publication.objects.all().delete()
+        Module.objects.all().delete()
+
+        load_publication(self.path)
+
+        self.assertEqual(sorted(os.listdir(get_publication_media_path(CODE))), ['ICN-0.png', 'ICN-1.png', 'ICN-2.png'])
+
+    def test_unreferenced_files_are_collected(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        with open(os.path.join(self.path, 'graphics', 'ICN-1.png'), 'wb') as file:
+            file.write(b'changed')
+
+        self.assertEqual(update_publication(self.path)['static_copied'], 1)
+
+        # заменённый файл моложе min_age и остаётся в хранилище
+        self.assertEqual(len(self.get_store_files()), 4)
+        out = io.StringIO()
+        call_command('gc_media_store', min_age=0, stdout=out)
+        self.assertIn('1 files removed', out.getvalue())
+        self.assertEqual(len(self.get_store_files()), 3)
+        self.assertEqual(gc_media_store(min_age=0), 0)
+
+    def test_copy_when_hardlinks_are_not_supported(self):
+        write_publication(self.path)
+
+        with mock.patch('os.link', side_effect=OSError('not supported')):
+            load_publication(self.path)
+
+        target = os.path.join(get_publication_media_path(CODE), 'ICN-0.png')
+        with open(target, 'rb') as file:
+            self.assertEqual(file.read(), b'\x89PNG\r\n\x1a\n' + bytes([0]) * 64)
+        self.assertEqual(len(self.get_store_files()), 3)
+        # у скопированных файлов нет других жестких ссылок, но на них ссылается манифест публикации
+        self.assertEqual(gc_media_store(min_age=0), 0)
+        self.assertEqual(len(self.get_store_files()), 3)
+        delete_publication(CODE)
+        self.assertEqual(gc_media_store(min_age=0), 3)
+
+    def test_store_root_setting(self):
+        write_publication(self.path)
+        store = os.path.join(self.base, 'media', 'other-store')
+
+        with override_settings(MEDIA_STORE_ROOT=store):
+            load_publication(self.path)
+
+        self.assertEqual(self.get_store_files(), [])
+        self.assertEqual(sum(len(files) for dir_path, dir_names, files in os.walk(store)), 3)
+        with override_settings(MEDIA_STORE_ROOT=os.path.join(self.base, 'store')):
+            with self.assertRaises(ImproperlyConfigured):
+                get_media_store_root()
+
+    def test_gc_is_not_run_by_import(self):
+        write_publication(self.path)
+        load_publication(self.path)
+        with open(os.path.join(self.path, 'graphics', 'ICN-1.png'), 'wb') as file:
+            file.write(b'changed')
+
+        with mock.patch('core.utils.gc_media_store') as gc_mock:
+            update_publication(self.path)
+
+        gc_mock.assert_not_called()
+
+    def test_worker_collects_store_periodically(self):
+        with mock.patch('core.jobs.gc_media_store') as gc_mock:
+            run_worker(once=True)
+        gc_mock.assert_called_once_with()
+
+        with override_settings(MEDIA_STORE_GC_INTERVAL=None), mock.patch('core.jobs.gc_media_store') as gc_mock:
+            run_worker(once=True)
+        gc_mock.assert_not_called()
+
+
+@override_settings(IMAGE_PREVIEW_SIZE=100, IMAGE_TILE_SIZE=128, IMAGE_TILE_THRESHOLD=250)
+class ImageDerivativesTests(MediaTestCase):
+    """
+    Превью и тайлы крупных иллюстраций
+    """
+
+    def setUp(self):
+        super().setUp()
+        if images.Image is None:
+            self.skipTest('Pillow is not installed')
+
+    def write_image(self, name, size, path=None):
+        images.Image.new('RGB', size, (255, 0, 0)).save(os.path.join(path or self.path, 'graphics', name + '.png'))
+
+    def get_img(self, tech_name):
+        content = json.loads(Module.objects.get(tech_name=tech_name).content_json)
+        return content['data']['imgs'][0]
+
+    def get_derived_dirs(self):
+        root = get_derivatives_root()
+        return [name for name in os.listdir(root) if name != 'manifests']
+
+    def test_preview_and_tiles(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        self.write_image('ICN-1', (80, 60))
+
+        load_publication(self.path)
+
+        img = self.get_img('Модуль 3')
+        self.assertEqual(img['src'], get_store_path(os.path.join(self.path, 'graphics', 'ICN-0.png')))
+        self.assertEqual((img['width'], img['height']), (300, 200))
+        self.assertEqual((img['preview']['width'], img['preview']['height']), (100, 67))
+        self.assertTrue(os.path.exists(img['preview']['src']))
+        self.assertEqual((img['tiles']['size'], img['tiles']['columns'], img['tiles']['rows']), (128, 3, 2))
+        with images.Image.open(img['tiles']['src'].format(x=2, y=1)) as tile:
+            self.assertEqual(tile.size, (300 - 256, 200 - 128))
+        # небольшое изображение получает только размеры, повреждённое - ничего
+        self.assertEqual(set(self.get_img('Модуль 1')), {'src', 'id', 'width', 'height', 'hotspots'})
+        self.assertNotIn('width', self.get_img('Модуль 2'))
+
+    @override_settings(IMAGE_TILE_THRESHOLD=4096)
+    def test_identical_images_are_processed_once(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER')
+        self.write_image('ICN-0', (300, 200), other_path)
+
+        load_publication(self.path)
+        load_publication(other_path)
+
+        self.assertEqual(len(self.get_derived_dirs()), 1)
+        self.assertEqual(get_publication_derivatives(CODE)['ICN-0'], get_publication_derivatives(OTHER_CODE)['ICN-0'])
+        self.assertNotIn('tiles', get_publication_derivatives(CODE)['ICN-0'])
+
+    @override_settings(LAZY_MODULE_CONTENT=True)
+    def test_lazy_content_uses_manifest(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        load_publication(self.path)
+
+        module = Module.objects.get(tech_name='Модуль 3')
+        content = json.loads(ensure_module_content(module))
+
+        self.assertEqual(content['data']['imgs'][0]['preview'], get_publication_derivatives(CODE)['ICN-0']['preview'])
+
+    def test_update_rerenders_modules_with_changed_images(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        load_publication(self.path)
+        module = Module.objects.get(tech_name='Модуль 3')
+
+        self.write_image('ICN-0', (400, 200))
+        update_publication(self.path)
+
+        self.assertEqual(Module.objects.get(tech_name='Модуль 3').pk, module.pk)
+        self.assertEqual(self.get_img('Модуль 3')['width'], 400)
+
+    def test_images_above_pillow_limit(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        # изображение больше предела Pillow (DecompressionBombWarning), но меньше IMAGE_MAX_PIXELS
+        with mock.patch.object(images.Image, 'MAX_IMAGE_PIXELS', 40000):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                load_publication(self.path)
+            self.assertEqual(images.Image.MAX_IMAGE_PIXELS, 40000)
+
+        self.assertIn('preview', self.get_img('Модуль 3'))
+        self.assertFalse([item for item in caught if issubclass(item.category, images.Image.DecompressionBombWarning)])
+
+    def test_images_refused_by_pillow_are_skipped(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        # больше двух пределов Pillow изображение не открывается (DecompressionBombError)
+        with mock.patch.object(images.Image, 'MAX_IMAGE_PIXELS', 1000), \
+                self.assertLogs('core.images', 'WARNING') as logs:
+            load_publication(self.path)
+
+        self.assertIn('MAX_IMAGE_PIXELS', logs.output[0])
+        self.assertNotIn('width', self.get_img('Модуль 3'))
+
+    def test_failed_derivatives_are_skipped(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        with mock.patch.object(images.Image.Image, 'save', side_effect=OSError('No space left on device')), \
+                self.assertLogs('core.images', 'WARNING') as logs:
+            load_publication(self.path)
+
+        self.assertIn('No space left on device', logs.output[0])
+        self.assertNotIn('width', self.get_img('Модуль 3'))
+        self.assertEqual(os.listdir(os.path.join(get_derivatives_root(), self.get_derived_dirs()[0])), [])
+
+    def test_manifest_paths_are_relative(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        load_publication(self.path)
+
+        info_path = glob.glob(os.path.join(get_derivatives_root(), '*', '*', images.INFO_FILE))[0]
+        with open(info_path) as file:
+            info = json.load(file)
+        self.assertFalse(os.path.isabs(info['preview']['src']))
+        self.assertTrue(os.path.exists(self.get_img('Модуль 3')['preview']['src']))
+        # служебные манифесты хранятся вне MEDIA_ROOT (settings.MEDIA_MANIFESTS_ROOT)
+        self.assertEqual(os.path.dirname(get_media_manifest_path(CODE)), os.path.join(self.base, 'manifests'))
+        with open(get_media_manifest_path(CODE)) as file:
+            store_paths = json.load(file)['store']
+        self.assertFalse([path for item in store_paths.items() for path in item if os.path.isabs(path)])
+        self.assertTrue(all(os.path.exists(path) for path in get_publication_store_paths(CODE).values()))
+
+    def test_unreferenced_derivatives_are_collected(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        load_publication(self.path)
+        prefix = self.get_derived_dirs()[0]
+        os.makedirs(os.path.join(get_derivatives_root(), prefix, 'ab' * 20 + '.1.tmp'))
+
+        self.assertEqual(gc_image_derivatives(min_age=0), 1)
+        self.assertEqual(len(os.listdir(os.path.join(get_derivatives_root(), prefix))), 1)
+        delete_publication(CODE)
+        out = io.StringIO()
+        call_command('gc_media_store', min_age=0, stdout=out)
+        self.assertIn('1 folders removed', out.getvalue())
+        self.assertEqual(os.listdir(os.path.join(get_derivatives_root(), prefix)), [])
+
+    @override_settings(IMAGE_MAX_PIXELS=10000)
+    def test_images_above_max_pixels_are_skipped(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        with self.assertLogs('core.images', 'WARNING') as logs:
+            load_publication(self.path)
+
+        self.assertIn('300x200', logs.output[0])
+        self.assertNotIn('width', self.get_img('Модуль 3'))
+
+    def test_replaced_manifest_is_read_again(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+        load_publication(self.path)
+        derivatives = get_publication_derivatives(CODE)
+        self.assertEqual(sorted(derivatives), ['ICN-0'])
+
+        # манифест заменён загрузкой в другом процессе
+        write_manifest(get_manifest_path(CODE), {'ICN-0': dict(derivatives['ICN-0'], width=1)})
+
+        self.assertEqual(get_publication_derivatives(CODE)['ICN-0']['width'], 1)
+        delete_publication(CODE)
+        self.assertEqual(get_publication_derivatives(CODE), {})
+
+    @override_settings(IMAGE_DERIVATIVES=False)
+    def test_disabled(self):
+        write_publication(self.path)
+        self.write_image('ICN-0', (300, 200))
+
+        load_publication(self.path)
+
+        self.assertNotIn('width', self.get_img('Модуль 3'))
+        self.assertEqual(get_publication_derivatives(CODE), {})
+
+
+class ImportJobTests(MediaTestCase):
+    """
+    Очередь заданий загрузки
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+
+    def test_run_job(self):
+        job = enqueue_import(self.path, lazy=True)
+
+        job = run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual((job.progress, job.stage), (1.0, ''))
+        self.assertEqual(job.publication_code, CODE)
+        # опубликованная публикация при ошибке не удаляется
+        self.assertFalse(job.publication_created)
+        self.assertEqual([stage['name'] for stage in json.loads(job.stages_json)],
+                         [name for name in LOAD_STAGES if name != 'module_parse'])
+        self.assertEqual(Module.objects.filter(is_category=False, content_json='').count(), 5)
+        status = get_job_status(job)
+        self.assertEqual((status['status'], status['eta']), (ImportJob.DONE, None))
+
+    def test_update_job(self):
+        load_publication(self.path)
+        job = enqueue_import(self.path, update=True)
+
+        run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertFalse(job.publication_created)
+        self.assertEqual(tuple(stage['name'] for stage in json.loads(job.stages_json)), UPDATE_STAGES)
+
+    def test_failed_job(self):
+        job = enqueue_import(os.path.join(self.base, 'missing'))
+
+        run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn('Traceback', job.error)
+        with self.assertRaises(ValueError):
+            run_job(job.pk)
+
+    def test_cancel_queued_job(self):
+        job = enqueue_import(self.path)
+
+        cancel_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.CANCELLED)
+        self.assertIsNotNone(job.finished_at)
+        with self.assertRaises(ValueError):
+            run_job(job.pk)
+
+    def test_cancel_running_job_removes_publication(self):
+        job = enqueue_import(self.path)
+        ImportJob.objects.filter(pk=job.pk).update(status=ImportJob.RUNNING)
+        progress = JobProgress(job)
+
+        def listener(summary, name, span):
+            if name == 'module_parse' and span is None:
+                cancel_job(job.pk)
+            progress(summary, name, span)
+
+        with self.assertRaises(ImportCancelled):
+            load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+        self.assertTrue(job.publication_created)
+        self.assertTrue(Publication.objects.get(code=job.publication_code).staging)
+        finish_job(job, ImportJob.CANCELLED)
+
+        self.assertFalse(Publication.objects.exists())
+        self.assertFalse(Module.objects.exists())
+        self.assertFalse(os.path.exists(get_publication_media_path(CODE)))
+
+    def test_cancel_is_ignored_after_publish(self):
+        job = enqueue_import(self.path)
+        progress = JobProgress(job)
+
+        def listener(summary, name, span):
+            if name == 'publish' and span is not None:
+                ImportJob.objects.filter(pk=job.pk).update(cancel_requested_at=timezone.now())
+            progress(summary, name, span)
+
+        load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertFalse(Publication.objects.get(code=CODE).staging)
+        with self.assertRaises(ImportCancelled):
+            progress(ImportSummary(self.path), 'props', None)
+
+    def test_update_job_cancel_is_ignored_after_tree_build(self):
+        load_publication(self.path)
+        job = enqueue_import(self.path, update=True)
+        ImportJob.objects.filter(pk=job.pk).update(cancel_requested_at=timezone.now())
+        progress = JobProgress(ImportJob.objects.get(pk=job.pk))
+
+        with self.assertRaises(ImportCancelled):
+            progress(ImportSummary(self.path), 'tree_build', None)
+        for stage in ('static_copy', 'module_parse', 'search_index'):
+            progress(ImportSummary(self.path), stage, None)
+
+    def test_claim_skips_running_path(self):
+        first = enqueue_import(self.path)
+        second = enqueue_import(self.path)
+        other = enqueue_import(os.path.join(self.base, 'other'))
+
+        self.assertEqual(claim_job().pk, first.pk)
+        self.assertEqual(claim_job().pk, other.pk)
+        self.assertIsNone(claim_job())
+        self.assertEqual(ImportJob.objects.get(pk=second.pk).status, ImportJob.QUEUED)
+
+    def test_recover_jobs(self):
+        job = enqueue_import(self.path)
+        # процесса с таким номером нет
+        ImportJob.objects.filter(pk=job.pk).update(status=ImportJob.RUNNING, started_at=timezone.now(),
+                                                   worker_pid=2 ** 30)
+
+        self.assertEqual(recover_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ImportJob.FAILED, 'import process terminated'))
+
+    def test_stage_weights(self):
+        self.assertEqual(set(get_stage_weights(False).values()), {1 / len(LOAD_STAGES)})
+        run_job(enqueue_import(self.path).pk)
+
+        weights = get_stage_weights(False)
+
+        self.assertEqual(set(weights), set(LOAD_STAGES))
+        self.assertAlmostEqual(sum(weights.values()), 1.0)
+
+
+class PublishTests(MediaTestCase):
+    """
+    Новая версия публикации собирается скрытой и заменяет прежнюю одной транзакцией
+    """
+
+    def setUp(self):
+        super().setUp()
+        write_publication(self.path)
+
+    def test_staging_version_replaces_live_one(self):
+        load_publication(self.path)
+        live = Publication.objects.get(code=CODE)
+        self.edit_file(self.get_dmc_path(1), 'PN-001', 'PN-STAGED')
+        checked = []
+
+        def listener(summary, name, span):
+            if name == 'publish' and span is None:
+                staging = Publication.objects.get(code=summary.code)
+                self.assertTrue(staging.staging)
+                self.assertTrue(staging.code.startswith(CODE + '~'))
+                self.assertEqual(Publication.objects.get(code=CODE).pk, live.pk)
+                checked.append(name)
+
+        load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertEqual(checked, ['publish'])
+        published = Publication.objects.get(code=CODE)
+        self.assertNotEqual(published.pk, live.pk)
+        self.assertFalse(published.staging)
+        self.assertGreater(published.generation, live.generation)
+        self.assertIn('PN-STAGED', published.modules.get(tech_name='Модуль 1').content_json)
+        retired = Publication.objects.get(pk=live.pk)
+        self.assertTrue(retired.staging)
+        self.assertTrue(retired.code.startswith(CODE + '~'))
+        # медиа-папка прежней версии остаётся на месте, новая собрана в своей папке
+        self.assertNotEqual(published.media_key, retired.media_key)
+        self.assertTrue(os.path.isdir(get_publication_media_path(published.media_key)))
+        self.assertTrue(os.path.isdir(get_publication_media_path(retired.media_key)))
+
+    def test_staging_modules_are_not_searched(self):
+        load_publication(self.path)
+        self.edit_file(self.get_dmc_path(1), 'PN-001', 'PN-STAGED')
+        checked = []
+
+        def listener(summary, name, span):
+            if name == 'publish' and span is None:
+                self.assertEqual(search_modules('pn-staged'), (0, []))
+                self.assertEqual(find_parts('PN-STAGED'), ([], False))
+                self.assertEqual(get_module_count(), 5)
+                checked.append(name)
+
+        load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+
+        self.assertEqual(checked, ['publish'])
+        self.assertEqual(search_modules('pn-staged')[0], 1)
+        self.assertEqual(find_parts('PN-STAGED')[0][0]['publications'], [CODE])
+        # модуль заменённой версии
+        self.assertEqual(find_parts('PN-001'), ([], False))
+        self.assertEqual(get_module_count(), 5)
+
+    def test_retired_version_is_deleted_after_ttl(self):
+        load_publication(self.path)
+        self.edit_file(self.get_dmc_path(1), 'PN-001', 'PN-RETIRED')
+        load_publication(self.path)
+        retired = Publication.objects.get(staging=True)
+
+        self.assertEqual(delete_retired_publications(60), 0)
+        self.assertEqual(delete_retired_publications(0), 1)
+
+        self.assertEqual(list(Publication.objects.values_list('code', flat=True)), [CODE])
+        self.assertFalse(ModulePart.objects.filter(part_number='PN-001').exists())
+        self.assertEqual(Module.objects.filter(is_category=False).count(), 5)
+        self.assertFalse(os.path.exists(get_publication_media_path(retired.media_key)))
+        # содержание ссылается на хранилище и не зависит от удалённой версии
+        for module in Module.objects.filter(is_category=False):
+            self.assertIn(get_media_store_root(), module.content_json)
+
+    def test_abandoned_builds_are_collected(self):
+        def listener(summary, name, span):
+            if name == 'publish' and span is None:
+                raise ValueError('import failed')
+
+        with self.assertRaises(ValueError):
+            load_publication(self.path, summary=ImportSummary(self.path, listener=listener))
+        self.assertTrue(Publication.objects.get().staging)
+        out = io.StringIO()
+
+        call_command('gc_publications', min_age=0, stdout=out)
+
+        self.assertIn('1 publication versions removed', out.getvalue())
+        self.assertFalse(Publication.objects.exists())
+        self.assertFalse(Module.objects.exists())
+
+    def test_delete_publication_resets_shared_content(self):
+        other_path = os.path.join(self.base, 'other')
+        write_publication(other_path, model='OTHER')
+        load_publication(self.path)
+        load_publication(other_path)
+        module = Module.objects.get(tech_name='Модуль 1')
+        content_json = module.content_json
+        # содержание, сформированное до перехода на пути в хранилище
+        legacy = Module.objects.get(tech_name='Модуль 2')
+        Module.objects.filter(pk=legacy.pk).update(
+            content_json=json.dumps({'src': os.path.join(get_publication_media_path(CODE), 'ICN-2.png')}))
+
+        self.assertTrue(delete_publication(CODE))
+
+        self.assertFalse(delete_publication(CODE))
+        self.assertEqual(Module.objects.filter(is_category=False).count(), 5)
+        self.assertEqual(Module.objects.get(pk=module.pk).content_json, content_json)
+        self.assertEqual(Module.objects.get(pk=legacy.pk).content_json, '')
+        self.assertIn(get_media_store_root(), ensure_module_content(legacy))
+        self.assertFalse(os.path.exists(get_publication_media_path(CODE)))
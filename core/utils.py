@@ -1,15 +1,38 @@
 import os
 import codecs
+import hashlib
+import io
 import xml.etree.ElementTree as ET
 import json
+from collections import namedtuple, defaultdict
+from datetime import timedelta
+import time
+import uuid
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils import timezone
+from django.db.models import BinaryField, Exists, ExpressionWrapper, F, Max, OuterRef, Q
 import shutil
 import logging
-
-from core.models import Module, Publication, PublicationModule, TempModule
+import threading
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from core.fields import compress_file, open_value
+from core.images import build_publication_derivatives, get_derivatives_root, get_manifest_path, get_manifests_root, \
+    get_media_url, get_publication_derivatives
+from core.instrumentation import ImportSummary
+from core.models import Module, ModulePart, Publication, PublicationModule, SearchTerm
+from core.search import get_module_parts, get_search_terms
 
 logger = logging.getLogger(__name__)
 
+# Файл модуля данных, загруженный в индекс публикации
+ModuleFile = namedtuple('ModuleFile', ('file_name', 'content_xml', 'content_hash'))
+
 def get_publication_file(path):
     """
     Функция,проверяющая наличие модуля публикации в указанной папке
@@ -30,27 +53,66 @@ def get_publication_file(path):
         return os.path.join(path, publication_files[0]), publication_files[0]
 
 
-def get_publication_props(file_path):
+def use_streaming(file_path):
     """
-    Открываем файл публикации и получаем оттуда все нужные параметры
-    :param str file_path: Путь к файлу публикации
-    :return: Объект со свойствами, аналогичными модели публикации, а именно
-    - str title
-    - str code
-    - int issue_number
-    - str content_xml
-    :rtype: obj
-    :raises ValueError: ошибка при разборе публикации
+    Функция, определяющая, нужно ли разбирать файл потоково (iterparse), не строя дерево целиком
+    :param str file_path: Путь к файлу
+    :return: True, если размер файла не меньше settings.IMPORT_STREAMING_THRESHOLD
+    :rtype: bool
     """
-    file = codecs.open(file_path, 'r', encoding="utf8", errors='replace')
-    tree = ET.parse(file)
-    root = tree.getroot()
+    threshold = getattr(settings, 'IMPORT_STREAMING_THRESHOLD', None)
+    return threshold is not None and os.path.getsize(file_path) >= threshold
+
+
+def get_content_hash(data):
+    """
+    Функция, возвращающая хеш содержимого, по которому определяется изменение модуля или публикации
+    :param bytes data: Содержимое
+    :return: sha1 в шестнадцатеричном виде
+    :rtype: str
+    """
+    return hashlib.sha1(data).hexdigest()
+
 
+def read_file_bytes(file_path):
+    """
+    Функция, возвращающая содержимое файла без разбора
+    :param str file_path: Путь к файлу
+    :return: содержимое файла
+    :rtype: bytes
+    """
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def find_first_element(file_path, tag):
+    """
+    Функция, потоково читающая xml файл до конца первого элемента с указанным тегом.
+    Остаток файла не читается
+    :param str file_path: Путь к файлу
+    :param str tag: Тег искомого элемента
+    :return: найденный элемент или None
+    :rtype: ETreeElement
+    """
+    with codecs.open(file_path, 'r', encoding="utf8", errors='replace') as file:
+        for event, elem in ET.iterparse(file, events=('end',)):
+            if elem.tag == tag:
+                return elem
+    return None
+
+
+def get_publication_ident(identAndStatusSection):
+    """
+    Функция, получающая параметры публикации из раздела identAndStatusSection
+    :param ETreeElement identAndStatusSection: Узел identAndStatusSection файла публикации
+    :return: название, код и номер выпуска публикации
+    :rtype: str, str, str
+    :raises ValueError: ошибка при разборе публикации
+    """
     title = False
     code = False
     issue_number = False
 
-    identAndStatusSection = root.find('identAndStatusSection')
     if not identAndStatusSection:
         raise ValueError('there is no identAndStatusSection in file')
 
@@ -76,16 +138,45 @@ def get_publication_props(file_path):
             code += '-' + dmCode.get('itemLocationCode')
 
     if title and code and issue_number:
-        return{
-            'title': title,
-            'code': code,
-            'issue_number': issue_number,
-            'content_xml': ET.tostring(root, encoding="utf-8", method="xml")
-        }
+        return title, code, issue_number
     else:
         raise ValueError('publication file incomplete')
 
 
+def get_publication_props(file_path):
+    """
+    Открываем файл публикации и получаем оттуда все нужные параметры.
+    Большие файлы (см. use_streaming) читаются потоково только до конца identAndStatusSection,
+    а content_xml - исходное содержимое файла, сжатое по частям (см. core.fields.compress_file),
+    поэтому файл не читается в память целиком
+    :param str file_path: Путь к файлу публикации
+    :return: Объект со свойствами, аналогичными модели публикации, а именно
+    - str title
+    - str code
+    - int issue_number
+    - str content_xml
+    :rtype: obj
+    :raises ValueError: ошибка при разборе публикации
+    """
+    if use_streaming(file_path):
+        identAndStatusSection = find_first_element(file_path, 'identAndStatusSection')
+        title, code, issue_number = get_publication_ident(identAndStatusSection)
+        content_xml = compress_file(file_path)
+    else:
+        file = codecs.open(file_path, 'r', encoding="utf8", errors='replace')
+        tree = ET.parse(file)
+        root = tree.getroot()
+        title, code, issue_number = get_publication_ident(root.find('identAndStatusSection'))
+        content_xml = ET.tostring(root, encoding="utf-8", method="xml")
+
+    return{
+        'title': title,
+        'code': code,
+        'issue_number': issue_number,
+        'content_xml': content_xml
+    }
+
+
 def create_module_publication_link(module, publication, parent=None, order=0):
     """
     Функция, создающая модуль-категорию и связь модуля и публикации
@@ -125,6 +216,7 @@ def create_category(node, publication, parent=None, order=0):
 
     cat = Module(
         title=title,
+        content_hash=get_content_hash(title.encode('utf-8')),
         is_category=True
     )
     cat.save()
@@ -133,133 +225,256 @@ def create_category(node, publication, parent=None, order=0):
     return cat, link
 
 
-def get_media_path(img_name, media_path):
+def get_media_index(media_path, store_paths=None):
+    """
+    Функция, строящая индекс медиа-файлов публикации по их именам.
+    Файлы, перенесённые через хранилище (см. sync_static), указываются путём в хранилище: он зависит
+    только от содержимого файла, поэтому содержание модулей, общих для нескольких публикаций,
+    не ссылается на медиа-папку одной из них
+    :param str media_path: Путь к директории с медиа-объектами
+    :param dict store_paths: Пути файлов в хранилище {путь к файлу в медиа-папке: путь к файлу в хранилище}
+    :return: словарь {имя файла без расширения: относительный путь к файлу}
+    :rtype: dict
+    """
+    store_paths = store_paths or {}
+    media_index = {}
+    for dir_path, dir_names, files in os.walk(media_path):
+        dir_names.sort()
+        for file in sorted(files):
+            file_name = file.split('.')[0]
+            if file_name not in media_index:
+                abs_path = os.path.join(dir_path, file)
+                media_index[file_name] = get_media_url(store_paths.get(abs_path, abs_path))
+    return media_index
+
+
+def get_media_path(img_name, media_index, unresolved=None):
     """
     Функция, возвращающая путь к файлу в медиа-папке по его имени
     :param str img_name: Имя файла без расширения
-    :param str media_path: Путь к директория с медиа-объектами
-    :return: Относительный путь к файлу
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param set unresolved: Множество для сбора имён, для которых не найден файл
+    :return: Относительный путь к файлу или None, если файл не найден
     :rtype: str
-    :raises ValueError:не найден указанный файл
-    """
-    files = os.listdir(media_path)
-    full_file_name = ''
-    for file in files:
-        file_name = file.split('.')[0]
-        if file_name == img_name:
-            full_file_name = file
-            break
-    abs_path = os.path.join(media_path, full_file_name)
-    rel_path = abs_path.replace(settings.BASE_DIR, '')
+    """
+    rel_path = media_index.get(img_name)
+    if rel_path is None and unresolved is not None:
+        unresolved.add(img_name)
     return rel_path
 
 
-def get_module_content(content_xml, media_path):
+def get_module_info(identAndStatusSection):
     """
-    Функция, возвращающая содержание модуля, преобразованное для просмотра
-    :param str content_xml: xml структура модуля
-    :param str media_path: путь к директории размещения медиа-контента
-    :return content_json: json строка содержания модуля
-    :rtype: str
-    :raises ValueError: ошибка при разборе xml документа
+    Функция, возвращающая параметры модуля из раздела identAndStatusSection
+    :param ETreeElement identAndStatusSection: Узел identAndStatusSection модуля
+    :return: номер выпуска, дата выпуска и полное название модуля
+    :rtype: dict
     """
-    content = {}
-    parser = ET.XMLParser(encoding="utf-8")
-    root = ET.XML(content_xml, parser=parser)
-    #print(content_xml)
-    #tree = etree.fromstring(content_xml)
-    
-    info = content['info'] = {}
-    data = content['data'] = {}
-
-    #find info
-    dmAddress = root.find('identAndStatusSection').find('dmAddress')
+    info = {}
+    dmAddress = identAndStatusSection.find('dmAddress')
     issueInfo = dmAddress.find('dmIdent').find('issueInfo')
     info['issueNumber'] = issueInfo.get('issueNumber')
     info['inWork'] = issueInfo.get('inWork')
     dmAddressItems = dmAddress.find('dmAddressItems')
-    issueDate = dmAddressItems.find('issueDate')    
+    issueDate = dmAddressItems.find('issueDate')
     info['issueDate'] = issueDate.get('day')+'.'+issueDate.get('month')+'.'+issueDate.get('year')
     info['techName'] = dmAddressItems.find('dmTitle').find('techName').text
+    return info
 
-    #find imgs
-    illustratedPartsCatalog = root.find('content').find('illustratedPartsCatalog')
-    if illustratedPartsCatalog:
-        figure = illustratedPartsCatalog.find('figure')
-        data['imgs'] = []
-        if figure:
-            imgs = figure.findall('graphic')            
-            for img in imgs:
-                img_obj = {}
-                img_obj['src'] = get_media_path(img.get('infoEntityIdent'), media_path)
-                img_obj['id'] = img.get('id')
-                img_obj['hotspots'] = []
-                hotspots = img.findall('hotspot')
-                for hs in hotspots:
-                    hs_obj = hs.attrib
-                    img_obj['hotspots'].append(hs_obj)
-
-                data['imgs'].append(img_obj)
-
-        #find parts
-        data['parts'] = []
-        parts = illustratedPartsCatalog.findall('catalogSeqNumber')
-        for part in parts:
-            part_obj = part.attrib
-            part_obj['info'] = {}
-            itemSeqNumber = part.find('itemSeqNumber')
-            part_obj['info']['quantityquantity'] = itemSeqNumber.find('quantityPerNextHigherAssy').text
-            part_obj['info']['partNumber'] = itemSeqNumber.find('partRef').get('partNumberValue')
-            part_obj['info']['code'] = itemSeqNumber.find('partRef').get('manufacturerCodeValue')
-            data['parts'].append(part_obj)
 
+def get_figure_imgs(figure, media_index, unresolved=None, derivatives=None):
+    """
+    Функция, возвращающая изображения иллюстрации каталога с точками привязки
+    :param ETreeElement figure: Узел figure
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param set unresolved: Множество для сбора ненайденных медиа-файлов
+    :param dict derivatives: Размеры, превью и тайлы изображений, см. core.images.build_publication_derivatives
+    :rtype: list
+    """
+    imgs = []
+    for img in figure.findall('graphic'):
+        img_obj = {}
+        img_obj['src'] = get_media_path(img.get('infoEntityIdent'), media_index, unresolved)
+        img_obj['id'] = img.get('id')
+        if derivatives and img.get('infoEntityIdent') in derivatives:
+            img_obj.update(derivatives[img.get('infoEntityIdent')])
+        img_obj['hotspots'] = []
+        hotspots = img.findall('hotspot')
+        for hs in hotspots:
+            hs_obj = hs.attrib
+            img_obj['hotspots'].append(hs_obj)
+        imgs.append(img_obj)
+    return imgs
+
+
+def get_catalog_part(catalogSeqNumber):
+    """
+    Функция, возвращающая позицию каталога деталей
+    :param ETreeElement catalogSeqNumber: Узел catalogSeqNumber
+    :rtype: dict
+    """
+    part_obj = catalogSeqNumber.attrib
+    part_obj['info'] = {}
+    itemSeqNumber = catalogSeqNumber.find('itemSeqNumber')
+    part_obj['info']['quantityquantity'] = itemSeqNumber.find('quantityPerNextHigherAssy').text
+    part_obj['info']['partNumber'] = itemSeqNumber.find('partRef').get('partNumberValue')
+    part_obj['info']['code'] = itemSeqNumber.find('partRef').get('manufacturerCodeValue')
+    return part_obj
+
+
+def get_module_content(content_xml, media_index, unresolved=None, derivatives=None):
+    """
+    Функция, возвращающая содержание модуля, преобразованное для просмотра.
+    Документ разбирается потоково (iterparse): разобранные разделы и позиции каталога сразу удаляются
+    из дерева, поэтому в памяти не строится дерево всего модуля. Вместе с файловым объектом,
+    распаковывающим значение по частям (см. core.fields.open_value), модуль целиком в памяти не находится
+    :param content_xml: xml структура модуля (str, bytes) или файловый объект с ней
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param set unresolved: Множество для сбора ненайденных медиа-файлов
+    :param dict derivatives: Размеры, превью и тайлы изображений, см. core.images.build_publication_derivatives
+    :return content_json: json строка содержания модуля
+    :rtype: str
+    :raises ValueError: ошибка при разборе xml документа
+    """
+    if isinstance(content_xml, str):
+        content_xml = content_xml.encode('utf-8')
+    if isinstance(content_xml, (bytes, bytearray, memoryview)):
+        content_xml = io.BytesIO(content_xml)
+
+    content = {}
+    info = content['info'] = {}
+    data = content['data'] = {}
+    stack = []
+    section = content_section = catalog = figure = None
+    catalog_size = 0
+    imgs = []
+    parts = []
+    for event, elem in ET.iterparse(content_xml, events=('start', 'end')):
+        if event == 'start':
+            if len(stack) == 1 and elem.tag == 'content' and content_section is None:
+                content_section = elem
+            elif len(stack) == 2 and stack[1] is content_section and elem.tag == 'illustratedPartsCatalog' \
+                    and catalog is None:
+                catalog = elem
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            break
+        if parent is catalog:
+            # используются первая иллюстрация и позиции каталога
+            catalog_size += 1
+            if elem.tag == 'figure' and figure is None:
+                figure = elem
+                if len(figure):
+                    imgs = get_figure_imgs(figure, media_index, unresolved, derivatives)
+            elif elem.tag == 'catalogSeqNumber':
+                parts.append(get_catalog_part(elem))
+        elif elem is catalog and catalog_size:
+            data['imgs'] = imgs
+            data['parts'] = parts
+        elif len(stack) == 1 and elem.tag == 'identAndStatusSection' and section is None:
+            section = elem
+            info.update(get_module_info(section))
+        if parent is catalog or parent is content_section or len(stack) == 1:
+            # разобранный узел больше не нужен
+            parent.remove(elem)
+
+    if section is None:
+        raise ValueError('there is no identAndStatusSection in module')
+    if content_section is None:
+        raise ValueError('there is no content in module')
     content_json = json.dumps(content)
     return content_json
 
 
-def create_end_module(node, parent=None, publication=None, order=None):
+def get_end_module_props(node):
     """
-    Функция, создающая модуль
-    :param ETreeElement node: Узел, для которого создается модуль
-    :param Module parent: Экземпляр класса Модуль - родительский модуль
-    :param Publication publication: Экземпляр публикации, к которой будет привязан модуль
-    :param int order: Порядок следования модуля в родителе
-    :return: экземпляр вновь созданного модуля и экземпляр связи с публикацией
-    :rtype: Module, ModulePublication
+    Функция, возвращающая параметры модуля из ссылки dmRef в файле публикации
+    :param ETreeElement node: Узел dmRef
+    :return: полное название и номер выпуска модуля
+    :rtype: str, str
     :raises ValueError: ошибка при поиске параметров, нужных для создания модуля
     """
     tech_name = node.find('dmRefAddressItems').find('dmTitle').find('techName').text
     issue_number = node.find('dmRefIdent').find('issueInfo').get('issueNumber')
     if not tech_name or not issue_number:
         raise ValueError('Не хватает данных для создания модуля')
+    return tech_name, issue_number
+
+
+def get_indexed_module(modules_index, tech_name, issue_number):
+    """
+    Функция, возвращающая загруженный из файла модуль по его названию и номеру выпуска
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param str tech_name: Полное название модуля
+    :param str issue_number: Номер выпуска модуля
+    :return: имя файла и xml содержимое модуля
+    :rtype: ModuleFile
+    :raises ValueError: модуль не найден
+    """
     try:
-        temp_module = TempModule.objects.get(tech_name=tech_name, issue_number=issue_number)
-    except TempModule.DoesNotExist:
-        raise ValueError('В папке публикации не найдено файла для модуля: %s c номером выпуска: %d' % (tech_name, issue_number))
-    except TempModule.MultipleObjectsReturned:
-        raise ValueError('В папке публикации найдено несколько модулей: %s c номером выпуска: %d' % (tech_name, issue_number))
+        return modules_index[(tech_name, issue_number)]
+    except KeyError:
+        raise ValueError('В папке публикации не найдено файла для модуля: %s c номером выпуска: %s' % (tech_name, issue_number))
+
 
-    new_module = Module(
+def build_end_module(node, modules_index):
+    """
+    Функция, создающая несохранённый экземпляр модуля по ссылке dmRef
+    :param ETreeElement node: Узел, для которого создается модуль
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :return: несохранённый экземпляр модуля
+    :rtype: Module
+    :raises ValueError: ошибка при поиске параметров, нужных для создания модуля
+    """
+    tech_name, issue_number = get_end_module_props(node)
+    module_file = get_indexed_module(modules_index, tech_name, issue_number)
+
+    return Module(
         tech_name = tech_name,
         issue_number = issue_number,
         title = tech_name,
-        file_name = temp_module.file_name,
-        content_xml = temp_module.content_xml,
-        #content_json = json,
+        file_name = module_file.file_name,
+        content_xml = module_file.content_xml,
+        content_hash = module_file.content_hash,
         is_category = False
     )
-    new_module.save()
+
+
+def create_end_module(node, parent=None, publication=None, order=None, modules_index=None):
+    """
+    Функция, создающая модуль
+    :param ETreeElement node: Узел, для которого создается модуль
+    :param Module parent: Экземпляр класса Модуль - родительский модуль
+    :param Publication publication: Экземпляр публикации, к которой будет привязан модуль
+    :param int order: Порядок следования модуля в родителе
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :return: экземпляр вновь созданного (или уже сохранённого с тем же содержимым) модуля и экземпляр связи с публикацией
+    :rtype: Module, ModulePublication
+    :raises ValueError: ошибка при поиске параметров, нужных для создания модуля
+    """
+    new_module = build_end_module(node, modules_index)
+    existing = get_existing_modules([new_module])
+    key = (new_module.content_hash, new_module.tech_name, new_module.issue_number)
+    if key in existing:
+        new_module.id = existing[key]
+    else:
+        new_module.save()
     link = create_module_publication_link(new_module, publication, parent, order)
 
     return new_module, link
 
 
-def create_nodes(node, parent=None, publication=None):
+def create_nodes(node, parent=None, publication=None, modules_index=None):
     """
     Функция, рекурсивно создающая модули и категории для переданного узла
     :param ETreeElement node: Узел, для которого осуществляется поиск
     :param Module parent: Экземпляр класса Модуль - родительский модуль
     :param Publication publication: экземпляр модели публикации, для которой создаются модули
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
     :return: результат выполнения операции - True при успешном выполнении
     :rtype: bool
     :raises ValueError: ошибки при создании модулей
@@ -270,7 +485,7 @@ def create_nodes(node, parent=None, publication=None):
         if child.tag == 'dmRef':
             counter_end_nodes += 1
             try:
-                create_end_module(child, parent, publication, counter_end_nodes)
+                create_end_module(child, parent, publication, counter_end_nodes, modules_index)
             except Exception as err:
                 if parent:
                     raise ValueError('Ошибка при создании модуля №%d для узла %s: %s'%(counter_end_nodes, parent.title, err))
@@ -279,86 +494,440 @@ def create_nodes(node, parent=None, publication=None):
         elif child.tag == 'pmEntry':
             counter_categories += 1
             new_category, link = create_category(child, publication, parent=parent, order=counter_categories)
-            create_nodes(child, parent=new_category, publication=publication)
+            create_nodes(child, parent=new_category, publication=publication, modules_index=modules_index)
 
     return True
 
 
-def load_modules_from_files(path):
+def collect_nodes(node, modules, links, modules_index, parent=None):
     """
-    Функция, загружающая все модули из директории публикации во временное хранилище
-    :param str path: Путь к папке публикации
+    Функция, рекурсивно собирающая в памяти модули и связи для переданного узла
+    в том же порядке и с той же нумерацией, что и create_nodes, но без записи в базу
+    :param ETreeElement node: Узел, для которого осуществляется поиск
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param list modules: Список для заполнения несохранёнными экземплярами Module
+    :param list links: Список для заполнения кортежами (индекс модуля, индекс родителя, порядок)
+    :param int parent: Индекс модуля-родителя в списке modules
+    :return: результат выполнения операции - True при успешном выполнении
+    :rtype: bool
+    :raises ValueError: ошибки при создании модулей
+    """
+    counter_end_nodes = 0
+    counter_categories = 0
+    for child in node:
+        if child.tag == 'dmRef':
+            counter_end_nodes += 1
+            try:
+                modules.append(build_end_module(child, modules_index))
+            except Exception as err:
+                if parent is not None:
+                    raise ValueError('Ошибка при создании модуля №%d для узла %s: %s'%(counter_end_nodes, modules[parent].title, err))
+                else:
+                    raise ValueError('Ошибка при создании модуля №%d для узла без родителя: %s'%(counter_end_nodes, err))
+            links.append((len(modules) - 1, parent, counter_end_nodes))
+        elif child.tag == 'pmEntry':
+            counter_categories += 1
+            title = child.find('pmEntryTitle').text
+            if not title:
+                raise ValueError('Для узла не указан заголовок')
+            modules.append(Module(title=title, content_hash=get_content_hash(title.encode('utf-8')), is_category=True))
+            category = len(modules) - 1
+            links.append((category, parent, counter_categories))
+            collect_nodes(child, modules, links, modules_index, parent=category)
+
+    return True
+
+
+def collect_nodes_stream(file_path, modules, links, modules_index):
+    """
+    Функция, потоково (iterparse) собирающая в памяти модули и связи из файла публикации
+    так же, как collect_nodes. Обработанные узлы dmRef и pmEntry удаляются из дерева,
+    поэтому объём памяти не зависит от размера файла
+    :param str file_path: Путь к файлу публикации
+    :param list modules: Список для заполнения несохранёнными экземплярами Module
+    :param list links: Список для заполнения кортежами (индекс модуля, индекс родителя, порядок)
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
     :return: результат выполнения операции - True при успешном выполнении
     :rtype: bool
+    :raises ValueError: ошибки при создании модулей
+    """
+    # стек открытых элементов и стек узлов content/pmEntry:
+    # [элемент, индекс модуля-категории, счётчик модулей, счётчик категорий]
+    elems = []
+    frames = []
+    with codecs.open(file_path, 'r', encoding="utf8", errors='replace') as file:
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                parent = elems[-1] if elems else None
+                elems.append(elem)
+                if elem.tag == 'content' and len(elems) == 2:
+                    frames.append([elem, None, 0, 0])
+                elif elem.tag == 'pmEntry' and frames and parent is frames[-1][0]:
+                    frame = frames[-1]
+                    frame[3] += 1
+                    modules.append(Module(title='', is_category=True))
+                    links.append((len(modules) - 1, frame[1], frame[3]))
+                    frames.append([elem, len(modules) - 1, 0, 0])
+                continue
+
+            elems.pop()
+            if not frames:
+                continue
+            parent = elems[-1] if elems else None
+            frame = frames[-1]
+            if elem.tag == 'pmEntryTitle' and parent is frame[0] and frame[1] is not None:
+                if not modules[frame[1]].title:
+                    modules[frame[1]].title = elem.text or ''
+            elif elem.tag == 'dmRef' and parent is frame[0]:
+                frame[2] += 1
+                try:
+                    modules.append(build_end_module(elem, modules_index))
+                except Exception as err:
+                    if frame[1] is not None:
+                        raise ValueError('Ошибка при создании модуля №%d для узла %s: %s'%(frame[2], modules[frame[1]].title, err))
+                    else:
+                        raise ValueError('Ошибка при создании модуля №%d для узла без родителя: %s'%(frame[2], err))
+                links.append((len(modules) - 1, frame[1], frame[2]))
+                parent.remove(elem)
+            elif elem is frame[0]:
+                frames.pop()
+                if elem.tag == 'content':
+                    break
+                if not modules[frame[1]].title:
+                    raise ValueError('Для узла не указан заголовок')
+                modules[frame[1]].content_hash = get_content_hash(modules[frame[1]].title.encode('utf-8'))
+                parent.remove(elem)
+
+    return True
+
+
+def iter_dm_refs_stream(file_path):
+    """
+    Генератор, потоково (iterparse) возвращающий узлы dmRef из раздела content файла публикации.
+    Обработанные узлы удаляются из дерева
+    :param str file_path: Путь к файлу публикации
+    :return: узлы dmRef
+    :rtype: generator
+    """
+    elems = []
+    in_content = False
+    with codecs.open(file_path, 'r', encoding="utf8", errors='replace') as file:
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                elems.append(elem)
+                if elem.tag == 'content' and len(elems) == 2:
+                    in_content = True
+                continue
+
+            elems.pop()
+            if not in_content:
+                continue
+            if elem.tag == 'content' and len(elems) == 1:
+                break
+            if elem.tag == 'dmRef':
+                yield elem
+                elems[-1].remove(elem)
+            elif elem.tag == 'pmEntry':
+                elems[-1].remove(elem)
+
+
+def get_existing_modules(modules):
+    """
+    Функция, находящая уже сохранённые модули (в том числе других публикаций) с тем же
+    содержимым: совпадают хеш файла, полное название и номер выпуска
+    :param list modules: Экземпляры Module
+    :return: {(content_hash, tech_name, issue_number): id сохранённого модуля}
+    :rtype: dict
+    """
+    hashes = list(set(module.content_hash for module in modules if not module.is_category and module.content_hash))
+    existing = {}
+    # ограничиваем количество параметров запроса
+    for i in range(0, len(hashes), 500):
+        rows = Module.objects.filter(is_category=False, content_hash__in=hashes[i:i + 500])\
+            .order_by('id').values_list('id', 'content_hash', 'tech_name', 'issue_number')
+        for module_id, content_hash, tech_name, issue_number in rows:
+            existing.setdefault((content_hash, tech_name, issue_number), module_id)
+    return existing
+
+
+@contextmanager
+def write_transaction():
+    """
+    Транзакция, которая сразу захватывает блокировку записи. Нужна там, где в транзакции
+    сначала читается, а потом записывается (например, назначение id по Max('id')), если
+    параллельно выполняются другие загрузки (см. core.jobs): в SQLite транзакция, начатая
+    чтением, при конфликте записи сразу получает "database is locked" вместо ожидания,
+    в PostgreSQL две загрузки назначили бы одинаковые id
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # запись, не изменяющая строк, захватывает блокировку записи базы
+                cursor.execute('UPDATE %s SET id = id WHERE 0' % connection.ops.quote_name(Module._meta.db_table))
+            elif connection.vendor == 'postgresql':
+                cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % connection.ops.quote_name(Module._meta.db_table))
+        yield
+
+
+def save_nodes_bulk(modules, links, publication, batch_size=None):
+    """
+    Функция, записывающая собранные в памяти модули и связи в одной транзакции через bulk_create
+    :param list modules: Несохранённые экземпляры Module, см. collect_nodes
+    :param list links: Кортежи (индекс модуля, индекс родителя, порядок), см. collect_nodes
+    :param Publication publication: экземпляр модели публикации, для которой создаются модули
+    :param int batch_size: Размер пачки для bulk_create, по умолчанию определяется базой
+    :return: количество созданных записей (модулей и связей)
+    :rtype: int
+    """
+    start = time.time()
+    existing = get_existing_modules(modules)
+    new_modules = []
+    with write_transaction():
+        # bulk_create в SQLite не возвращает первичные ключи,
+        # поэтому назначаем их сами - они нужны для ссылок на родителя.
+        # Модули с тем же содержимым не создаются заново, а только привязываются к публикации
+        last_id = Module.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        for module in modules:
+            key = (module.content_hash, module.tech_name, module.issue_number)
+            if not module.is_category and key in existing:
+                module.id = existing[key]
+                continue
+            last_id += 1
+            module.id = last_id
+            new_modules.append(module)
+            if not module.is_category and module.content_hash:
+                existing[key] = module.id
+        Module.objects.bulk_create(new_modules, batch_size=batch_size)
+        PublicationModule.objects.bulk_create([
+            PublicationModule(
+                module_id=modules[module].id,
+                publication=publication,
+                parent_id=modules[parent].id if parent is not None else None,
+                order_in_parent=order
+            )
+            for module, parent, order in links
+        ], batch_size=batch_size)
+
+    rows = len(new_modules) + len(links)
+    elapsed = time.time() - start
+    logger.info('created %d rows in %.2f s (%.0f rows/sec), %d modules reused',
+                rows, elapsed, rows / elapsed if elapsed else rows, len(modules) - len(new_modules))
+
+    return rows
+
+
+def create_nodes_bulk(node, publication, modules_index, batch_size=None):
+    """
+    Функция, создающая модули и категории для переданного узла в одной транзакции.
+    Дерево сначала собирается в памяти, затем модули и связи записываются через bulk_create
+    :param ETreeElement node: Узел, для которого осуществляется поиск
+    :param Publication publication: экземпляр модели публикации, для которой создаются модули
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param int batch_size: Размер пачки для bulk_create, по умолчанию определяется базой
+    :return: количество созданных записей (модулей и связей)
+    :rtype: int
+    :raises ValueError: ошибки при создании модулей
+    """
+    modules = []
+    links = []
+    collect_nodes(node, modules, links, modules_index)
+
+    return save_nodes_bulk(modules, links, publication, batch_size)
+
+
+def parse_module_file(file_path, known_hashes=None):
+    """
+    Функция, разбирающая файл модуля данных. Выполняется в том числе в дочерних процессах,
+    поэтому не обращается к базе данных. Большие файлы (см. use_streaming) читаются потоково
+    только до конца identAndStatusSection, а содержимым модуля становится исходный файл,
+    сжатый по частям (см. core.fields.compress_file), поэтому файл не читается в память целиком
+    :param str file_path: Путь к файлу модуля (DMC-...)
+    :param dict known_hashes: Хеши уже загруженных файлов {хеш: (tech_name, issue_number)},
+        такие файлы не разбираются и возвращаются без xml содержимого
+    :return: полное название, номер выпуска, имя файла, xml содержимое модуля и хеш файла
+    :rtype: tuple
+    :raises ValueError: ошибка при обработке модуля
+    """
+    file_name = os.path.basename(file_path)
+    streaming = use_streaming(file_path)
+    if streaming:
+        content_hash = get_file_hash(file_path)
+    else:
+        file_bytes = read_file_bytes(file_path)
+        content_hash = get_content_hash(file_bytes)
+    if known_hashes and content_hash in known_hashes:
+        tech_name, issue_number = known_hashes[content_hash]
+        return tech_name, issue_number, file_name, None, content_hash
+
+    if streaming:
+        identAndStatusSection = find_first_element(file_path, 'identAndStatusSection')
+        content_xml = compress_file(file_path)
+    else:
+        root = ET.fromstring(file_bytes.decode('utf8', errors='replace'))
+        identAndStatusSection = root.find('identAndStatusSection')
+        content_xml = ET.tostring(root, encoding='utf-8', method='xml')
+
+    dmAddressItems = identAndStatusSection.find('dmAddress')
+    tech_name = dmAddressItems.find('dmAddressItems').find('dmTitle').find('techName').text
+    issue_number = dmAddressItems.find('dmIdent').find('issueInfo').get('issueNumber')
+    if not tech_name or not issue_number:
+        raise ValueError('Не хватает данных для создания модуля из файла: %s' % file_name)
+
+    return tech_name, issue_number, file_name, content_xml, content_hash
+
+
+def load_modules_from_files(path, workers=None, known_hashes=None):
+    """
+    Функция, загружающая все модули из директории публикации в индекс в памяти.
+    При workers > 1 файлы разбираются в пуле процессов
+    :param str path: Путь к папке публикации
+    :param int workers: Количество процессов для разбора файлов, по умолчанию settings.IMPORT_WORKERS
+    :param dict known_hashes: Хеши уже загруженных файлов, см. parse_module_file
+    :return: индекс модулей {(tech_name, issue_number): ModuleFile} и
+        словарь повторяющихся ключей {(tech_name, issue_number): [имена файлов]}
+    :rtype: dict, dict
     :raises ValueError: ошибка при обработке модуля
     """
     mod_file_prefix = 'DMC-'
+    if workers is None:
+        workers = getattr(settings, 'IMPORT_WORKERS', 1)
     files = os.listdir(path)
-    modules_files = list(filter(lambda x: x[:4] == mod_file_prefix, files))
-    for f in modules_files:
-        tech_name = None
-        issue_number = None
-        file_path = os.path.join(path, f)
+    modules_files = [os.path.join(path, f) for f in files if f[:4] == mod_file_prefix]
+    parse = partial(parse_module_file, known_hashes=known_hashes)
+
+    modules_index = {}
+    duplicates = {}
+
+    def add(results):
+        for tech_name, issue_number, file_name, content_xml, content_hash in results:
+            key = (tech_name, issue_number)
+            if key in modules_index:
+                duplicates.setdefault(key, [modules_index[key].file_name]).append(file_name)
+            else:
+                modules_index[key] = ModuleFile(file_name, content_xml, content_hash)
+
+    if workers > 1:
+        chunksize = max(1, len(modules_files) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            add(executor.map(parse, modules_files, chunksize=chunksize))
+    else:
+        add(map(parse, modules_files))
+
+    return modules_index, duplicates
 
-        file = codecs.open(file_path, 'r', encoding="utf8", errors='replace')
-        tree = ET.parse(file)
-        root = tree.getroot()
-        dmAddressItems = root.find('identAndStatusSection').find('dmAddress')
-        tech_name = dmAddressItems.find('dmAddressItems').find('dmTitle').find('techName').text
-        issue_number = dmAddressItems.find('dmIdent').find('issueInfo').get('issueNumber')
-        if not tech_name or not issue_number:
-            raise ValueError('Не хватает данных для создания модуля из файла: %s' % f)
-        temp_module = TempModule(
-            tech_name = tech_name,
-            title = tech_name,
-            issue_number = issue_number,
-            file_name = f,
-            content_xml = ET.tostring(root, encoding='utf-8', method='xml')
-        )
-        temp_module.save()
+
+def check_module_refs(dm_refs, modules_index, duplicates):
+    """
+    Функция, проверяющая до создания модулей, что каждой ссылке dmRef публикации
+    соответствует ровно один файл модуля
+    :param iterable dm_refs: Узлы dmRef раздела content файла публикации
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param dict duplicates: Повторяющиеся ключи индекса, см. load_modules_from_files
+    :return: результат выполнения операции - True при успешном выполнении
+    :rtype: bool
+    :raises ValueError: найдены ссылки без файлов или с несколькими файлами
+    """
+    missing = []
+    ambiguous = []
+    referenced = set()
+    for dm_ref in dm_refs:
+        key = get_end_module_props(dm_ref)
+        referenced.add(key)
+        if key in duplicates:
+            ambiguous.append('%s c номером выпуска: %s (%s)' % (key[0], key[1], ', '.join(duplicates[key])))
+        elif key not in modules_index:
+            missing.append('%s c номером выпуска: %s' % key)
+
+    errors = []
+    if missing:
+        errors.append('В папке публикации не найдено файлов для модулей: %s' % '; '.join(missing))
+    if ambiguous:
+        errors.append('В папке публикации найдено несколько файлов для модулей: %s' % '; '.join(ambiguous))
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+    for key in set(duplicates) - referenced:
+        logger.warning('duplicate module files not referenced by publication: %s', ', '.join(duplicates[key]))
 
     return True
 
 
+def get_publication_content(file_path):
+    """
+    Функция, возвращающая узел content файла публикации
+    :param str file_path: Путь к файлу публикации
+    :return: узел content
+    :rtype: ETreeElement
+    :raises ValueError: узел не найден
+    """
+    file = codecs.open(file_path, 'r', encoding="utf8", errors='replace')
+    tree = ET.parse(file)
+    root = tree.getroot()
+    content = root.find('content')
+    if content is None:
+        raise ValueError('В файле публикации не найден узел content')
+    return content
+
+
+def collect_publication_nodes(file_path, modules_index, duplicates=None):
+    """
+    Функция, проверяющая ссылки на модули и собирающая в памяти модули и связи публикации.
+    Большие файлы (см. use_streaming) разбираются потоково
+    :param str file_path: Путь к файлу публикации
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param dict duplicates: Повторяющиеся ключи индекса, см. load_modules_from_files
+    :return: несохранённые модули и связи, см. collect_nodes
+    :rtype: list, list
+    :raises ValueError: ошибки при создании модулей
+    """
+    modules = []
+    links = []
+    if use_streaming(file_path):
+        check_module_refs(iter_dm_refs_stream(file_path), modules_index, duplicates or {})
+        collect_nodes_stream(file_path, modules, links, modules_index)
+    else:
+        content = get_publication_content(file_path)
+        check_module_refs(content.iter('dmRef'), modules_index, duplicates or {})
+        collect_nodes(content, modules, links, modules_index)
+    return modules, links
 
 
-def load_modules(file_path, publication, path):
+def load_modules(file_path, publication, modules_index, duplicates=None, bulk=False):
     """
     Функция, загружающая все модули данных публикации
     :param str file_path: Путь к файлу публикации
     :param Publication publication: Экземпляр модели публикации, для которой создаются модули
-    :param str path: Путь к папке публикации
+    :param dict modules_index: Индекс модулей публикации, см. load_modules_from_files
+    :param dict duplicates: Повторяющиеся ключи индекса, см. load_modules_from_files
+    :param bool bulk: Создавать модули и связи пачками в одной транзакции.
+        Большие файлы публикации (см. use_streaming) всегда разбираются потоково и записываются пачками
     :return: результат выполнения операции - True при успешном выполнении
     :rtype: bool
     :raises ValueError: ошибка при отсутствии предусмотренного родительского узла
     """
-    file = codecs.open(file_path, 'r', encoding="utf8", errors='replace')
-    tree = ET.parse(file)
-    root = tree.getroot()
-    try:
-        content = root.find('content')
-    except Exception as err:
-        raise ValueError('В файле публикации не найден узел content: %s' % err)
-
-    create_nodes(content, publication=publication)
+    if bulk or use_streaming(file_path):
+        modules, links = collect_publication_nodes(file_path, modules_index, duplicates)
+        save_nodes_bulk(modules, links, publication)
+        return True
 
-    #Очистим временные модули
-    TempModule.objects.all().delete()
+    content = get_publication_content(file_path)
+    check_module_refs(content.iter('dmRef'), modules_index, duplicates or {})
+    create_nodes(content, publication=publication, modules_index=modules_index)
 
     return True
 
 
-def copy_static(path, publication_code, media_path):
+def copy_static(path, publication_code, media_path, store_paths=None):
     """
-    Функция, копирующая статические файлы публикации в папку сервера
+    Функция, копирующая статические файлы публикации в папку сервера через хранилище медиа-файлов,
+    см. sync_static
     :param str path: Путь к директории публикации
     :param str code: Код публикации, будет служить названием папки для файлов в медиа-папке
+    :param dict store_paths: Пути файлов в хранилище, см. sync_static
     :return: результат выполнения операции - True при успешном выполнении
     :rtype: bool
     """
-    static_folder = 'graphics'
-    static_path = os.path.join(path, static_folder)
-    shutil.copytree(static_path, media_path)
+    sync_static(path, media_path, store_paths=store_paths)
     return True
 
 
@@ -389,6 +958,64 @@ def get_childrens(holder, publication, parent=None):
     return True
 
 
+def get_tree_data(publication):
+    """
+    Функция, собирающая дерево модулей публикации одним запросом к базе
+    :param Publication publication: экземпляр модели публикации, для которой выполняется поиск
+    :return: массив узлов верхнего уровня в формате jstree
+    :rtype: list
+    """
+    links = PublicationModule.objects.filter(publication=publication)\
+        .order_by('order_in_parent', 'id')\
+        .values_list('module_id', 'module__title', 'parent_id')
+
+    childrens = defaultdict(list)
+    for module_id, title, parent_id in links:
+        childrens[parent_id].append((module_id, title))
+
+    data = []
+    stack = [(None, data)]
+    while stack:
+        parent_id, holder = stack.pop()
+        for module_id, title in childrens[parent_id]:
+            obj = {
+                'id': module_id,
+                'text': title,
+                'a_attr':{'href':module_id},
+                'children': []
+            }
+            holder.append(obj)
+            stack.append((module_id, obj['children']))
+
+    return data
+
+
+def get_tree_children(publication, parent=None):
+    """
+    Функция, возвращающая только непосредственные дочерние узлы для ленивой загрузки дерева jstree.
+    Узлы, у которых есть свои дочерние элементы, помечаются 'children': True
+    :param Publication publication: экземпляр модели публикации
+    :param int parent: id модуля-родителя, None - узлы верхнего уровня
+    :return: массив узлов в формате jstree
+    :rtype: list
+    """
+    has_children = PublicationModule.objects.filter(publication=publication, parent=OuterRef('module_id'))
+    links = PublicationModule.objects.filter(publication=publication, parent=parent)\
+        .annotate(has_children=Exists(has_children))\
+        .order_by('order_in_parent', 'id')\
+        .values_list('module_id', 'module__title', 'has_children')
+
+    return [
+        {
+            'id': module_id,
+            'text': title,
+            'a_attr':{'href':module_id},
+            'children': has_children
+        }
+        for module_id, title, has_children in links
+    ]
+
+
 def get_tree_structure(publication):
     """
     Функция, создающее дерево модулей в публикации
@@ -400,66 +1027,896 @@ def get_tree_structure(publication):
     
     tree = {
         'core':{
-            'data':[]
+            'data': get_tree_data(publication)
         }
     }
-    get_childrens(tree['core']['data'], publication)
 
     return json.dumps(tree)
 
 
-def parce_modules(publication, media_path):
+def with_raw_content_xml(modules):
+    """
+    Функция, заменяющая в выборке модулей распакованное содержимое content_xml значением из базы
+    без распаковки (атрибут raw_xml), которое разбирается по частям, см. core.fields.open_value
+    :param QuerySet modules: Выборка модулей
+    :rtype: QuerySet
+    """
+    return modules.defer('content_xml').annotate(
+        raw_xml=ExpressionWrapper(F('content_xml'), output_field=BinaryField()))
+
+
+def render_module_content(module, media_index, derivatives=None, content_xml=None):
+    """
+    Функция, формирующая json содержание модуля и сообщающая о ненайденных медиа-файлах
+    :param Module module: экземпляр модели модуля
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param dict derivatives: Размеры, превью и тайлы изображений, см. core.images.build_publication_derivatives
+    :param content_xml: xml содержимое модуля или файловый объект с ним, по умолчанию module.content_xml
+    :return content_json: json строка содержания модуля
+    :rtype: str
+    """
+    unresolved = set()
+    if content_xml is None:
+        content_xml = module.content_xml
+    content_json = get_module_content(content_xml, media_index, unresolved, derivatives)
+    if unresolved:
+        logger.warning('media files not found for module %s (%s): %s', module.title, module.file_name, ', '.join(sorted(unresolved)))
+    return content_json
+
+
+def parce_modules(publication, media_index, derivatives=None):
     """
     Функция, формирующее json содержание модуля
     :param Publication publication: экземпляр объекта публикации, для модулей которой будет заполняться содержимое
-    :param str media_path: путь к директории размещения медиа-объектов
-    :return: Флаг об успешном завершении операции
-    :rtype: bool
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param dict derivatives: Размеры, превью и тайлы изображений, см. core.images.build_publication_derivatives
+    :return: Количество обработанных модулей
+    :rtype: int
     """
-    modules = publication.modules.filter(is_category = False)
-    for module in modules:
-        module.content_json = get_module_content(module.content_xml, media_path)
-        module.save()
+    # модули, общие с другими публикациями, уже сформированы.
+    # Модули читаются частями и без распаковки xml, поэтому в памяти не находится содержимое всех модулей сразу
+    ids = list(publication.modules.filter(is_category = False, content_json = '').values_list('id', flat=True))
+    count = 0
+    for i in range(0, len(ids), 100):
+        for module in with_raw_content_xml(Module.objects.filter(id__in=ids[i:i + 100])):
+            module.content_json = render_module_content(module, media_index, derivatives, open_value(module.raw_xml))
+            module.save()
+            count += 1
+
+    return count
+
+
+def index_modules(modules, batch_size=1000):
+    """
+    Функция, заполняющая обратный индекс поиска (SearchTerm) и таблицу деталей (ModulePart)
+    для ещё не проиндексированных модулей.
+    Данные берутся из содержания модуля (см. get_module_content); если content_json ещё не
+    сформирован (ленивый режим), содержание разбирается из content_xml без медиа-индекса
+    :param QuerySet modules: Модули для индексации
+    :param int batch_size: Количество записей, накапливаемых перед сохранением. Размер пачки
+        bulk_create определяет база, т.к. SQLite ограничивает число параметров запроса
+    :return: количество проиндексированных модулей
+    :rtype: int
+    """
+    # идентификаторы выбираются заранее, чтобы не читать таблицу модулей во время записи индекса
+    ids = list(modules.filter(is_category=False)
+               .annotate(indexed=Exists(SearchTerm.objects.filter(module=OuterRef('pk'))))
+               .filter(indexed=False).values_list('id', flat=True))
+
+    terms = []
+    parts = []
+    for i in range(0, len(ids), 500):
+        chunk = Module.objects.filter(id__in=ids[i:i + 500])
+        rows = chain(
+            ((module_id, tech_name, content_json, False) for module_id, tech_name, content_json in
+             chunk.exclude(content_json='').values_list('id', 'tech_name', 'content_json')),
+            ((module_id, tech_name, raw_xml, True) for module_id, tech_name, raw_xml in
+             with_raw_content_xml(chunk.filter(content_json='')).values_list('id', 'tech_name', 'raw_xml')),
+        )
+        for module_id, tech_name, content, is_xml in rows:
+            try:
+                content = json.loads(get_module_content(open_value(content), {}) if is_xml else content)
+            except (ET.ParseError, AttributeError, ValueError) as err:
+                logger.warning('module %s is not indexed: %s', module_id, err)
+                content = {}
+            terms.extend(
+                SearchTerm(term=term, module_id=module_id, weight=weight)
+                for term, weight in get_search_terms(tech_name, content).items()
+            )
+            for part in get_module_parts(content):
+                part.module_id = module_id
+                parts.append(part)
+        if len(terms) >= batch_size:
+            SearchTerm.objects.bulk_create(terms)
+            terms = []
+        if len(parts) >= batch_size:
+            ModulePart.objects.bulk_create(parts)
+            parts = []
+    SearchTerm.objects.bulk_create(terms)
+    ModulePart.objects.bulk_create(parts)
+
+    return len(ids)
+
+
+def get_publication_media_path(publication_code):
+    """
+    Функция, возвращающая путь к медиа-папке публикации
+    :param str publication_code: Код публикации
+    :return: абсолютный путь к папке
+    :rtype: str
+    """
+    return os.path.join(settings.MEDIA_ROOT, 'pub_files', publication_code)
+
+
+def get_media_manifest_path(publication_code):
+    """
+    Функция, возвращающая путь к манифесту медиа-файлов публикации, см. save_publication_media_index
+    :param str publication_code: Код публикации
+    :rtype: str
+    """
+    return os.path.join(get_manifests_root(), publication_code + '.media.json')
+
+
+@lru_cache(maxsize=64)
+def load_manifest(path, inode, mtime_ns):
+    with open(path) as file:
+        return json.load(file)
+
+
+def read_manifest(path):
+    """
+    Функция, читающая json файл манифеста. Манифест кешируется в процессе по пути, inode и времени
+    изменения файла: манифест заменяется целиком (см. write_manifest), поэтому изменения, сделанные
+    загрузкой в другом процессе, видны при следующем обращении. Результат не должен изменяться
+    :param str path: Путь к файлу
+    :return: содержимое манифеста или None, если файла нет
+    :rtype: dict
+    """
+    try:
+        stat = os.stat(path)
+        return load_manifest(path, stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path, data):
+    """
+    Функция, записывающая json файл манифеста через временный файл, чтобы читатели
+    видели либо прежний, либо новый манифест целиком
+    :param str path: Путь к файлу
+    :param dict data: Содержимое манифеста
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def save_publication_media_index(publication_code, media_index, store_paths=None):
+    """
+    Функция, сохраняющая индекс медиа-файлов публикации в её манифест. Манифест записывается
+    после переноса медиа-файлов и создания производных изображений, поэтому его наличие означает,
+    что по нему можно формировать содержание модулей (см. ensure_module_content)
+    :param str publication_code: Код публикации
+    :param dict media_index: Индекс медиа-файлов публикации, см. get_media_index
+    :param dict store_paths: Пути файлов в хранилище, см. sync_static
+    """
+    # манифест хранится внутри MEDIA_ROOT, поэтому пути в нем относительны MEDIA_ROOT
+    store_paths = {os.path.relpath(target, settings.MEDIA_ROOT): os.path.relpath(store_path, settings.MEDIA_ROOT)
+                   for target, store_path in (store_paths or {}).items()}
+    write_manifest(get_media_manifest_path(publication_code), {'index': media_index, 'store': store_paths})
+
+
+def get_publication_store_paths(publication_code):
+    """
+    Функция, возвращающая пути медиа-файлов публикации в хранилище из её манифеста
+    :param str publication_code: Код публикации
+    :return: {путь к файлу в медиа-папке: путь к файлу в хранилище}
+    :rtype: dict
+    """
+    manifest = read_manifest(get_media_manifest_path(publication_code)) or {}
+    return {os.path.join(settings.MEDIA_ROOT, target): os.path.join(settings.MEDIA_ROOT, store_path)
+            for target, store_path in manifest.get('store', {}).items()}
 
-    return True
 
-def load_publication(path):
+def get_publication_media_index(publication_code):
     """
-    Функция для загрузки публикации
+    Функция, возвращающая индекс медиа-файлов публикации из её манифеста
+    :param str publication_code: Код публикации
+    :return: словарь {имя файла без расширения: относительный путь к файлу} или None,
+        если манифеста нет
+    :rtype: dict
+    """
+    manifest = read_manifest(get_media_manifest_path(publication_code))
+    return manifest['index'] if manifest is not None else None
+
+
+# Блокировки для формирования содержания модулей по запросу, выбираются по id модуля
+CONTENT_LOCKS = [threading.Lock() for i in range(64)]
+
+
+def ensure_module_content(module):
+    """
+    Функция, формирующая json содержание модуля при первом обращении к нему и сохраняющая его в базу.
+    В пределах процесса содержание модуля формируется один раз; между процессами сохраняется
+    только первый результат (запись выполняется, только если content_json ещё пуст).
+    Пока медиа-файлы загружаемой публикации не перенесены (нет манифеста, см. save_publication_media_index),
+    содержание формируется без изображений и не сохраняется
+    :param Module module: экземпляр модели модуля
+    :return content_json: json строка содержания модуля
+    :rtype: str
+    """
+    if module.is_category or module.content_json:
+        return module.content_json
+
+    with CONTENT_LOCKS[module.pk % len(CONTENT_LOCKS)]:
+        content_json = Module.objects.filter(pk=module.pk).values_list('content_json', flat=True).first()
+        if not content_json:
+            # содержание не зависит от публикации, кроме имён изображений, которых в ней нет;
+            # предпочитается последняя загруженная опубликованная версия
+            link = PublicationModule.objects.filter(module=module)\
+                .order_by('publication__staging', '-publication__generation', 'publication_id')\
+                .values_list('publication__storage_key', 'publication__code', 'publication__staging').first()
+            media_key = link and (link[0] or link[1])
+            media_index = get_publication_media_index(media_key) if media_key else {}
+            if media_index is None and link[2]:
+                module.content_json = render_module_content(module, {})
+                return module.content_json
+            shared = False
+            if media_index is None:
+                # публикация загружена до появления манифестов медиа-файлов: ссылки ведут в её медиа-папку,
+                # поэтому содержание модуля, общего с другими публикациями, не сохраняется
+                media_index = get_media_index(get_publication_media_path(media_key))
+                shared = PublicationModule.objects.filter(module=module)\
+                    .values('publication_id').distinct().count() > 1
+            derivatives = get_publication_derivatives(media_key) if media_key else {}
+            content_json = render_module_content(module, media_index, derivatives)
+            if shared:
+                module.content_json = content_json
+                return content_json
+            updated = Module.objects.filter(pk=module.pk, content_json='').update(content_json=content_json)
+            if not updated:
+                content_json = Module.objects.filter(pk=module.pk).values_list('content_json', flat=True).first()
+
+    module.content_json = content_json
+    return content_json
+
+
+def get_generation():
+    """
+    Функция, возвращающая номер последней загрузки публикаций
+    :rtype: int
+    """
+    return Publication.objects.aggregate(generation=Max('generation'))['generation'] or 0
+
+
+# Номер последней загрузки и время (time.monotonic), до которого он не перечитывается, см. get_cached_generation
+generation_cache = [0, 0.0]
+
+
+def get_cached_generation():
+    """
+    Функция, возвращающая номер последней загрузки публикаций, запомненный в процессе не дольше
+    settings.API_GENERATION_TTL секунд, чтобы не выполнять запрос на каждый ответ API.
+    Загрузка в другом процессе становится видна не позже чем через API_GENERATION_TTL секунд,
+    в этом процессе - сразу (см. bump_generation)
+    :rtype: int
+    """
+    now = time.monotonic()
+    if now >= generation_cache[1]:
+        generation_cache[:] = [get_generation(), now + getattr(settings, 'API_GENERATION_TTL', 1)]
+    return generation_cache[0]
+
+
+def bump_generation(publication):
+    """
+    Функция, присваивающая публикации следующий номер загрузки. Вызывается по завершении
+    загрузки, номер входит в ключи кеша ответов API
+    :param Publication publication: экземпляр модели публикации
+    :return: новый номер загрузки
+    :rtype: int
+    """
+    with write_transaction():
+        publication.generation = get_generation() + 1
+        Publication.objects.filter(pk=publication.pk).update(generation=publication.generation)
+    generation_cache[1] = 0
+    return publication.generation
+
+
+def get_files_size(path, prefix=''):
+    """
+    Функция, возвращающая количество и суммарный размер файлов в директории и её поддиректориях
+    :param str path: Путь к директории
+    :param str prefix: Учитывать только файлы, имя которых начинается с prefix
+    :return: количество файлов и их размер в байтах
+    :rtype: int, int
+    """
+    count = 0
+    size = 0
+    for dir_path, dir_names, files in os.walk(path):
+        for file in files:
+            if file.startswith(prefix):
+                count += 1
+                size += os.path.getsize(os.path.join(dir_path, file))
+    return count, size
+
+
+def load_publication(path, bulk=False, workers=None, lazy=None, summary=None):
+    """
+    Функция для загрузки публикации. Каждый этап замеряется и пишется в лог, см. ImportSummary.
+    Публикация собирается под временным кодом и не видна API, пока не будет готова целиком;
+    затем она подменяет опубликованную версию с тем же кодом одной транзакцией (см. publish_publication)
     :param str path: Путь к директории с файлом структуры публикации (PMC-...)
-    :return: результат выполнения операции - True при успешном выполнении
-    :rtype: bool
+    :param bool bulk: Создавать модули и связи пачками в одной транзакции
+    :param int workers: Количество процессов для разбора файлов модулей, по умолчанию settings.IMPORT_WORKERS
+    :param bool lazy: Не формировать содержание модулей при загрузке, а формировать его
+        при первом запросе (см. ensure_module_content), по умолчанию settings.LAZY_MODULE_CONTENT
+    :param ImportSummary summary: Сводка для заполнения, например с обработчиком этапов (см. core.jobs)
+    :return: сводка по этапам загрузки
+    :rtype: ImportSummary
     :raises ValueError: ошибка при загрузке публикации
     """
-    pub_file_path, file_name = get_publication_file(path)
-    #Создание публикации
-    pub_data = get_publication_props(pub_file_path)
-    publication = Publication(
-        title = pub_data['title'],
-        code = pub_data['code'],
-        file_name = os.path.splitext(file_name)[0],
-        issue_number = pub_data['issue_number'],
-        content_xml = pub_data['content_xml']
-        )
-    publication.save()
-    MEDIA_PATH = os.path.join(settings.MEDIA_ROOT, 'pub_files', publication.code)
-    print("publication created")
-    load_modules_from_files(path)
-    print("loaded modules from files")
-    #Создание модулей
-    load_modules(pub_file_path, publication, path)
-    print("modules from publication file loaded")
-    #Перенос статического контента
-    copy_static(path, pub_data['code'], MEDIA_PATH)
-    print("static copied")
-    #Cоздание дерева модулей
-    publication.structure_json = get_tree_structure(publication)
-    publication.save()
-    print("publication tree created")
-    parce_modules(publication, MEDIA_PATH)
-    print("modules parced")
+    if summary is None:
+        summary = ImportSummary(path)
+    with summary.span('props') as span:
+        pub_file_path, file_name = get_publication_file(path)
+        #Создание публикации
+        pub_data = get_publication_props(pub_file_path)
+        staging_code = '%s~%s' % (pub_data['code'], uuid.uuid4().hex[:12])
+        with write_transaction():
+            # медиа-папка опубликованной версии остаётся на месте до замены
+            storage_taken = Publication.objects.filter(
+                Q(code=pub_data['code'], storage_key='') | Q(storage_key=pub_data['code'])).exists()
+            publication = Publication(
+                title = pub_data['title'],
+                code = staging_code,
+                storage_key = staging_code if storage_taken else pub_data['code'],
+                staging = True,
+                file_name = os.path.splitext(file_name)[0],
+                issue_number = pub_data['issue_number'],
+                content_xml = pub_data['content_xml']
+                )
+            publication.save()
+        summary.created = True
+        MEDIA_PATH = get_publication_media_path(publication.media_key)
+        summary.code = publication.code
+        span.items = 1
+        span.bytes_read = os.path.getsize(pub_file_path)
+    with summary.span('dmc_load') as span:
+        modules_index, duplicates = load_modules_from_files(path, workers=workers)
+        span.items, span.bytes_read = get_files_size(path, 'DMC-')
+    with summary.span('tree_build') as span:
+        #Создание модулей
+        load_modules(pub_file_path, publication, modules_index, duplicates, bulk=bulk)
+        span.items = PublicationModule.objects.filter(publication=publication).count()
+    with summary.span('static_copy') as span:
+        #Перенос статического контента
+        store_paths = get_publication_store_paths(publication.media_key)
+        copy_static(path, pub_data['code'], MEDIA_PATH, store_paths)
+        media_index = get_media_index(MEDIA_PATH, store_paths)
+        span.items, span.bytes_read = get_files_size(MEDIA_PATH)
+    with summary.span('image_derivatives') as span:
+        derivatives = build_publication_derivatives(publication.media_key, media_index)
+        save_publication_media_index(publication.media_key, media_index, store_paths)
+        span.items = len(derivatives)
+    with summary.span('structure_json') as span:
+        #Cоздание дерева модулей
+        publication.structure_json = get_tree_structure(publication)
+        publication.content_hash = get_content_hash(publication.structure_json.encode('utf-8'))
+        publication.save()
+        span.items = 1
+    if lazy is None:
+        lazy = getattr(settings, 'LAZY_MODULE_CONTENT', False)
+    if not lazy:
+        with summary.span('module_parse') as span:
+            span.items = parce_modules(publication, media_index, derivatives)
+    with summary.span('search_index') as span:
+        span.items = index_modules(publication.modules.all())
+    with summary.span('publish') as span:
+        publish_publication(publication, pub_data['code'])
+        summary.code = publication.code
+        summary.created = False
+        span.items = 1
+    with summary.span('gc') as span:
+        span.items = delete_retired_publications(getattr(settings, 'IMPORT_RETIRED_TTL', 60))
+
+    return summary
+
+
+def publish_publication(publication, code):
+    """
+    Функция, публикующая собранную загрузкой публикацию под кодом code одной транзакцией:
+    опубликованная ранее версия переименовывается и скрывается (staging), новая получает код
+    и следующий номер загрузки. До фиксации транзакции API отдаёт прежнюю версию целиком.
+    Заменённая версия удаляется позже (см. delete_retired_publications), чтобы клиенты,
+    получившие её структуру, могли запросить её модули
+    :param Publication publication: Собранная публикация с временным кодом
+    :param str code: Код публикации
+    :return: временный код заменённой версии или None
+    :rtype: str
+    """
+    retired_code = None
+    with write_transaction():
+        live = Publication.objects.filter(code=code).values_list('pk', flat=True).first()
+        if live is not None:
+            retired_code = '%s~%s' % (code, uuid.uuid4().hex[:12])
+            Publication.objects.filter(pk=live).update(code=retired_code, staging=True, updated_at=timezone.now())
+        publication.code = code
+        publication.staging = False
+        publication.generation = get_generation() + 1
+        Publication.objects.filter(pk=publication.pk).update(
+            code=code, staging=False, generation=publication.generation, updated_at=timezone.now())
+    generation_cache[1] = 0
+    logger.info('publication %s published, generation %d', code, publication.generation)
+    return retired_code
+
+
+def get_file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Функция, вычисляющая хеш файла, не читая его в память целиком
+    :param str file_path: Путь к файлу
+    :return: sha1 хеш в шестнадцатеричном виде
+    :rtype: str
+    """
+    content_hash = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(partial(file.read, chunk_size), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
 
 
+def get_media_store_root():
+    """
+    Функция, возвращающая путь к хранилищу медиа-файлов, где каждый файл хранится один раз под своим хешем.
+    Пути файлов хранилища попадают в содержание модулей и отдаются как медиа-файлы, а жесткие ссылки
+    возможны только в пределах одной файловой системы, поэтому хранилище должно находиться внутри MEDIA_ROOT
+    :rtype: str
+    :raises ImproperlyConfigured: settings.MEDIA_STORE_ROOT вне MEDIA_ROOT
+    """
+    store_root = getattr(settings, 'MEDIA_STORE_ROOT', None)
+    if not store_root:
+        return os.path.join(settings.MEDIA_ROOT, 'store')
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    if os.path.commonpath([media_root, os.path.abspath(store_root)]) != media_root:
+        raise ImproperlyConfigured('MEDIA_STORE_ROOT must be inside MEDIA_ROOT: %s' % store_root)
+    return store_root
+
+
+def put_to_store(source, content_hash):
+    """
+    Функция, помещающая файл в хранилище медиа-файлов, если его там ещё нет
+    :param str source: Путь к файлу
+    :param str content_hash: Хеш файла
+    :return: путь к файлу в хранилище
+    :rtype: str
+    """
+    store_dir = os.path.join(get_media_store_root(), content_hash[:2])
+    store_path = os.path.join(store_dir, content_hash + os.path.splitext(source)[1].lower())
+    if not os.path.exists(store_path):
+        os.makedirs(store_dir, exist_ok=True)
+        # копируем во временный файл, чтобы в хранилище не появился недописанный файл
+        tmp_path = '%s.%d.%d.tmp' % (store_path, os.getpid(), threading.get_ident())
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, store_path)
+    return store_path
+
+
+def link_file(store_path, target):
+    """
+    Функция, создающая в медиа-папке публикации жесткую ссылку на файл хранилища.
+    Если файловая система не поддерживает жесткие ссылки, файл копируется
+    :param str store_path: Путь к файлу в хранилище
+    :param str target: Путь к файлу в медиа-папке публикации
+    """
+    tmp_path = '%s.%d.%d.tmp' % (target, os.getpid(), threading.get_ident())
+    try:
+        os.link(store_path, tmp_path)
+    except OSError:
+        shutil.copy2(store_path, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def sync_static_file(source, target, store_path=None):
+    """
+    Функция, переносящая статический файл в медиа-папку публикации через хранилище.
+    Файл не хешируется, если размер и время изменения совпадают с уже перенесённым
+    и известен его путь в хранилище
+    :param str source: Путь к файлу публикации
+    :param str target: Путь к файлу в медиа-папке публикации
+    :param str store_path: Путь к уже перенесённому файлу в хранилище
+    :return: был ли файл перенесён и путь к файлу в хранилище
+    :rtype: bool, str
+    """
+    source_stat = os.stat(source)
+    try:
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        target_stat = None
+    if target_stat is not None and source_stat.st_size == target_stat.st_size and \
+            int(source_stat.st_mtime) == int(target_stat.st_mtime) and \
+            store_path and os.path.exists(store_path) and os.path.samefile(store_path, target):
+        return False, store_path
+
+    store_path = put_to_store(source, get_file_hash(source))
+    if target_stat is not None and os.path.samefile(store_path, target):
+        return False, store_path
+    link_file(store_path, target)
+    return True, store_path
+
+
+def get_referenced_store_paths():
+    """
+    Функция, возвращающая пути файлов хранилища, на которые ссылаются манифесты медиа-файлов публикаций
+    (см. save_publication_media_index), в том числе собираемых и заменённых версий
+    :rtype: set
+    """
+    referenced = set()
+    manifests_path = os.path.dirname(get_media_manifest_path(''))
+    if not os.path.isdir(manifests_path):
+        return referenced
+    for name in os.listdir(manifests_path):
+        if name.endswith('.media.json'):
+            manifest = read_manifest(os.path.join(manifests_path, name)) or {}
+            referenced.update(os.path.abspath(os.path.join(settings.MEDIA_ROOT, store_path))
+                              for store_path in manifest.get('store', {}).values())
+    return referenced
+
+
+def gc_media_store(min_age=3600):
+    """
+    Функция, удаляющая из хранилища файлы, на которые не ссылается ни одна публикация: файла нет
+    в манифестах медиа-файлов (см. get_referenced_store_paths) и на него нет других жестких ссылок
+    (публикации, загруженные до появления манифестов). Файлы, скопированные в медиа-папку без жесткой
+    ссылки (см. link_file), указаны в манифестах и не удаляются. Недавно добавленные файлы не удаляются,
+    так как ссылки на них могут создаваться параллельной загрузкой. Выполняется командой gc_media_store
+    и периодически обработчиком заданий загрузки (см. core.jobs.run_worker)
+    :param int min_age: Минимальный возраст удаляемого файла в секундах
+    :return: количество удаленных файлов
+    :rtype: int
+    """
+    referenced = get_referenced_store_paths()
+    removed = 0
+    now = time.time()
+    for dir_path, dir_names, files in os.walk(get_media_store_root()):
+        for file in files:
+            store_path = os.path.join(dir_path, file)
+            if os.path.abspath(store_path) in referenced:
+                continue
+            stat = os.stat(store_path)
+            if stat.st_nlink == 1 and now - stat.st_ctime > min_age:
+                os.remove(store_path)
+                removed += 1
+    return removed
+
+
+def sync_static(path, media_path, workers=None, store_paths=None):
+    """
+    Функция, переносящая в папку сервера только новые и изменённые статические файлы публикации
+    и удаляющая файлы, которых больше нет в публикации.
+    Файлы хранятся один раз в хранилище медиа-файлов (см. put_to_store), а в папке публикации
+    на них создаются жесткие ссылки, поэтому одинаковые файлы разных публикаций и выпусков
+    не занимают место повторно. Файлы обрабатываются в пуле потоков. Файлы хранилища, оставшиеся
+    без ссылок, удаляет сборка мусора (см. gc_media_store)
+    :param str path: Путь к директории публикации
+    :param str media_path: Путь к медиа-папке публикации
+    :param int workers: Количество потоков, по умолчанию settings.MEDIA_COPY_WORKERS
+    :param dict store_paths: Пути файлов в хранилище {путь к файлу в медиа-папке: путь к файлу в хранилище},
+        известные по предыдущему переносу (см. get_publication_store_paths); заполняется путями
+        всех файлов медиа-папки
+    :return: количество скопированных и удалённых файлов
+    :rtype: int, int
+    """
+    if workers is None:
+        workers = getattr(settings, 'MEDIA_COPY_WORKERS', 4)
+    if store_paths is None:
+        store_paths = {}
+    static_path = os.path.join(path, 'graphics')
+    files = []
+    for dir_path, dir_names, file_names in os.walk(static_path):
+        target_dir = os.path.normpath(os.path.join(media_path, os.path.relpath(dir_path, static_path)))
+        os.makedirs(target_dir, exist_ok=True)
+        for file in file_names:
+            files.append((os.path.join(dir_path, file), os.path.join(target_dir, file)))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = list(executor.map(lambda pair: sync_static_file(pair[0], pair[1], store_paths.get(pair[1])), files))
+    copied = 0
+    for (source, target), (file_copied, store_path) in zip(files, results):
+        copied += file_copied
+        store_paths[target] = store_path
+
+    actual = set(target for source, target in files)
+    for target in set(store_paths) - actual:
+        del store_paths[target]
+    removed = 0
+    for dir_path, dir_names, file_names in os.walk(media_path):
+        for file in file_names:
+            target = os.path.join(dir_path, file)
+            if target not in actual:
+                os.remove(target)
+                removed += 1
+
+    return copied, removed
+
+
+def get_category_paths(nodes):
+    """
+    Функция, вычисляющая для категорий путь от корня публикации, по которому
+    категории сопоставляются при повторной загрузке
+    :param dict nodes: {ключ узла: (ключ родителя, порядок, заголовок, является ли категорией)}
+    :return: {ключ категории: кортеж пар (заголовок, порядок) от корня}
+    :rtype: dict
+    """
+    paths = {}
+
+    def get_path(key):
+        if key not in paths:
+            parent, order, title, is_category = nodes[key]
+            paths[key] = (get_path(parent) if parent is not None else ()) + ((title, order),)
+        return paths[key]
+
+    for key, node in nodes.items():
+        if node[3]:
+            get_path(key)
+    return paths
+
+
+def update_publication(path, workers=None, lazy=None, summary=None):
+    """
+    Функция для загрузки нового выпуска уже загруженной публикации.
+    Заново разбираются и формируются только модули, файлы которых изменились (по хешу файла),
+    связи дерева пересоздаются только у изменившихся узлов, копируются только изменённые статические файлы.
+    Если публикация ещё не загружалась, выполняется обычная загрузка
+    :param str path: Путь к директории с файлом структуры публикации (PMC-...)
+    :param int workers: Количество процессов для разбора файлов модулей, по умолчанию settings.IMPORT_WORKERS
+    :param bool lazy: Не формировать содержание модулей при загрузке, по умолчанию settings.LAZY_MODULE_CONTENT
+    :param ImportSummary summary: Сводка для заполнения этапами загрузки, см. load_publication
+    :return: количество добавленных, изменённых, удалённых и неизменных модулей,
+        скопированных и удалённых статических файлов
+    :rtype: dict
+    :raises ValueError: ошибка при загрузке публикации
+    """
+    if summary is None:
+        summary = ImportSummary(path)
+    with summary.span('props') as span:
+        pub_file_path, file_name = get_publication_file(path)
+        pub_data = get_publication_props(pub_file_path)
+        publication = Publication.objects.filter(code=pub_data['code']).first()
+        summary.code = pub_data['code']
+        span.items = 1
+        span.bytes_read = os.path.getsize(pub_file_path)
+    if publication is None:
+        load_publication(path, bulk=True, workers=workers, lazy=lazy, summary=summary)
+        publication = Publication.objects.get(code=pub_data['code'])
+        return {
+            'added': publication.modules.filter(is_category=False).count(),
+            'changed': 0, 'removed': 0, 'unchanged': 0,
+            'static_copied': sum(len(files) for dir_path, dir_names, files in os.walk(get_publication_media_path(publication.media_key))),
+            'static_removed': 0,
+        }
+
+    with summary.span('dmc_load') as span:
+        old_links = list(PublicationModule.objects.filter(publication=publication).values_list(
+            'id', 'module_id', 'parent_id', 'order_in_parent',
+            'module__title', 'module__is_category', 'module__tech_name', 'module__issue_number', 'module__content_hash'
+        ))
+        known_hashes = {}
+        old_by_hash = defaultdict(list)
+        old_by_name = defaultdict(list)
+        old_nodes = {}
+        for link_id, module_id, parent_id, order, title, is_category, tech_name, issue_number, content_hash in old_links:
+            old_nodes[module_id] = (parent_id, order, title, is_category)
+            if not is_category:
+                known_hashes[content_hash] = (tech_name, issue_number)
+                old_by_hash[content_hash].append(module_id)
+                old_by_name[tech_name].append(module_id)
+        old_categories = {category_path: module_id for module_id, category_path in get_category_paths(old_nodes).items()}
+        # модули, которые используются и другими публикациями, не изменяются и не удаляются
+        shared = set(PublicationModule.objects.exclude(publication=publication)
+                     .filter(module__in=PublicationModule.objects.filter(publication=publication).values('module_id'))
+                     .values_list('module_id', flat=True))
+
+        modules_index, duplicates = load_modules_from_files(path, workers=workers, known_hashes=known_hashes)
+        span.items, span.bytes_read = get_files_size(path, 'DMC-')
+    with summary.span('tree_build') as span:
+        modules, links = collect_publication_nodes(pub_file_path, modules_index, duplicates)
+        new_nodes = {}
+        for module, parent, order in links:
+            new_nodes[module] = (parent, order, modules[module].title, modules[module].is_category)
+        new_categories = get_category_paths(new_nodes)
+
+        used = set()
+        inserts = []
+        updates = []
+        report = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+
+        def take(candidates):
+            for module_id in candidates:
+                if module_id not in used:
+                    used.add(module_id)
+                    return module_id
+
+        for i, module in enumerate(modules):
+            if module.is_category:
+                module.id = take([old_categories[new_categories[i]]] if new_categories[i] in old_categories else [])
+                if module.id is None:
+                    inserts.append(module)
+                continue
+            module.id = take(old_by_hash.get(module.content_hash, []))
+            if module.id is not None:
+                report['unchanged'] += 1
+                continue
+            module.id = take(old_by_name.get(module.tech_name, []))
+            if module.id is not None:
+                report['changed'] += 1
+                if module.id in shared:
+                    module.id = None
+                    inserts.append(module)
+                else:
+                    updates.append(module)
+            else:
+                inserts.append(module)
+                report['added'] += 1
+            if module.content_xml is None:
+                # файл не разбирался, так как совпадает с уже загруженным модулем
+                module.content_xml = Module.objects.filter(content_hash=module.content_hash)\
+                    .values_list('content_xml', flat=True).first()
+
+        removed_ids = set(old_nodes) - used
+        report['removed'] = sum(1 for module_id in removed_ids if not old_nodes[module_id][3])
+
+        existing = get_existing_modules(inserts)
+        with write_transaction():
+            last_id = Module.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            new_modules = []
+            for module in inserts:
+                key = (module.content_hash, module.tech_name, module.issue_number)
+                if not module.is_category and key in existing:
+                    module.id = existing[key]
+                    continue
+                last_id += 1
+                module.id = last_id
+                new_modules.append(module)
+            Module.objects.bulk_create(new_modules)
+            for module in updates:
+                Module.objects.filter(pk=module.id).update(
+                    tech_name=module.tech_name,
+                    title=module.title,
+                    issue_number=module.issue_number,
+                    file_name=module.file_name,
+                    content_xml=module.content_xml,
+                    content_hash=module.content_hash,
+                    content_json='',
+                    updated_at=timezone.now()
+                )
+            SearchTerm.objects.filter(module_id__in=[module.id for module in updates]).delete()
+            ModulePart.objects.filter(module_id__in=[module.id for module in updates]).delete()
+
+            # Связи пересоздаются только у родителей, список дочерних узлов которых изменился.
+            # Новые связи создаются в порядке документа, как при первой загрузке
+            new_children = defaultdict(list)
+            for module, parent, order in links:
+                new_children[modules[parent].id if parent is not None else None].append((modules[module].id, order))
+            old_children = defaultdict(list)
+            for link_id, module_id, parent_id, order, *rest in sorted(old_links, key=lambda link: (link[3], link[0])):
+                old_children[parent_id].append((module_id, order, link_id))
+            changed_parents = [
+                parent_id for parent_id in set(new_children) | set(old_children)
+                if new_children[parent_id] != [(module_id, order) for module_id, order, link_id in old_children[parent_id]]
+            ]
+            PublicationModule.objects.filter(id__in=[
+                link_id for parent_id in changed_parents for module_id, order, link_id in old_children[parent_id]
+            ]).delete()
+            PublicationModule.objects.bulk_create([
+                PublicationModule(module_id=module_id, publication=publication, parent_id=parent_id, order_in_parent=order)
+                for parent_id in changed_parents for module_id, order in new_children[parent_id]
+            ])
+            Module.objects.filter(id__in=removed_ids - shared).delete()
+
+            publication.title = pub_data['title']
+            publication.file_name = os.path.splitext(file_name)[0]
+            publication.issue_number = pub_data['issue_number']
+            publication.content_xml = pub_data['content_xml']
+            publication.structure_json = get_tree_structure(publication)
+            publication.content_hash = get_content_hash(publication.structure_json.encode('utf-8'))
+            publication.save()
+        span.items = len(links)
+
+    with summary.span('static_copy') as span:
+        media_path = get_publication_media_path(publication.media_key)
+        old_index = get_publication_media_index(publication.media_key)
+        if old_index is None:
+            old_index = get_media_index(media_path)
+        store_paths = get_publication_store_paths(publication.media_key)
+        report['static_copied'], report['static_removed'] = sync_static(path, media_path, store_paths=store_paths)
+        media_index = get_media_index(media_path, store_paths)
+        span.items, span.bytes_read = get_files_size(media_path)
+    with summary.span('image_derivatives') as span:
+        old_derivatives = get_publication_derivatives(publication.media_key)
+        derivatives = build_publication_derivatives(publication.media_key, media_index)
+        save_publication_media_index(publication.media_key, media_index, store_paths)
+        # изменённые и новые модули, содержание которых сформировано по запросу до записи манифеста,
+        # ссылаются на прежние изображения, поэтому их содержание сбрасывается после его записи
+        query = Q(id__in=[module.id for module in inserts + updates])
+        stale = [
+            json.dumps(old_index[name]) for name in set(old_index) | set(old_derivatives) | set(derivatives)
+            if name in old_index and (old_index[name] != media_index.get(name) or
+                                      old_derivatives.get(name) != derivatives.get(name))
+        ]
+        if stale:
+            # неизменённые модули с изменившимися изображениями (другой путь в хранилище) формируются заново
+            stale_query = Q()
+            for src in stale:
+                stale_query |= Q(content_json__contains=src)
+            query |= stale_query & Q(id__in=set(old_nodes) - shared)
+        Module.objects.filter(query).exclude(content_json='').update(content_json='', updated_at=timezone.now())
+        span.items = len(derivatives)
+
+    if lazy is None:
+        lazy = getattr(settings, 'LAZY_MODULE_CONTENT', False)
+    if not lazy:
+        with summary.span('module_parse') as span:
+            span.items = parce_modules(publication, media_index, derivatives)
+    with summary.span('search_index') as span:
+        span.items = index_modules(Module.objects.filter(id__in=[module.id for module in inserts + updates]))
+    bump_generation(publication)
+
+    logger.info('publication %s updated: %s', publication.code, report)
+    return report
+
+
+def delete_retired_publications(min_age=60):
+    """
+    Функция, удаляющая версии публикаций, заменённые новыми загрузками (см. publish_publication)
+    :param int min_age: Минимальное время с момента замены в секундах
+    :return: количество удалённых версий
+    :rtype: int
+    """
+    codes = list(Publication.objects.filter(
+        staging=True, generation__gt=0, updated_at__lte=timezone.now() - timedelta(seconds=min_age)
+    ).values_list('code', flat=True))
+    return sum(1 for code in codes if delete_publication(code))
+
+
+def delete_publication(publication_code):
+    """
+    Функция, удаляющая публикацию вместе с модулями, которые не используются другими публикациями,
+    её медиа-папкой и манифестом производных изображений. Содержание оставшихся общих модулей,
+    ссылающееся на медиа-папку публикации, сбрасывается и формируется заново (см. ensure_module_content),
+    а номер загрузки увеличивается, чтобы кеш ответов API не отдавал прежнее содержание.
+    Файлы хранилища медиа-файлов удаляются позже сборкой мусора, см. gc_media_store
+    :param str publication_code: Код публикации
+    :return: публикация найдена и удалена
+    :rtype: bool
+    """
+    publication = Publication.objects.filter(code=publication_code).first()
+    if publication is None:
+        return False
+    media_path = get_publication_media_path(publication.media_key)
+    with write_transaction():
+        modules = Module.objects.filter(id__in=PublicationModule.objects.filter(publication=publication).values('module_id'))
+        shared = PublicationModule.objects.exclude(publication=publication).values('module_id')
+        # до удаления: удаление категорий каскадно удаляет связи публикации с дочерними модулями
+        reset = list(modules.filter(
+            id__in=shared, content_json__contains=json.dumps(get_media_url(media_path) + '/')[1:-1]
+        ).values_list('id', flat=True))
+        modules.exclude(id__in=shared).delete()
+        publication.delete()
+        if reset:
+            Module.objects.filter(id__in=reset).update(content_json='', updated_at=timezone.now())
+            owner = Publication.objects.filter(
+                generation__gt=0, id__in=PublicationModule.objects.filter(module_id__in=reset).values('publication_id')
+            ).order_by('staging', '-generation').first()
+            if owner is not None:
+                bump_generation(owner)
+    shutil.rmtree(media_path, ignore_errors=True)
+    for manifest_path in (get_manifest_path(publication.media_key), get_media_manifest_path(publication.media_key)):
+        try:
+            os.remove(manifest_path)
+        except FileNotFoundError:
+            pass
+    logger.info('publication %s deleted', publication_code)
     return True
 
 
@@ -470,7 +1927,6 @@ from core.utils import *
 Publication.objects.all().delete()
 Module.objects.all().delete()
 PublicationModule.objects.all().delete()
-TempModule.objects.all().delete()
 
 #home
 shutil.rmtree('/home/denis/projects/tgws-serv/tgws_serv/media/pub_files/3204-A-00-0-0-00-00-A-022-A-D')
@@ -484,7 +1940,7 @@ load_publication('/home/denis/projects/tgws_serv/assets/pubs/ПАЗ-320445 Ве
 from core.utils import *
 publication = Publication.objects.all()[0]
 MEDIA_PATH = os.path.join(settings.MEDIA_ROOT, 'pub_files', publication.code)
-parce_modules(publication, MEDIA_PATH)
+parce_modules(publication, get_media_index(MEDIA_PATH))
 
 """
 
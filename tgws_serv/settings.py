@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -82,9 +83,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # parallel import jobs wait for each other's write transactions instead of failing
+        'OPTIONS': {'timeout': 60},
     }
 }
 
+# SQLite journal mode set on every connection (core.apps): in WAL mode API reads are not blocked by imports
+SQLITE_JOURNAL_MODE = 'wal'
+
 TEMPLATE_DIRS = (
     os.path.join(os.path.dirname(__file__), 'templates').replace('\\','/'),
 )
@@ -146,4 +152,83 @@ CORS_ORIGIN_WHITELIST = (
 
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-MEDIA_URL = '/media/'
\ No newline at end of file
+MEDIA_URL = '/media/'
+# Serve MEDIA_URL from Django (api/media/..., see api.media.serve_media). Leave off when the web server
+# serves MEDIA_ROOT directly
+MEDIA_SERVE = DEBUG
+# Internal publication manifests (media index, store paths, derivatives); keep outside MEDIA_ROOT so the
+# web server does not expose them. Default MEDIA_ROOT/derived/manifests, which serve_media refuses
+MEDIA_MANIFESTS_ROOT = os.path.join(BASE_DIR, 'manifests')
+# Hand media files off to the web server: None, 'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect' (nginx)
+MEDIA_SENDFILE = None
+# nginx internal location aliased to MEDIA_ROOT, used with MEDIA_SENDFILE = 'x-accel-redirect'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Cache-Control max-age (seconds) of media files without a content hash in the path
+MEDIA_MAX_AGE = 3600
+
+
+# Publication import
+# Number of worker processes used to parse data module (DMC-...) files
+IMPORT_WORKERS = 1
+# PMC/DMC files of this size (bytes) or larger are parsed incrementally with iterparse
+IMPORT_STREAMING_THRESHOLD = 10 * 1024 * 1024
+# Codec used to compress stored XML: 'zlib', 'bz2', 'lzma' or one added with core.fields.register_codec
+CONTENT_XML_CODEC = 'zlib'
+# Content-addressed media store (default MEDIA_ROOT/store); publication media folders hardlink into it.
+# Must be inside MEDIA_ROOT: store paths are served as media URLs and hardlinks need the same filesystem
+MEDIA_STORE_ROOT = None
+# Seconds between removals of unreferenced store files by import_worker (None disables; see gc_media_store command)
+MEDIA_STORE_GC_INTERVAL = 3600
+# Number of threads used to hash and copy publication graphics
+MEDIA_COPY_WORKERS = 4
+# Generate previews and tiles of large illustrations at import (requires Pillow, skipped without it)
+IMAGE_DERIVATIVES = True
+# Folder for previews and tiles (default MEDIA_ROOT/derived)
+IMAGE_DERIVATIVES_ROOT = None
+# Largest side (px) of a preview; only larger images get derivatives
+IMAGE_PREVIEW_SIZE = 1024
+# Images with the largest side above IMAGE_TILE_THRESHOLD (px) are also cut into IMAGE_TILE_SIZE tiles
+IMAGE_TILE_SIZE = 512
+IMAGE_TILE_THRESHOLD = 4096
+# Largest image (width * height) that gets derivatives; decoding takes up to 4 bytes per pixel.
+# Pillow refuses images above 2 * PIL.Image.MAX_IMAGE_PIXELS (178956970 by default) in any case
+IMAGE_MAX_PIXELS = 178956970
+# Number of processes used to build image derivatives
+IMAGE_WORKERS = 1
+# Render Module.content_json on first request instead of during import
+LAZY_MODULE_CONTENT = False
+# Seconds a publication version replaced by a new import stays readable before it is deleted
+# (clients may keep its structure for API_CACHE_MAX_AGE)
+IMPORT_RETIRED_TTL = 60
+# Number of publications imported in parallel by the import_worker command
+IMPORT_JOB_PROCESSES = 2
+# Seconds a running import job may take to stop at the next stage after cancellation before it is killed
+IMPORT_JOB_CANCEL_TIMEOUT = 60
+
+
+# API
+# Cache-Control max-age (seconds) for publication_detail and module_detail responses
+API_CACHE_MAX_AGE = 60
+# Return structure_json/content_json as nested JSON objects instead of strings (per request: ?nested=1)
+API_NESTED_JSON = False
+# Size limit (bytes) of the in-process API response cache
+API_RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+# Optional django cache alias used as the second cache level
+API_RESPONSE_CACHE_ALIAS = None
+# Seconds a process reuses the latest import generation in module response cache keys;
+# imports made by other processes are served after at most this delay
+API_GENERATION_TTL = 1
+# JSON responses of this size (bytes) or larger are compressed with brotli (if installed) or gzip
+API_COMPRESS_MIN_SIZE = 16 * 1024
+# Max number of modules returned by one module_batch request
+API_MODULE_BATCH_SIZE = 100
+# Default and max page size of the search endpoint
+API_SEARCH_PAGE_SIZE = 20
+API_SEARCH_MAX_PAGE_SIZE = 100
+# Max number of catalog items returned by the part lookup endpoint
+API_PART_LOOKUP_LIMIT = 100
+# Collect per-route request metrics exported on /metrics
+API_METRICS_ENABLED = True
+# Addresses and networks (besides staff users) allowed to read /metrics, e.g. ['10.0.0.0/8'].
+# REMOTE_ADDR is checked, so behind a reverse proxy restrict /metrics on the proxy instead
+API_METRICS_ALLOWED_IPS = []